@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+
+#
+# ツリーの形とノード数を変えながら、レイアウト計算と二分探索木の操作の所要時間を計測する
+#
+# ツリーの形
+#   random      各ノードが、それより前に作られたノードの中から無作為に選んだノードの子になるツリー
+#   kary        全てのノードがK_ARY個の子を持つ完全K分木
+#   chain       子を一つだけ持つノードが一直線に連なったツリー
+#   star        ルートに全てのノードがぶら下がったツリー
+#   caterpillar 背骨となるノードの列に、それぞれ末端ノードが一つずつぶら下がったツリー
+#
+# 二分探索木に追加するキーの順序
+#   bst-random  無作為な順序
+#   bst-sorted  昇順、一直線のツリーになる
+#
+# ノード数ごとの所要時間から、両対数グラフでの傾き（計算量の指数）を最小二乗法で求める。
+# 傾きが想定した指数にTOLERANCEを加えた値を超えたら、計算量が悪化したとみなして終了コード1を返す。
+# 各サイズはREPEAT回計測した最速値を使い、MIN_FIT_TIME以上の点がMIN_FIT_POINTS個に満たなければ判定しない。
+#
+
+import gc
+import math
+import random
+import sys
+import time
+
+from tree_layout import TreeNode, preorder, postorder, iter_levels, calc_tree_position
+
+import binary_search_tree
+import binary_search_tree_layout
+import binary_search_tree_set
+
+
+def create_chain_tree(num_nodes: int) -> TreeNode:
+    """num_nodes個のノードが一直線に連なったツリーを作成する
+
+    コンストラクタの入れ子で作ると再帰が深くなるので、末端から順に作る
+    """
+    node = TreeNode(f"n{num_nodes - 1}")
+    for i in range(num_nodes - 2, -1, -1):
+        node = TreeNode(f"n{i}", node)
+    return node
+
+
+def create_caterpillar_tree(num_nodes: int) -> TreeNode:
+    """背骨の各ノードに末端ノードを一つずつぶら下げたツリーを作成する
+
+    背骨の長さはおよそnum_nodes/2になる
+    """
+    spine_length = max(num_nodes // 2, 1)
+    node = TreeNode(f"s{spine_length - 1}")
+    for i in range(spine_length - 2, -1, -1):
+        node = TreeNode(f"s{i}", TreeNode(f"l{i}"), node)
+    return node
+
+
+def create_random_tree(num_nodes: int, seed: int = 0) -> TreeNode:
+    """各ノードを、それより前に作ったノードから無作為に選んだノードの子にする
+
+    深さの期待値はO(log n)になる
+    """
+    rng = random.Random(seed)
+    nodes = [TreeNode("n0")]
+    for i in range(1, num_nodes):
+        node = TreeNode(f"n{i}")
+        parent = nodes[rng.randrange(i)]
+        node.parent = parent
+        parent.children.append(node)
+        nodes.append(node)
+    return nodes[0]
+
+
+# 完全K分木の子の数
+K_ARY = 3
+
+
+def create_kary_tree(num_nodes: int, k: int = K_ARY) -> TreeNode:
+    """BFS順に子をk個ずつ割り当てて、完全k分木を作成する"""
+    nodes = [TreeNode(f"n{i}") for i in range(num_nodes)]
+    for i in range(1, num_nodes):
+        parent = nodes[(i - 1) // k]
+        nodes[i].parent = parent
+        parent.children.append(nodes[i])
+    return nodes[0]
+
+
+def create_star_tree(num_nodes: int) -> TreeNode:
+    """ルートに num_nodes - 1 個の末端ノードをぶら下げる"""
+    return TreeNode("root", *[TreeNode(f"n{i}") for i in range(1, num_nodes)])
+
+
+def create_random_keys(num_nodes: int, seed: int = 0) -> list:
+    return random.Random(seed).sample(range(num_nodes * 10), num_nodes)
+
+
+def create_sorted_keys(num_nodes: int) -> list:
+    return list(range(num_nodes))
+
+
+def create_binary_search_tree(keys: list, module=binary_search_tree_layout):
+    """キーを順に追加した二分探索木を作成する
+
+    レイアウト計算には binary_search_tree_layout、削除には binary_search_tree のノードを使う
+    """
+    root = None
+    for key in keys:
+        root = module.insert_binary_tree(root, key)
+    return root
+
+
+def create_sorted_layout_tree(num_nodes: int):
+    """昇順に追加したのと同じ、右の子だけが一直線に連なったツリーをO(n)で作る"""
+    nodes = [binary_search_tree_layout.BinaryTreeNode(key) for key in range(num_nodes)]
+    for parent, child in zip(nodes, nodes[1:]):
+        parent.right = child
+    return nodes[0]
+
+
+def delete_all(root, keys: list):
+    for key in keys:
+        root = binary_search_tree.delete_binary_tree(root, key)
+    return root
+
+
+def create_sized_tree(keys: list):
+    root = None
+    for key in keys:
+        root = binary_search_tree.insert_binary_tree(root, key, node_class=binary_search_tree.SizedTreeNode)
+    return root
+
+
+def rank_all(root, keys: list):
+    for key in keys:
+        binary_search_tree.rank_binary_tree(root, key)
+
+
+def select_all(root, size: int):
+    for i in range(size):
+        binary_search_tree.select_binary_tree(root, i)
+
+
+def walk_cursor(root):
+    cursor = binary_search_tree.BinaryTreeCursor(root)
+    node = cursor.first()
+    while node is not None:
+        node = cursor.next()
+
+
+def create_avl_tree(keys: list):
+    root = None
+    for key in keys:
+        root = binary_search_tree.insert_avl_tree(root, key)
+    return root
+
+
+def delete_all_avl(root, keys: list):
+    for key in keys:
+        root = binary_search_tree.delete_avl_tree(root, key)
+    return root
+
+
+def create_avl_tree_pair(num_nodes: int) -> tuple:
+    """無作為な値を半分ずつ持つ二つのAVL木を作る"""
+    keys = create_random_keys(num_nodes)
+    return (binary_search_tree.build_binary_tree(sorted(keys[0::2]), node_class=binary_search_tree.AVLTreeNode),
+            binary_search_tree.build_binary_tree(sorted(keys[1::2]), node_class=binary_search_tree.AVLTreeNode))
+
+
+def create_compact_tree(shape: str, num_nodes: int):
+    # numpyの読み込みに時間がかかるので、使うときだけimportする
+    from compact_tree import CompactTree
+    return CompactTree.from_tree_node(TREE_SHAPES[shape](num_nodes))
+
+
+def finalize_compact(tree):
+    import numpy as np
+    from compact_tree import accumulate_ancestors_bfs, calc_x_finalize_compact, calc_y_compact
+    accumulate_ancestors_bfs(tree.parent, tree.child_offsets, np.ones(len(tree), dtype=np.int32), tree.depth)
+    calc_y_compact(tree)
+    calc_x_finalize_compact(tree)
+
+
+def measure(func, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def consume(iterator):
+    for _ in iterator:
+        pass
+
+
+TREE_SHAPES = {
+    'random': create_random_tree,
+    'kary': create_kary_tree,
+    'chain': create_chain_tree,
+    'star': create_star_tree,
+    'caterpillar': create_caterpillar_tree,
+}
+
+KEY_ORDERS = {
+    'bst-random': create_random_keys,
+    'bst-sorted': create_sorted_keys,
+}
+
+SIZES = [10 ** 2, 3 * 10 ** 2, 10 ** 3, 3 * 10 ** 3, 10 ** 4, 3 * 10 ** 4,
+         10 ** 5, 3 * 10 ** 5, 10 ** 6]
+
+# 一回の計測がこの秒数を超えたら、それより大きなサイズは計測しない
+TIME_BUDGET = 5.0
+
+# この秒数より短い計測は誤差が大きいので、指数の推定に使わない
+MIN_FIT_TIME = 0.02
+
+# 指数の推定に必要な点の数、これより少なければ判定しない
+MIN_FIT_POINTS = 3
+
+# 一つのサイズを計測する回数、最も速かった回を使う
+REPEAT = 3
+
+# 想定した指数からの許容幅
+# Pythonではメモリ割り当てやキャッシュの影響でO(n)でも傾きが1.3程度になることがある
+# O(n log n)もこの範囲に収まり、O(n^1.5)以上への悪化は検出できる
+TOLERANCE = 0.5
+
+# 昇順に追加した二分探索木は一直線になるので、どの操作もO(n^2)かかる
+# inorder()は再帰で実装されているので、再帰も深くなる
+SORTED_BST_LIMIT = 3_000
+
+# classicはツリーの形によってはO(n^2)になるので、大きなサイズでは計測しない
+CLASSIC_LIMIT = 10_000
+
+# 集合演算を並列に計算する場合のプロセス数
+PARALLEL_WORKERS = 4
+
+
+class Case:
+
+    def __init__(self, name: str, setup, run, exponent: float, max_size: int = SIZES[-1]):
+        """計測する処理
+
+        Args:
+            name (str): 表示名
+            setup (_type_): ノード数を受け取り、runに渡す引数を作る（計測しない）
+            run (_type_): setupの戻り値を受け取って計測対象の処理を実行する
+            exponent (float): 想定している計算量の指数
+            max_size (int, optional): 計測する最大のノード数. Defaults to SIZES[-1].
+        """
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.exponent = exponent
+        self.max_size = max_size
+
+
+def create_cases() -> list:
+    cases = []
+
+    for shape, create_tree in TREE_SHAPES.items():
+        cases.append(Case(f"preorder/{shape}", create_tree, lambda t: consume(preorder(t)), 1))
+        cases.append(Case(f"postorder/{shape}", create_tree, lambda t: consume(postorder(t)), 1))
+        cases.append(Case(f"buchheim/{shape}", create_tree,
+                          lambda t: calc_tree_position(t, engine="buchheim"), 1))
+        cases.append(Case(f"levels/{shape}", create_tree, lambda t: consume(iter_levels(t)), 1))
+        cases.append(Case(f"parallel/{shape}", create_tree,
+                          lambda t: calc_tree_position(t, engine="parallel"), 1))
+
+    # classicは兄弟ごとに左側の兄弟全ての輪郭と比べるので、兄弟が多いstarと、深いサブツリーを兄弟に持つcaterpillarでO(n^2)になる
+    cases.append(Case("classic/random", create_random_tree, calc_tree_position, 1, CLASSIC_LIMIT))
+    cases.append(Case("classic/kary", create_kary_tree, calc_tree_position, 1, CLASSIC_LIMIT))
+    cases.append(Case("classic/star", create_star_tree, calc_tree_position, 2, CLASSIC_LIMIT))
+    cases.append(Case("classic/chain", create_chain_tree, calc_tree_position, 1, CLASSIC_LIMIT))
+    cases.append(Case("classic/caterpillar", create_caterpillar_tree, calc_tree_position, 2, CLASSIC_LIMIT))
+
+    # 配列演算によるmodの伝搬と深さの計算、chainはpointer jumpingになるのでO(n log n)
+    for shape in ['random', 'chain']:
+        cases.append(Case(f"finalize_compact/{shape}", lambda n, shape=shape: create_compact_tree(shape, n),
+                          finalize_compact, 1))
+
+    # memoは輪郭を共有するので、形が全て異なるchainやcaterpillarでもO(n)
+    for shape in ['random', 'kary', 'star', 'chain', 'caterpillar']:
+        cases.append(Case(f"memo/{shape}", TREE_SHAPES[shape], lambda t: calc_tree_position(t, engine="memo"), 1))
+
+    for order, create_keys in KEY_ORDERS.items():
+        max_size = SORTED_BST_LIMIT if order == 'bst-sorted' else SIZES[-1]
+
+        # 昇順に追加すると一直線になるので、一回の操作がO(n)、全体でO(n^2)になる
+        exponent = 2 if order == 'bst-sorted' else 1
+
+        def setup_layout_tree(n, create_keys=create_keys):
+            return create_binary_search_tree(create_keys(n))
+
+        def setup_search_tree(n, create_keys=create_keys):
+            return create_binary_search_tree(create_keys(n), binary_search_tree)
+
+        def setup_delete(n, create_keys=create_keys):
+            # 追加したのとは別の順序で削除する
+            keys = create_keys(n)
+            delete_order = keys[:]
+            random.Random(1).shuffle(delete_order)
+            return create_binary_search_tree(keys, binary_search_tree), delete_order
+
+        cases.append(Case(f"insert/{order}", create_keys, create_binary_search_tree, exponent, max_size))
+        cases.append(Case(f"delete/{order}", setup_delete, lambda args: delete_all(*args), exponent, max_size))
+
+        # 輪郭はスレッドで辿るので、一直線のツリーでもO(n)
+        # 昇順のツリーは追加に時間がかかるので、ノードを直接つないで作る
+        setup = create_sorted_layout_tree if order == 'bst-sorted' else setup_layout_tree
+        cases.append(Case(f"reingold_tilford/{order}", setup, binary_search_tree_layout.reingold_tilford, 1))
+
+        # yield fromを入れ子にしたジェネレータなので、ノードごとに深さ分のコストがかかる
+        cases.append(Case(f"inorder/{order}", setup_search_tree,
+                          lambda t: consume(binary_search_tree.inorder(t)), exponent, max_size))
+
+        cases.append(Case(f"iter_range/{order}", setup_search_tree,
+                          lambda t: consume(binary_search_tree.iter_range(t)), 1, max_size))
+        cases.append(Case(f"cursor/{order}", setup_search_tree, walk_cursor, 1, max_size))
+        cases.append(Case(f"level_order/{order}", setup_search_tree,
+                          lambda t: consume(binary_search_tree.level_order(t)), 1, max_size))
+
+        # サブツリーのノード数を更新するオーバーヘッドは insert/delete と比べる
+        def setup_sized_delete(n, create_keys=create_keys):
+            keys = create_keys(n)
+            delete_order = keys[:]
+            random.Random(1).shuffle(delete_order)
+            return create_sized_tree(keys), delete_order
+
+        def setup_sized_queries(n, create_keys=create_keys):
+            keys = create_keys(n)
+            return create_sized_tree(keys), keys
+
+        cases.append(Case(f"insert_sized/{order}", create_keys, create_sized_tree, exponent, max_size))
+        cases.append(Case(f"delete_sized/{order}", setup_sized_delete, lambda args: delete_all(*args), exponent, max_size))
+        cases.append(Case(f"rank/{order}", setup_sized_queries, lambda args: rank_all(*args), exponent, max_size))
+        cases.append(Case(f"select/{order}", setup_sized_queries,
+                          lambda args: select_all(args[0], len(args[1])), exponent, max_size))
+
+        # AVL木は並び順によらず高さがO(log n)になる
+        def setup_avl_delete(n, create_keys=create_keys):
+            keys = create_keys(n)
+            delete_order = keys[:]
+            random.Random(1).shuffle(delete_order)
+            return create_avl_tree(keys), delete_order
+
+        cases.append(Case(f"insert_avl/{order}", create_keys, create_avl_tree, 1))
+
+        # 整列済みならO(n)、そうでなければ整列のO(n log n)が加わる
+        cases.append(Case(f"bulk_load/{order}", create_keys, binary_search_tree.build_binary_tree_unsorted, 1))
+        cases.append(Case(f"delete_avl/{order}", setup_avl_delete, lambda args: delete_all_avl(*args), 1))
+
+    # 件数の分からないジェネレータからの構築
+    cases.append(Case("bulk_load_stream/bst-sorted", lambda n: n,
+                      lambda n: binary_search_tree.build_binary_tree(i for i in range(n)), 1))
+
+    # joinとsplitによる集合演算、プロセスプールを使わない場合
+    for operation in ['union', 'intersection', 'difference']:
+        func = getattr(binary_search_tree_set, operation)
+        cases.append(Case(f"{operation}/bst-random", create_avl_tree_pair,
+                          lambda args, func=func: func(*args, workers=1), 1))
+
+    # プロセスプールを使う場合、値の受け渡しとツリーの作り直しの分だけ遅くなるのを上と比べる
+    # 閾値を0にして、小さいサイズでも並列の経路を通す
+    for operation in ['union', 'intersection', 'difference']:
+        func = getattr(binary_search_tree_set, operation)
+        cases.append(Case(f"{operation}_parallel/bst-random", create_avl_tree_pair,
+                          lambda args, func=func: func(*args, workers=PARALLEL_WORKERS, parallel_threshold=0), 1))
+
+    return cases
+
+
+def fit_exponent(results: list) -> float:
+    """(ノード数, 秒数)のリストから、両対数での傾きを最小二乗法で求める
+
+    短すぎる計測は除外し、点がMIN_FIT_POINTS個未満ならNoneを返す
+    """
+    points = [(math.log(size), math.log(t)) for size, t in results if t >= MIN_FIT_TIME]
+    if len(points) < MIN_FIT_POINTS:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    sxx = sum((x - mean_x) ** 2 for x, _ in points)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    return sxy / sxx if sxx > 0 else None
+
+
+def run_case(case: Case, sizes: list, time_budget: float = TIME_BUDGET, repeat: int = REPEAT) -> list:
+    """ノード数を増やしながら計測する
+
+    一回の計測は他のプロセスの影響を受けやすいので、サイズごとにrepeat回計測して最も速かった回を使う
+    runは引数を書き換えることがあるので、計測ごとにsetupし直す
+
+    Returns:
+        list: (ノード数, 秒数)のリスト
+    """
+    results = []
+    for size in sizes:
+        if size > case.max_size:
+            break
+
+        best = None
+        for _ in range(repeat):
+            args = case.setup(size)
+
+            # ガベージコレクタが計測の途中で動くと、ノード数に比例しない時間がかかる
+            gc.collect()
+            gc.disable()
+            try:
+                t = measure(case.run, args)
+            finally:
+                gc.enable()
+
+            del args
+            if best is None or t < best:
+                best = t
+            # 予算を超える計測は繰り返さない
+            if t > time_budget:
+                break
+
+        results.append((size, best))
+        if best > time_budget:
+            break
+    return results
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="scaling benchmark for tree layout and binary search tree")
+    parser.add_argument('--max-size', type=int, default=SIZES[-1], help="largest number of nodes")
+    parser.add_argument('--budget', type=float, default=TIME_BUDGET,
+                        help="stop growing a case after one run takes longer than this (seconds)")
+    parser.add_argument('--repeat', type=int, default=REPEAT, help="runs per size, the fastest one is used")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="allowed excess over the expected exponent")
+    parser.add_argument('--only', default=None, help="run cases whose name contains this string")
+    args = parser.parse_args(argv)
+
+    # 再帰で実装された処理を一直線のツリーで計測するため
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), SORTED_BST_LIMIT * 4))
+
+    sizes = [size for size in SIZES if size <= args.max_size]
+
+    failed = []
+    print(f"{'case':<28} {'nodes':>8} {'seconds':>10}")
+    for case in create_cases():
+        if args.only and args.only not in case.name:
+            continue
+
+        results = run_case(case, sizes, args.budget, max(1, args.repeat))
+        for size, t in results:
+            print(f"{case.name:<28} {size:>8} {t:10.4f}")
+
+        exponent = fit_exponent(results)
+        limit = case.exponent + args.tolerance
+        if exponent is None:
+            # 判定できるだけの点がないときは失敗にしない
+            status = "insufficient data"
+        elif exponent > limit:
+            status = "FAIL"
+            failed.append(case.name)
+        else:
+            status = "ok"
+        fitted = f"{exponent:.2f}" if exponent is not None else "-"
+        print(f"{case.name:<28} exponent {fitted} (expected {case.exponent}, limit {limit:.2f}) {status}")
+        sys.stdout.flush()
+
+    if failed:
+        print(f"asymptotic regression: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,6 +25,9 @@
 
 import sys
 
+from collections import deque
+from itertools import groupby
+
 class BinaryTreeNode:
     """二分探索木のノードクラス
     """
@@ -40,24 +43,55 @@ class BinaryTreeNode:
         return self
 
 
-def insert_binary_tree(root, data) -> BinaryTreeNode:
+def insert_binary_tree(root, data, node_class=BinaryTreeNode) -> BinaryTreeNode:
     """二分探索木に新たなノードを追加する
+
+    再帰を使わずにループで追加先を探すので、ツリーが深くても再帰の上限に達しない。
+    変更するのは追加先の親ノードだけ。
+    ただしSizedTreeNodeのようにsizeを持つノードであれば、経路上のノードのsizeも更新する。
+
+    Args:
+        root (_type_): 頂点
+        data (_type_): 追加する値
+        node_class (_type_, optional): rootがNoneのときに作成するノードのクラス、
+                                       それ以外はrootと同じクラスのノードを追加する. Defaults to BinaryTreeNode.
     """
     # rootがNoneの場合、新しいノードを作成して返す
     # これがツリーの頂点になる
     if root is None:
-        root = BinaryTreeNode(data)
+        root = node_class(data)
         return root
 
-    if data == root.data:
-        # 同じ値の場合は何もしない（追加できない）
-        return root
-    elif data < root.data:
-        # 渡された値が小さければ左のサブツリーに追加し、
-        root.left = insert_binary_tree(root.left, data)
-    else:
-        # そうでなければ右のサブツリーに追加
-        root.right = insert_binary_tree(root.right, data)
+    node_class = type(root)
+
+    # sizeを更新するために、辿った経路を覚えておく
+    path = [] if hasattr(root, 'size') else None
+
+    current = root
+    while True:
+        if data == current.data:
+            # 同じ値の場合は何もしない（追加できない）
+            return root
+
+        if path is not None:
+            path.append(current)
+
+        if data < current.data:
+            # 渡された値が小さければ左のサブツリーに追加し、
+            if current.left is None:
+                current.left = node_class(data)
+                break
+            current = current.left
+        else:
+            # そうでなければ右のサブツリーに追加
+            if current.right is None:
+                current.right = node_class(data)
+                break
+            current = current.right
+
+    if path is not None:
+        for node in path:
+            node.size += 1
 
     return root
 
@@ -65,40 +99,65 @@ def insert_binary_tree(root, data) -> BinaryTreeNode:
 def delete_binary_tree(root: BinaryTreeNode, data: object) -> BinaryTreeNode:
     """二分探索木から指定された値のノードを削除する
 
+    再帰を使わずにループで削除対象を探す。
+    変更するのは削除するノードの親と、子を二つ持つ場合に昇格させるノードの周辺だけ。
+    ただしsizeを持つノードであれば、経路上のノードのsizeも更新する。
+
     Args:
         root (_type_): _description_
         data (_type_): _description_
 
     Returns:
-        _type_: _description_
+        _type_: 新しい頂点、頂点を削除した場合は変わる
     """
-    if root is None:
+    # sizeを更新するために、辿った経路を覚えておく
+    path = [] if hasattr(root, 'size') else None
+
+    # 削除対象のノードとその親を探す
+    parent = None
+    node = root
+    while node is not None and data != node.data:
+        if path is not None:
+            path.append(node)
+        parent = node
+        # 削除すべきデータが現在のノードの値より小さい場合は左のサブツリーを、大きい場合は右のサブツリーを探索する
+        node = node.left if data < node.data else node.right
+
+    if node is None:
+        # 見つからなければ何もしない
         return root
 
-    if data < root.data:
-        # 削除すべきデータが現在のノードの値より小さい場合は左のサブツリーを探索し、
-        root.left = delete_binary_tree(root.left, data)
-    elif data > root.data:
-        # 削除すべきデータが現在のノードの値より大きい場合は右のサブツリーを探索し、
-        root.right = delete_binary_tree(root.right, data)
+    if node.left is not None and node.right is not None:
+        # 子を二つ持つ場合は、左サブツリーの最大値をここに昇格させる
+        # 最大値のノードは右の子を持たないので、その左の子を親につなぎ替えれば取り除ける
+        if path is not None:
+            path.append(node)
+        max_parent = node
+        max_node = node.left
+        while max_node.right is not None:
+            if path is not None:
+                path.append(max_node)
+            max_parent = max_node
+            max_node = max_node.right
+
+        node.data = max_node.data
+        if max_parent is node:
+            max_parent.left = max_node.left
+        else:
+            max_parent.right = max_node.left
     else:
-        # 削除すべきデータがルートノードの値であれば、このノード自身が削除対象
-        if root.left is None:
-            temp = root.right
-            root = None
-            return temp
-        elif root.right is None:
-            temp = root.left
-            root = None
-            return temp
-
-        # 左サブツリーの最大値をここに昇格させる
-        root.data = find_max_node(root.left).data
-        root.left = delete_binary_tree(root.left, root.data)
-
-        # もしくは、右サブツリーの最小値をここに昇格させる方法でもよい
-        # root.data = find_min_node(root.right).data
-        # root.right = delete_binary_tree(root.right, root.data)
+        # 子が一つ以下の場合は、その子を親につなぎ替える
+        child = node.left if node.left is not None else node.right
+        if parent is None:
+            root = child
+        elif parent.left is node:
+            parent.left = child
+        else:
+            parent.right = child
+
+    if path is not None:
+        for n in path:
+            n.size -= 1
 
     return root
 
@@ -117,6 +176,416 @@ def find_max_node(root: BinaryTreeNode):
     return current
 
 
+def find_binary_tree(root: BinaryTreeNode, data: object) -> BinaryTreeNode:
+    """二分探索木から指定された値のノードを探す
+
+    AVLTreeNodeのツリーにも使える
+
+    Returns:
+        BinaryTreeNode: 見つからなければNone
+    """
+    current = root
+    while current is not None:
+        if data == current.data:
+            return current
+        current = current.left if data < current.data else current.right
+    return None
+
+
+#
+# AVL木
+#
+# insert_binary_tree()とdelete_binary_tree()は木の形を整えないので、昇順に並んだ値を追加すると一直線になってしまう。
+# AVL木は左右のサブツリーの高さの差が1以下になるように、追加・削除のたびに回転させて形を整える。
+# 高さは常にO(log n)になるので、追加・削除・探索もO(log n)で済む。
+#
+# AVLTreeNodeはBinaryTreeNodeを継承しているので、トラバーサルや表示の関数はそのまま使える。
+# AVL木を使う場合は、insert_binary_tree()、delete_binary_tree()の代わりに
+# insert_avl_tree()、delete_avl_tree()を使うこと。
+#
+
+class AVLTreeNode(BinaryTreeNode):
+    """AVL木のノードクラス
+    """
+
+    def __init__(self, data: object):
+        super().__init__(data)
+
+        # 自分を頂点とするサブツリーの高さ、末端なら1
+        self.height: int = 1
+
+        # 自分を頂点とするサブツリーのノード数、rank_binary_tree()などで使う
+        self.size: int = 1
+
+
+def avl_height(node: AVLTreeNode) -> int:
+    return node.height if node is not None else 0
+
+
+def update_avl_height(node: AVLTreeNode):
+    # 回転や削除で子が変わったときに呼ばれるので、ノード数も合わせて更新する
+    node.height = max(avl_height(node.left), avl_height(node.right)) + 1
+    node.size = subtree_size(node.left) + subtree_size(node.right) + 1
+
+
+def rotate_right(node: AVLTreeNode) -> AVLTreeNode:
+    """右回転
+
+    左の子を新しい頂点にする
+
+    #        node          left
+    #        /  \         /  \
+    #     left   c  ->   a   node
+    #     /  \              /  \
+    #    a    b             b    c
+    """
+    left = node.left
+    node.left = left.right
+    left.right = node
+    update_avl_height(node)
+    update_avl_height(left)
+    return left
+
+
+def rotate_left(node: AVLTreeNode) -> AVLTreeNode:
+    """左回転
+
+    右の子を新しい頂点にする
+
+    #     node               right
+    #     /  \              /  \
+    #    a   right   ->   node   c
+    #        /  \        /  \
+    #       b    c      a    b
+    """
+    right = node.right
+    node.right = right.left
+    right.left = node
+    update_avl_height(node)
+    update_avl_height(right)
+    return right
+
+
+def rebalance_avl_tree(node: AVLTreeNode) -> AVLTreeNode:
+    """左右の高さの差が2になっていたら回転させて、新しい頂点を返す
+    """
+    update_avl_height(node)
+    balance = avl_height(node.left) - avl_height(node.right)
+
+    if balance > 1:
+        # 左が高い
+        if avl_height(node.left.left) < avl_height(node.left.right):
+            # 左の子の右側が高い場合は、先に左の子を左回転させる
+            node.left = rotate_left(node.left)
+        return rotate_right(node)
+
+    if balance < -1:
+        # 右が高い
+        if avl_height(node.right.right) < avl_height(node.right.left):
+            node.right = rotate_right(node.right)
+        return rotate_left(node)
+
+    return node
+
+
+def insert_avl_tree(root: AVLTreeNode, data: object) -> AVLTreeNode:
+    """AVL木に新たなノードを追加する
+
+    回転によって頂点が変わることがあるので、戻り値を新しい頂点として使うこと
+
+    Returns:
+        AVLTreeNode: 新しい頂点
+    """
+    if root is None:
+        return AVLTreeNode(data)
+
+    if data == root.data:
+        # 同じ値の場合は何もしない（追加できない）
+        return root
+    elif data < root.data:
+        root.left = insert_avl_tree(root.left, data)
+    else:
+        root.right = insert_avl_tree(root.right, data)
+
+    return rebalance_avl_tree(root)
+
+
+def delete_avl_tree(root: AVLTreeNode, data: object) -> AVLTreeNode:
+    """AVL木から指定された値のノードを削除する
+
+    Returns:
+        AVLTreeNode: 新しい頂点
+    """
+    if root is None:
+        return root
+
+    if data < root.data:
+        root.left = delete_avl_tree(root.left, data)
+    elif data > root.data:
+        root.right = delete_avl_tree(root.right, data)
+    else:
+        if root.left is None:
+            return root.right
+        elif root.right is None:
+            return root.left
+
+        # delete_binary_tree()と同じく、左サブツリーの最大値をここに昇格させる
+        root.data = find_max_node(root.left).data
+        root.left = delete_avl_tree(root.left, root.data)
+
+    return rebalance_avl_tree(root)
+
+
+#
+# 順序統計
+#
+# 各ノードに自分を頂点とするサブツリーのノード数（size）を持たせておくと、
+# 「k番目に小さい値」や「ある値より小さい値の数」を、inorderで全てのノードを辿らずに
+# 頂点から一本の経路を辿るだけで求められる。計算量はツリーの高さに比例する。
+#
+# sizeを持つノードはSizedTreeNodeとAVLTreeNode。
+# insert_binary_tree()とdelete_binary_tree()は、ノードがsizeを持っていれば更新する。
+#
+
+class SizedTreeNode(BinaryTreeNode):
+    """サブツリーのノード数を持つ二分探索木のノードクラス
+    """
+
+    def __init__(self, data: object):
+        super().__init__(data)
+
+        # 自分を頂点とするサブツリーのノード数
+        self.size: int = 1
+
+
+def subtree_size(node: BinaryTreeNode) -> int:
+    return node.size if node is not None else 0
+
+
+def check_sized(root: BinaryTreeNode):
+    if root is not None and not hasattr(root, 'size'):
+        raise TypeError(f"{type(root).__name__} does not keep subtree sizes, use SizedTreeNode or AVLTreeNode")
+
+
+def rank_binary_tree(root: BinaryTreeNode, data: object, inclusive: bool = False) -> int:
+    """dataより小さい値の数を返す
+
+    Args:
+        root (BinaryTreeNode): sizeを持つノードの頂点
+        data (object): 比較する値、ツリーに含まれていなくてもよい
+        inclusive (bool, optional): Trueならdataと等しい値も数える. Defaults to False.
+
+    Returns:
+        int: 値の数
+    """
+    check_sized(root)
+
+    count = 0
+    node = root
+    while node is not None:
+        if data < node.data or (data == node.data and not inclusive):
+            node = node.left
+        else:
+            # 自分と左サブツリーの値は全てdataより小さい（またはdataと等しい）
+            count += subtree_size(node.left) + 1
+            node = node.right
+    return count
+
+
+def select_binary_tree(root: BinaryTreeNode, index: int) -> BinaryTreeNode:
+    """index番目（0から数える）に小さい値のノードを返す
+
+    Raises:
+        IndexError: indexがノード数の範囲外の場合
+
+    Returns:
+        BinaryTreeNode: _description_
+    """
+    check_sized(root)
+
+    if index < 0 or index >= subtree_size(root):
+        raise IndexError(f"index {index} is out of range")
+
+    node = root
+    while True:
+        left_size = subtree_size(node.left)
+        if index < left_size:
+            node = node.left
+        elif index == left_size:
+            return node
+        else:
+            index -= left_size + 1
+            node = node.right
+
+
+def count_range_binary_tree(root: BinaryTreeNode, low: object, high: object) -> int:
+    """low以上high以下の値の数を返す"""
+    if high < low:
+        return 0
+    return rank_binary_tree(root, high, inclusive=True) - rank_binary_tree(root, low)
+
+
+#
+# 一括構築
+#
+# insert_binary_tree()で一つずつ追加すると、全体でO(n log n)、昇順に並んだ値ではO(n^2)かかる。
+# 昇順に並んだ値からであれば、左右のノード数が均等になるように直接ツリーを組み立てることでO(n)で作成できる。
+#
+
+def build_binary_tree(sorted_keys, size: int = None, node_class=BinaryTreeNode) -> BinaryTreeNode:
+    """昇順に並んだ値から、高さが最小になる二分探索木をO(n)で作成する
+
+    値はイテレータから順に一つずつ取り出すので、ジェネレータを渡しても途中でリストを作らない。
+
+    値の数が分かっている場合（len()が使えるか、sizeを指定した場合）は、
+    中央の値が頂点になるように、inorderの順でノードを作りながら組み立てる。
+
+    値の数が分からない場合は、右の子だけを辿る一直線のツリー（vine）を作ってから、
+    Day-Stout-Warrenのアルゴリズムで回転させて形を整える。
+
+    Args:
+        sorted_keys (_type_): 昇順に並んだ重複のない値
+        size (int, optional): 値の数. Defaults to None.
+        node_class (_type_, optional): 作成するノードのクラス、AVLTreeNodeやSizedTreeNodeを指定すればheightやsizeも設定する. Defaults to BinaryTreeNode.
+
+    Raises:
+        ValueError: 値が昇順に並んでいない、または重複している場合
+
+    Returns:
+        BinaryTreeNode: 頂点、値がなければNone
+    """
+    if size is None and hasattr(sorted_keys, '__len__'):
+        size = len(sorted_keys)
+
+    keys = iter(sorted_keys)
+    previous = None
+    first = True
+
+    def next_key():
+        nonlocal previous, first
+        key = next(keys)
+        if not first and not previous < key:
+            raise ValueError("keys must be sorted in ascending order without duplicates")
+        previous = key
+        first = False
+        return key
+
+    if size is not None:
+        root = build_binary_tree_inorder(next_key, size, node_class)
+        # sizeより多くの値が渡されていないか確認する
+        for _ in keys:
+            raise ValueError(f"more than {size} keys are given")
+        return root
+
+    return build_binary_tree_dsw(next_key, node_class)
+
+
+def build_binary_tree_inorder(next_key, size: int, node_class) -> BinaryTreeNode:
+    """左サブツリー、自分、右サブツリーの順にノードを作る
+
+    再帰の深さはツリーの高さと同じO(log n)で済む
+    """
+    # 左右のノード数の差が1以下なので、ノード数nのサブツリーの高さは n.bit_length() になる
+    sample = node_class(None)
+    set_height = hasattr(sample, 'height')
+    set_size = hasattr(sample, 'size')
+
+    def build(n):
+        if n == 0:
+            return None
+        left = build(n // 2)
+        node = node_class(next_key())
+        node.left = left
+        node.right = build(n - n // 2 - 1)
+        if set_height:
+            node.height = n.bit_length()
+        if set_size:
+            node.size = n
+        return node
+
+    try:
+        return build(size)
+    except StopIteration:
+        raise ValueError(f"fewer than {size} keys are given") from None
+
+
+def build_binary_tree_dsw(next_key, node_class) -> BinaryTreeNode:
+    """Day-Stout-Warrenのアルゴリズムで組み立てる
+    """
+    # 右の子だけを辿る一直線のツリーを作る
+    # 頂点の回転を他のノードと同じように扱うため、仮の親ノードを用意する
+    pseudo_root = node_class(None)
+    tail = pseudo_root
+    size = 0
+    while True:
+        try:
+            key = next_key()
+        except StopIteration:
+            break
+        tail.right = node_class(key)
+        tail = tail.right
+        size += 1
+
+    def compress(count):
+        # 右の子を辿りながら、一つおきに左回転させる
+        parent = pseudo_root
+        for _ in range(count):
+            node = parent.right
+            child = node.right
+            node.right = child.left
+            child.left = node
+            parent.right = child
+            parent = child
+
+    # 最下段に収まりきらない分だけ先に回転させてから、段ごとに半分ずつ回転させる
+    full = (1 << (size + 1).bit_length() - 1) - 1
+    compress(size - full)
+    while full > 1:
+        full //= 2
+        compress(full)
+
+    root = pseudo_root.right
+
+    if root is not None and (hasattr(root, 'height') or hasattr(root, 'size')):
+        update_subtree_postorder(root)
+
+    return root
+
+
+def update_subtree_postorder(root: BinaryTreeNode):
+    """postorderで全てのノードの高さとノード数を設定し直す"""
+    stack = [(root, False)]
+    while stack:
+        node, visited = stack.pop()
+        if visited:
+            if hasattr(node, 'height'):
+                update_avl_height(node)
+            else:
+                node.size = subtree_size(node.left) + subtree_size(node.right) + 1
+            continue
+        stack.append((node, True))
+        if node.right is not None:
+            stack.append((node.right, False))
+        if node.left is not None:
+            stack.append((node.left, False))
+
+
+def build_binary_tree_unsorted(keys, node_class=BinaryTreeNode) -> BinaryTreeNode:
+    """並び順を問わない値から、高さが最小になる二分探索木を作成する
+
+    整列と重複の削除にO(n log n)かかる
+
+    Args:
+        keys (_type_): 値
+        node_class (_type_, optional): 作成するノードのクラス. Defaults to BinaryTreeNode.
+
+    Returns:
+        BinaryTreeNode: 頂点
+    """
+    unique_keys = [key for key, _ in groupby(sorted(keys))]
+    return build_binary_tree(unique_keys, node_class=node_class)
+
+
 def traverse_preorder(root: BinaryTreeNode, callback=None):
     if root == None:
         return
@@ -141,7 +610,7 @@ def traverse_inorder(root: BinaryTreeNode, callback=None):
     #
     # 左サブツリーを探索して深いノードを探しに行く
     #
-    traverse_preorder(root.left, callback=callback)
+    traverse_inorder(root.left, callback=callback)
 
     #
     # ノードににたどり着いたときの処理をここに書く
@@ -153,7 +622,7 @@ def traverse_inorder(root: BinaryTreeNode, callback=None):
     #
     # 右サブツリーを探索して深いノードを探しに行く
     #
-    traverse_preorder(root.right, callback=callback)
+    traverse_inorder(root.right, callback=callback)
 
 
 def traverse_postorder(root: BinaryTreeNode, callback=None):
@@ -200,14 +669,159 @@ def postorder(root: BinaryTreeNode):
     yield root
 
 
+def iter_range(root: BinaryTreeNode, low: object = None, high: object = None):
+    """low以上high以下の値を持つノードを昇順に返す
+
+    範囲外の値しか持たないサブツリーには降りていかないので、
+    範囲内のノード数をkとするとO(高さ + k)で済む。
+
+    Args:
+        root (BinaryTreeNode): _description_
+        low (object, optional): 下限、Noneなら下限なし. Defaults to None.
+        high (object, optional): 上限、Noneなら上限なし. Defaults to None.
+
+    Yields:
+        BinaryTreeNode: _description_
+    """
+    stack = []
+    node = root
+    while stack or node is not None:
+        # 左に降りながら、範囲内に入りうるノードをスタックに積む
+        while node is not None:
+            if low is not None and node.data < low:
+                # 自分も左サブツリーも下限より小さいので、右サブツリーだけを見ればよい
+                node = node.right
+            else:
+                stack.append(node)
+                node = node.left
+
+        if not stack:
+            return
+
+        node = stack.pop()
+        if high is not None and node.data > high:
+            # 以降のノードは全て上限より大きい
+            return
+        yield node
+        node = node.right
+
+
+class BinaryTreeCursor:
+    """二分探索木のノードを昇順、降順に一つずつ移動するカーソル
+
+    ノードは親へのポインタを持たないので、頂点から現在のノードまでの経路をスタックで保持する。
+    next()、prev()は一回あたり平均O(1)で次のノードに移動する。
+
+    カーソルが指すノードを削除・追加した場合は、first()、last()、seek()で位置を設定し直すこと。
+    """
+
+    def __init__(self, root: BinaryTreeNode):
+        self.root = root
+
+        # 頂点から現在のノードまでの経路、空であればどのノードも指していない
+        self.path = []
+
+    @property
+    def node(self) -> BinaryTreeNode:
+        """現在のノード、どのノードも指していなければNone"""
+        return self.path[-1] if self.path else None
+
+    def first(self) -> BinaryTreeNode:
+        """最小の値を持つノードに移動する"""
+        self.path = []
+        self.descend_left(self.root)
+        return self.node
+
+    def last(self) -> BinaryTreeNode:
+        """最大の値を持つノードに移動する"""
+        self.path = []
+        self.descend_right(self.root)
+        return self.node
+
+    def seek(self, data: object) -> BinaryTreeNode:
+        """data以上で最小の値を持つノードに移動する
+
+        該当するノードがなければNoneを返し、カーソルはどのノードも指さない
+        """
+        self.path = []
+
+        # 頂点から辿りながら、data以上で最小のノードが経路のどこにあるかを記録する
+        found = 0
+        node = self.root
+        while node is not None:
+            self.path.append(node)
+            if data == node.data:
+                return node
+            if data < node.data:
+                found = len(self.path)
+                node = node.left
+            else:
+                node = node.right
+
+        # 見つかったノードまでの経路を残す
+        del self.path[found:]
+        return self.node
+
+    def next(self) -> BinaryTreeNode:
+        """次に大きい値を持つノードに移動する
+
+        最後のノードから移動した場合はNoneを返し、カーソルはどのノードも指さない
+        """
+        if not self.path:
+            return None
+
+        node = self.path[-1]
+        if node.right is not None:
+            # 右サブツリーの最小値
+            self.descend_left(node.right)
+            return self.node
+
+        # 左の子として上がれる祖先まで戻る
+        child = self.path.pop()
+        while self.path and self.path[-1].right is child:
+            child = self.path.pop()
+        return self.node
+
+    def prev(self) -> BinaryTreeNode:
+        """次に小さい値を持つノードに移動する
+
+        最初のノードから移動した場合はNoneを返し、カーソルはどのノードも指さない
+        """
+        if not self.path:
+            return None
+
+        node = self.path[-1]
+        if node.left is not None:
+            # 左サブツリーの最大値
+            self.descend_right(node.left)
+            return self.node
+
+        child = self.path.pop()
+        while self.path and self.path[-1].left is child:
+            child = self.path.pop()
+        return self.node
+
+    def descend_left(self, node: BinaryTreeNode):
+        while node is not None:
+            self.path.append(node)
+            node = node.left
+
+    def descend_right(self, node: BinaryTreeNode):
+        while node is not None:
+            self.path.append(node)
+            node = node.right
+
+
 def level_order(root: BinaryTreeNode):
     if root == None:
         return
 
-    q = [root]
+    # list.pop(0)は先頭を取り出すたびに残りを詰め直すのでO(n)かかる
+    # dequeであれば両端の出し入れがO(1)で済む
+    q = deque([root])
 
     while q:
-        node = q.pop(0)
+        node = q.popleft()
 
         yield node
 
@@ -217,8 +831,45 @@ def level_order(root: BinaryTreeNode):
             q.append(node.right)
 
 
+def iter_levels(root: BinaryTreeNode, key=None):
+    """幅優先で探索し、同じ深さのノードをまとめて返す
+
+    Args:
+        root (BinaryTreeNode): _description_
+        key (_type_, optional): 最小値と最大値を求める値を返す関数. Defaults to None（ノードの値）.
+
+    Yields:
+        tuple: (深さ, ノードのリスト, keyの最小値, keyの最大値)、ノード数はリストの長さ
+    """
+    if root == None:
+        return
+
+    depth = 0
+    level = [root]
+    while level:
+        if key is None:
+            # 二分探索木では同じ深さのノードも左から昇順に並ぶので、両端が最小値と最大値になる
+            yield depth, level, level[0].data, level[-1].data
+        else:
+            keys = [key(node) for node in level]
+            yield depth, level, min(keys), max(keys)
+
+        next_level = []
+        for node in level:
+            if node.left is not None:
+                next_level.append(node.left)
+            if node.right is not None:
+                next_level.append(node.right)
+        level = next_level
+        depth += 1
+
+
 def tree_height(root: BinaryTreeNode) -> int:
-    return (max(tree_height(root.left), tree_height(root.right)) + 1) if root else 0
+    # 再帰を使わずに、深さの数を数える
+    height = 0
+    for _ in iter_levels(root):
+        height += 1
+    return height
 
 
 def print_binary_tree_h(root: BinaryTreeNode, level=0):
@@ -235,42 +886,50 @@ def print_binary_tree_h(root: BinaryTreeNode, level=0):
     print_binary_tree_h(root.right, level + 1)
 
 
-def print_binary_tree_v(root: BinaryTreeNode):
+def print_binary_tree_v(root: BinaryTreeNode, file=None):
+    """ツリーを上から下に向かって、深さごとに一行ずつ表示する
 
-    def _get_coloum(height):
-        if height == 1:
-            return 1
-        # heightを一つ減らすたびに2倍+1にしていく
-        return _get_coloum(height-1) *2 + 1
+    X座標はbinary_search_tree_layout.reingold_tilford()で求める。
+    行列を作らずに一行ずつ書き出すので、メモリ使用量は最も幅の広い階層のノード数に比例する。
+    ただし、行の長さはツリーの幅に比例する。
 
+    reingold_tilford()はノードに位置の情報（x, y, depth, relative_x, height）を設定する。
+    AVLTreeNodeのheightは同じ定義なので値は変わらない。
 
-    def _create_print_matrix_preorder(matrix, root, col, row, height):
-        if root is None:
-            return
-        #
-        # preorder探索での処理
-        #
-
-        # 自分の位置に値を入れる
-        matrix[row][col] = root.data
+    Args:
+        root (BinaryTreeNode): _description_
+        file (_type_, optional): 書き出し先のファイルオブジェクト. Defaults to None（標準出力）.
+    """
+    from binary_search_tree_layout import reingold_tilford
 
-        _create_print_matrix_preorder(matrix, root.left, col - pow(2, height-2), row +1, height -1)
-        _create_print_matrix_preorder(matrix, root.right, col + pow(2, height-2), row +1, height -1)
+    if root is None:
+        return
 
+    if file is None:
+        file = sys.stdout
 
-    height = tree_height(root)
-    column = _get_coloum(height)
+    reingold_tilford(root)
 
-    # ' 'で初期化した行列を作成
-    matrix = [[' ']*column for _ in range(height)]
+    # 同じ深さのノードは左から順に並ぶので、先頭のノードがその階層の左端になる
+    # 最初に全体の左端と、値を表示するのに必要な幅を求める
+    min_x = root.x
+    width = 1
+    for _, level, _, _ in iter_levels(root):
+        min_x = min(min_x, level[0].x)
+        width = max(width, max(len(str(node.data)) for node in level))
 
-    # rootの位置は、x=行列の中央、y=0として、preorder探索で値を入れていく
-    _create_print_matrix_preorder(matrix, root, column//2, 0, height)
+    # X座標が1違うノードの間に空白が一つ入るようにする
+    cell = width + 1
 
-    for row in matrix:
-        for col in row:
-            print(col, end=' ')
-        print('')
+    for _, level, _, _ in iter_levels(root):
+        line = []
+        column = 0
+        for node in level:
+            start = (node.x - min_x) * cell
+            line.append(' ' * (start - column))
+            line.append(str(node.data).center(width))
+            column = start + width
+        file.write(''.join(line).rstrip() + '\n')
 
 
 def test_binary_tree():
@@ -296,6 +955,10 @@ def test_binary_tree():
     print_binary_tree_h(root)
     print('')
 
+    print("--- Binary Tree From Top to Bottom---")
+    print_binary_tree_v(root)
+    print('')
+
     # ツリーの深さを表示
     print("--- Tree Hight---")
     print(tree_height(root))
@@ -352,10 +1015,38 @@ def test_binary_tree():
     print('')
 
 
+def test_avl_tree():
+
+    # 昇順に追加しても一直線にならない
+    root = None
+    for data in range(1, 16):
+        root = insert_avl_tree(root, data)
+
+    print("--- AVL Tree From Left to Right---")
+    print_binary_tree_h(root)
+    print('')
+
+    # 15個のノードなので高さは4になる
+    print("--- Tree Hight---")
+    print(tree_height(root))
+    print('')
+
+    print("--- delete 1, 2, 3 ---")
+    for data in [1, 2, 3]:
+        root = delete_avl_tree(root, data)
+    print_binary_tree_h(root)
+    print('')
+
+    print("--- find 8 ---")
+    print(find_binary_tree(root, 8).data)
+    print('')
+
+
 if __name__ == '__main__':
 
     def main():
         test_binary_tree()
+        test_avl_tree()
         return 0
 
     sys.exit(main())
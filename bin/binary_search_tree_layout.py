@@ -5,6 +5,8 @@
 
 import sys
 
+import layout_stats
+
 
 class BinaryTreeNode:
 
@@ -17,10 +19,14 @@ class BinaryTreeNode:
         self.left = None
         self.right = None
 
-        # 自分からみた左輪郭、右輪郭
-        # 自分からの相対位置で各レベルのX軸方向の位置を表現する
-        self.left_contour = [0]
-        self.right_contour = [0]
+        # 自分を頂点とするサブツリーの階層の数（末端なら1）
+        self.height: int = 1
+
+        # 輪郭の末端にある末端ノードから、より深い階層にある輪郭の続きへのスレッド
+        # thread_offsetはスレッドの先のノードの、自分からみた相対位置
+        # 輪郭をリストで持つと、親に上がるたびにコピーすることになりO(n・高さ)かかってしまう
+        self.thread: 'BinaryTreeNode' = None
+        self.thread_offset: int = 0
 
         # 上位ノードからみた自分の相対位置
         self.relative_x: int = 0
@@ -43,6 +49,8 @@ class BinaryTreeNode:
 
 def insert_binary_tree(root, data) -> BinaryTreeNode:
     """二分探索木に新たなノードを追加する
+
+    再帰を使わずにループで追加先を探す
     """
     # rootがNoneの場合、新しいノードを作成して返す
     # これがツリーの頂点になる
@@ -50,17 +58,23 @@ def insert_binary_tree(root, data) -> BinaryTreeNode:
         root = BinaryTreeNode(data)
         return root
 
-    if data == root.data:
-        # 同じ値の場合は何もしない（追加できない）
-        return root
-    elif data < root.data:
-        # 渡された値が小さければ左のサブツリーに追加し、
-        root.left = insert_binary_tree(root.left, data)
-    else:
-        # そうでなければ右のサブツリーに追加
-        root.right = insert_binary_tree(root.right, data)
-
-    return root
+    current = root
+    while True:
+        if data == current.data:
+            # 同じ値の場合は何もしない（追加できない）
+            return root
+        elif data < current.data:
+            # 渡された値が小さければ左のサブツリーに追加し、
+            if current.left is None:
+                current.left = BinaryTreeNode(data)
+                return root
+            current = current.left
+        else:
+            # そうでなければ右のサブツリーに追加
+            if current.right is None:
+                current.right = BinaryTreeNode(data)
+                return root
+            current = current.right
 
 
 def preorder(root: BinaryTreeNode):
@@ -88,33 +102,55 @@ def print_binary_tree(root: BinaryTreeNode, level=0):
     print_binary_tree(root.right, level + 1)
 
 
-def reingold_tilford_postorder(node):
-    """postorder探索で末端ノードから順に、X軸方向の相対位置を決める
-
-    末端から決めていくのでX軸方向の位置を絶対座標で決めることはできない。
-    親ノードが子の位置を相対的な位置relative_xとして設定する。
-    後ほどpreorder探索を実行し、上位ノードからの相対位置をもとにX軸方向の絶対位置を決定する。
+def next_left_contour(node, x):
+    """左輪郭において、一つ深い階層のノードと、その相対位置を返す
 
-    末端から上に上がっていく際に、各ノードで左輪郭および右輪郭を構築し、その輪郭を使ってサブツリー同士が重ならないように配置する。
+    左の子がいれば左の子、いなければ右の子、どちらもいなければスレッドの先が次の輪郭になる
 
     Args:
-        node (_type_): _description_
+        node (_type_): 輪郭を構成するノード
+        x (_type_): nodeの相対位置
+
+    Returns:
+        tuple: (次の輪郭ノード, その相対位置)
     """
+    if node.left != None:
+        return node.left, x + node.left.relative_x
+    if node.right != None:
+        return node.right, x + node.right.relative_x
+    return node.thread, x + node.thread_offset
 
-    if node == None:
-        return
 
-    # 再帰呼び出しで深く降りていく
-    reingold_tilford_postorder(node.left)
-    reingold_tilford_postorder(node.right)
+def next_right_contour(node, x):
+    """右輪郭において、一つ深い階層のノードと、その相対位置を返す"""
+    if node.right != None:
+        return node.right, x + node.right.relative_x
+    if node.left != None:
+        return node.left, x + node.left.relative_x
+    return node.thread, x + node.thread_offset
+
+
+def reingold_tilford_postorder_node(node):
+    """postorderでたどり着いたノード一つ分の処理を行う
+
+    子の位置を自分からの相対位置relative_xとして設定する。
+    左の子のサブツリーの右輪郭と、右の子のサブツリーの左輪郭を階層ごとに比較して、重ならないように左右の子の間隔を広げる。
+
+    輪郭はリストとして持たずに、子とスレッドを辿って求める。
+    比較するのは浅い方のサブツリーの高さまでなので、ツリー全体の計算量はO(n)になる。
 
-    #
-    # postorderの場合はここに処理を書く
-    #
+    Args:
+        node (_type_): _description_
+    """
+
+    # 前回の計算で張ったスレッドは使わない
+    node.thread = None
+    node.thread_offset = 0
 
     # 末端にたどり着いた場合は何もせずに、ひとつ上の階層に戻る
     # 自分の相対位置は親ノードによって後から決められる
     if node.left == None and node.right == None:
+        node.height = 1
         return
 
     # ここから先の処理は左か右に必ず子がいる
@@ -128,19 +164,12 @@ def reingold_tilford_postorder(node):
         #   子
 
         # 左の子は、自分からみて -1 の相対位置に設定する
+        # 自分の輪郭は、左の子の輪郭の先頭に自分を加えたものになる
         node.left.relative_x = -1
+        node.height = node.left.height + 1
+        return
 
-        # 自分の左輪郭を構築する
-        # 左の子が持っている左輪郭をコピーして、先頭に自分の相対位置 0 を追加する
-        # ただし、左の子は相対位置を-1移動させたので、左輪郭の要素も全て-1する
-        node.left_contour = [0] + [x + node.left.relative_x for x in node.left.left_contour]
-
-        # 自分の右輪郭を構築する
-        # 右に子がいないので、左の子が持っている右輪郭をコピーして、先頭に自分の相対位置 0 を追加する
-        # ただし、左の子は相対位置を-1移動させたので、左輪郭の要素も全て-1する
-        node.right_contour = [0] + [x + node.left.relative_x for x in node.left.right_contour]
-
-    elif node.right != None and node.left == None:
+    if node.right != None and node.left == None:
 
         # 左に子がなく、右に子がある場合
         #    node
@@ -149,158 +178,186 @@ def reingold_tilford_postorder(node):
 
         # 右の子は、自分からみて +1 の相対位置に設定する
         node.right.relative_x = +1
+        node.height = node.right.height + 1
+        return
 
-        # 自分の左輪郭を構築する
-        # 左に子がいないので、右の子が持っている左輪郭を引き継いで使う
-        node.left_contour = [0] + [x + node.right.relative_x for x in node.right.left_contour]
+    # 左右に子がいる場合
+    #    node
+    #    /  \
+    #   子   子
+
+    left = node.left
+    right = node.right
+
+    # 左右の子が同じ位置にあるとして、左の子の右輪郭と、右の子の左輪郭を階層ごとに比較する
+    # 浅い方のサブツリーの高さまで比較すればよい
+    #   li: 左の子の右輪郭（内側）、ri: 右の子の左輪郭（内側）
+    #   lo: 左の子の左輪郭（外側）、ro: 右の子の右輪郭（外側）
+    # 外側の輪郭は、スレッドを張る末端のノードを求めるために辿る
+    li = lo = left
+    ri = ro = right
+    li_x = lo_x = ri_x = ro_x = 0
+
+    # 各階層で、右の子の左輪郭から、左の子の右輪郭を引いて、差を計算する
+    # これが
+    #   - マイナスの場合は、その階層で重なりが発生している
+    #   - ゼロであれば左サブツリーの右端と、右サブツリーの左端がちょうど一致している
+    #   - プラスであれば、左右のサブツリーが離れている
+    # ということになる
+    # 差の最小値を求める
+    minimum_distance = ri_x - li_x
+    depth = min(left.height, right.height)
+    for _ in range(depth - 1):
+        li, li_x = next_right_contour(li, li_x)
+        ri, ri_x = next_left_contour(ri, ri_x)
+        lo, lo_x = next_left_contour(lo, lo_x)
+        ro, ro_x = next_right_contour(ro, ro_x)
+        minimum_distance = min(minimum_distance, ri_x - li_x)
+
+    stats = layout_stats.current
+    if stats is not None:
+        # 左右の子から始めて、4本の輪郭を辿っている
+        stats.add_contour(4 * depth, depth)
+
+    # 最低限確保したい間隔
+    minimal_distance = BinaryTreeNode.MINIMAL_X_DISTANCE
+
+    # 左の子のサブツリーと、右の子のサブツリーで重複しているので、間隔を広げる必要がある
+    # 1階層目で左右の子は同じ位置にあるので、差の最小値は必ず0以下になる
+    shift_value = minimal_distance - minimum_distance
+
+    # 左の子は左に、右の子は右に動かしたい
+    # 左右均等に動かしたいので、動かす量は2の倍数にする
+    if abs(shift_value) % 2 == 0:
+        # 偶数なので+2にすることで、左サブツリーは左に1、右サブツリーは右に1、というように均等にずらせる
+        shift_value = abs(shift_value) + BinaryTreeNode.MINIMAL_X_DISTANCE + BinaryTreeNode.MINIMAL_X_DISTANCE
+    else:
+        # 奇数なので+1して、合計で2の倍数にする
+        shift_value = abs(shift_value) + BinaryTreeNode.MINIMAL_X_DISTANCE
 
-        # 自分の右輪郭を構築する
-        # 左に子がいないので、右の子が持っている右輪郭を引き継いで使う
-        node.right_contour = [0] + [x + node.right.relative_x for x in node.right.right_contour]
+    # 左の子は、自分からみて、マイナスの方向にずらす
+    left.relative_x = -1 * shift_value // 2
 
-    else:
+    # 右の子は、自分からみて、プラスの方向にずらす
+    right.relative_x = shift_value // 2
 
-        # 左右に子がいる場合
-        #    node
-        #    /  \
-        #   子   子
-
-        # 左の子を頂点とするサブツリーと、右の子を頂点とするサブツリーで重なりがあるかもしれない
-        # 左の子のサブツリーの右輪郭、右の子のサブツリーの左輪郭を、階層ごとに比較して、重ならないように左右の子の間隔を広げる
-        # ただし、必ずしも全ての階層を比較する必要はなく、サブツリーが存在する階層だけを調べればよい
-
-        # 右の子が持つ左輪郭の長さと、左の子が持つ右輪郭の長さで、短い方を取る
-        minimum_height = min(len(node.right.left_contour), len(node.left.right_contour))
-
-        # 各階層で、右の子の左輪郭から、左の子の右輪郭を引いて、差を計算する
-        # これが
-        #   - マイナスの場合は、その階層で重なりが発生している
-        #   - ゼロであれば左サブツリーの右端と、右サブツリーの左端がちょうど一致している
-        #   - プラスであれば、左右のサブツリーが離れている
-        # ということになる
-        # 差の最小値を求める
-        diff_list = []
-        for i in range(minimum_height):
-            diff = node.right.left_contour[i] - node.left.right_contour[i]
-            diff_list.append(diff)
-        minimum_distance = min(diff_list)
-
-        # 最低限確保したい間隔
-        minimal_distance = BinaryTreeNode.MINIMAL_X_DISTANCE
-
-        # どのくらい移動すべきか、を求める
-        shift_value = 0
-
-        if minimum_distance + shift_value <= minimum_distance:
-            # 左の子のサブツリーと、右の子のサブツリーで重複しているので、間隔を広げる必要がある
-            shift_value = minimal_distance - minimum_distance
-
-            # 左の子は左に、右の子は右に動かしたい
-            # 左右均等に動かしたいので、動かす量は2の倍数にする
-            if abs(shift_value) % 2 == 0:
-                # 偶数なので+2にすることで、左サブツリーは左に1、右サブツリーは右に1、というように均等にずらせる
-                shift_value = abs(shift_value) + BinaryTreeNode.MINIMAL_X_DISTANCE + BinaryTreeNode.MINIMAL_X_DISTANCE
-            else:
-                # 奇数なので+1して、合計で2の倍数にする
-                shift_value = abs(shift_value) + BinaryTreeNode.MINIMAL_X_DISTANCE
-
-            # 左の子は、自分からみて、マイナスの方向にずらす
-            node.left.relative_x = -1 * shift_value // 2
-
-            # 右の子は、自分からみて、プラスの方向にずらす
-            node.right.relative_x = shift_value // 2
-
-            # 自分の左輪郭を再構築する
-            if len(node.right.left_contour) > len(node.left.left_contour):
-                # 右サブツリーの左輪郭の方が長い場合、足りない分をそこから補う
-                node.left_contour =  [0] + [x + node.left.relative_x for x in node.left.left_contour] + [ x + node.right.relative_x for x in node.right.left_contour[len(node.left.left_contour):]]
-            else:
-                # 左サブツリーの左輪郭の方が長いなら、足りない部分はない
-                node.left_contour = [0] + [x + node.left.relative_x for x in node.left.left_contour]
-
-            # 自分の右輪郭を再構築する
-            if len(node.left.right_contour) > len(node.right.right_contour):
-                node.right_contour =  [0] + [x + node.right.relative_x for x in node.right.right_contour] + [x + node.left.relative_x for x in node.left.right_contour[len(node.right.right_contour):]]
-            else:
-                node.right_contour = [0] + [x + node.right.relative_x for x in node.right.right_contour]
+    # 浅い方の輪郭の末端から、深い方の輪郭の続きへスレッドを張る
+    # スレッドの相対位置はサブツリー内の位置関係なので、この先サブツリーが動いても変わらない
+    if right.height > left.height:
+        # 自分の左輪郭は、左の子の左輪郭の先を右の子の左輪郭で補う
+        next_node, next_x = next_left_contour(ri, ri_x)
+        lo.thread = next_node
+        lo.thread_offset = (next_x + right.relative_x) - (lo_x + left.relative_x)
+    elif left.height > right.height:
+        # 自分の右輪郭は、右の子の右輪郭の先を左の子の右輪郭で補う
+        next_node, next_x = next_right_contour(li, li_x)
+        ro.thread = next_node
+        ro.thread_offset = (next_x + left.relative_x) - (ro_x + right.relative_x)
 
+    node.height = max(left.height, right.height) + 1
 
-def reingold_tilford_preorder(node):
+
+def reingold_tilford_postorder(node):
+    """postorder探索で末端ノードから順に、X軸方向の相対位置を決める
+
+    末端から決めていくのでX軸方向の位置を絶対座標で決めることはできない。
+    親ノードが子の位置を相対的な位置relative_xとして設定する。
+    後ほどpreorder探索を実行し、上位ノードからの相対位置をもとにX軸方向の絶対位置を決定する。
+
+    末端から上に上がっていく際に、左輪郭および右輪郭を辿って、サブツリー同士が重ならないように配置する。
+    深いツリーでも再帰の上限に達しないように、明示的なスタックで探索する。
+
+    Args:
+        node (_type_): _description_
+    """
     if node == None:
         return
 
-    #
-    # preorderの場合はここに処理を書く
-    #
+    stats = layout_stats.current
 
-    # 前段の処理で上位ノードからの相対位置が求まっているので、それを反映させる
+    # スタックには(ノード, 子を積み終えたか)を積む
+    stack = [(node, False)]
+    while stack:
+        node, visited = stack.pop()
 
-    if node.left != None:
-        # 左の子の位置を決める
-        node.left.x = node.left.relative_x + node.x
+        if visited:
+            reingold_tilford_postorder_node(node)
+            if stats is not None:
+                stats.nodes_visited += 1
+            continue
 
-        # 子の深さは自分の深さ+1
-        node.left.depth = node.left.y = node.depth + 1
+        stack.append((node, True))
+        if node.right != None:
+            stack.append((node.right, False))
+        if node.left != None:
+            stack.append((node.left, False))
 
-        # 子のY軸の位置を決める
-        node.left.y = node.y + BinaryTreeNode.MINIMAL_Y_DISTANCE
 
-    if node.right != None:
-        # 右の子の位置を決める
-        node.right.x = node.right.relative_x + node.x
+def reingold_tilford_preorder(node):
+    if node == None:
+        return
 
-        # 子の深さは自分の深さ+1
-        node.right.depth = node.right.y = node.depth + 1
+    stack = [node]
+    while stack:
+        node = stack.pop()
 
-        # 子のY軸の位置を決める
-        node.right.y = node.y + BinaryTreeNode.MINIMAL_Y_DISTANCE
+        #
+        # preorderの場合はここに処理を書く
+        #
 
+        # 前段の処理で上位ノードからの相対位置が求まっているので、それを反映させる
+        # 位置が確定すればスレッドは不要なので外しておく
+        node.thread = None
 
-    # 再帰呼び出しで深く降りていく
-    reingold_tilford_preorder(node.left)
-    reingold_tilford_preorder(node.right)
+        for child in (node.right, node.left):
+            if child == None:
+                continue
 
+            # 子の位置を決める
+            child.x = child.relative_x + node.x
 
-def reingold_tilford(node):
-    reingold_tilford_postorder(node)
-    reingold_tilford_preorder(node)
+            # 子の深さは自分の深さ+1
+            child.depth = node.depth + 1
 
+            # 子のY軸の位置を決める
+            child.y = node.y + BinaryTreeNode.MINIMAL_Y_DISTANCE
+
+            stack.append(child)
 
-def save_png(root, filename):
-    import matplotlib.pyplot as plt
-    import networkx as nx
 
-    def add_tree(root, G):
-        if root is None:
-            return
+def reingold_tilford(node):
+    """ツリー全体の位置を計算する
 
-        G.add_node(root.data, label=f"{root.data}")
+    layout_stats.collect_layout_stats()のwith文の中で実行すると、フェーズごとの時間や輪郭を辿った量を集める。
+    二分木では兄弟の均等化を行わないので、equalize_shiftsは0のまま。
 
-        if root.left is not None:
-            G.add_edge(root.data, root.left.data)
-            add_tree(root.left, G)
+    Args:
+        node (_type_): _description_
+    """
+    if node == None:
+        return
 
-        if root.right is not None:
-            G.add_edge(root.data, root.right.data)
-            add_tree(root.right, G)
+    # 頂点を基準位置にする
+    # 回転などで頂点が入れ替わっても、前回の位置が残らないようにする
+    node.x = 0
+    node.y = 0
+    node.depth = 0
 
+    with layout_stats.phase("x_postorder"):
+        reingold_tilford_postorder(node)
 
-    def get_postion_preorder(root, position={}):
-        if root is None:
-            return
+    # 深さとY座標もここで決まる
+    with layout_stats.phase("finalize"):
+        reingold_tilford_preorder(node)
 
-        position[root.data] = (root.x, -root.y)
-        get_postion_preorder(root.left, position)
-        get_postion_preorder(root.right, position)
 
-    position = {}
-    get_postion_preorder(root, position)
+def save_png(root, filename):
+    """ツリーを画像として保存する
 
-    G = nx.Graph()
-    add_tree(root, G)
-    nx.draw(G, pos=position, node_size=300, with_labels=True, font_size=8, font_color='white')
-    plt.savefig(filename)
-    plt.cla()
+    拡張子が.svgならラベル付きのSVG、それ以外はPNGで保存する
+    """
+    from tree_render import save_image
+    save_image(root, filename)
 
 
 if __name__ == '__main__':
@@ -347,12 +404,12 @@ if __name__ == '__main__':
         reingold_tilford_postorder(root)
         print("\nreingold_tilford_postorder done\n")
         for node in preorder(root):
-            print(node.data, node.relative_x, (node.x, node.depth), node.left_contour, node.right_contour)
+            print(node.data, node.relative_x, (node.x, node.depth), node.height)
 
         reingold_tilford_preorder(root)
         print("\nreingold_tilford_preorder done\n")
         for node in preorder(root):
-            print(node.data, node.relative_x, (node.x, node.depth), node.left_contour, node.right_contour)
+            print(node.data, node.relative_x, (node.x, node.depth), node.height)
 
         save_png(root, filename)
 
@@ -360,7 +417,7 @@ if __name__ == '__main__':
     def main():
         trees = create_test_trees()
         for i, tree in enumerate(trees):
-            test_tree(tree, f"log/binary_search_tree_{i}.png")
+            test_tree(tree, f"log/binary_search_tree_{i}.svg")
         return 0
 
     sys.exit(main())
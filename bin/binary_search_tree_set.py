@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+#
+# joinとsplitを使った二分探索木の集合演算
+#
+# 参考文献
+#   Guy E. Blelloch, Daniel Ferizovic, Yihan Sun, "Just Join for Parallel Ordered Sets", SPAA 2016
+#
+# 二つのツリーの和集合を作るのに、片方のノードを一つずつinsert_binary_tree()で追加するとO(m log n)かかり、
+# 追加する値の順序によってはツリーが偏ってしまう。
+#
+# AVL木では、全ての値が左のツリー < k < 右のツリー となっている二つのツリーとノードkを
+# 高さの差に比例する時間で一つのツリーにまとめられる（join）。
+# これを使うと、ツリーをある値で二つに分けるsplitもO(log n)で行える。
+# 和集合、積集合、差集合はjoinとsplitの組み合わせだけで書けて、
+# 小さい方のツリーのノード数をm、大きい方をnとするとO(m log(n/m + 1))で計算できる。
+#
+# 演算はAVLTreeNodeのツリーに対して行う。
+# AVLTreeNodeのツリーを渡した場合はノードをそのまま使って組み替えるので、渡したツリーは壊れる。
+# それ以外のBinaryTreeNodeのツリーを渡した場合は、AVLTreeNodeのツリーを新しく作ってから計算する。
+#
+# workersを指定して両方のツリーが大きい場合は、値の範囲で分割してプロセスプールで並列に計算する。
+# プロセス間では値のリストを受け渡すため、親プロセスで値の取り出しと結果のツリーの作り直しにO(n + m)のコストがかかる。
+# この直列の部分だけで一つのプロセスで計算するより時間がかかることが多いので、並列化はworkersを指定したときだけ行う。
+#
+
+import sys
+
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+
+from binary_search_tree import (AVLTreeNode, avl_height, build_binary_tree, find_max_node, find_min_node,
+                                iter_range, print_binary_tree_h, rotate_left, rotate_right, subtree_size,
+                                update_avl_height)
+
+# 両方のツリーのノード数がこれ以上なら並列に計算する
+PARALLEL_THRESHOLD = 200_000
+
+
+def to_avl_tree(root):
+    """AVLTreeNodeのツリーでなければ、同じ値を持つAVLTreeNodeのツリーをO(n)で作成する"""
+    if root is None or isinstance(root, AVLTreeNode):
+        return root
+    return build_binary_tree((node.data for node in iter_range(root)), node_class=AVLTreeNode)
+
+
+#
+# join
+#
+
+def join_with_node(left: AVLTreeNode, node: AVLTreeNode, right: AVLTreeNode) -> AVLTreeNode:
+    """左のツリー < node < 右のツリー となっている二つのツリーとノードをまとめる
+
+    計算量は左右のツリーの高さの差に比例する
+
+    Returns:
+        AVLTreeNode: 新しい頂点
+    """
+    left_height = avl_height(left)
+    right_height = avl_height(right)
+
+    if left_height > right_height + 1:
+        return join_right(left, node, right)
+
+    if right_height > left_height + 1:
+        return join_left(left, node, right)
+
+    node.left = left
+    node.right = right
+    update_avl_height(node)
+    return node
+
+
+def join_right(left: AVLTreeNode, node: AVLTreeNode, right: AVLTreeNode) -> AVLTreeNode:
+    """左のツリーが高い場合、左のツリーの右端を降りて、右のツリーと高さが揃うところにつなぐ"""
+    if avl_height(left.right) <= avl_height(right) + 1:
+        node.left = left.right
+        node.right = right
+        update_avl_height(node)
+        if avl_height(node) <= avl_height(left.left) + 1:
+            left.right = node
+            update_avl_height(left)
+            return left
+        left.right = rotate_right(node)
+        update_avl_height(left)
+        return rotate_left(left)
+
+    left.right = join_right(left.right, node, right)
+    update_avl_height(left)
+    if avl_height(left.right) <= avl_height(left.left) + 1:
+        return left
+    return rotate_left(left)
+
+
+def join_left(left: AVLTreeNode, node: AVLTreeNode, right: AVLTreeNode) -> AVLTreeNode:
+    """右のツリーが高い場合、右のツリーの左端を降りて、左のツリーと高さが揃うところにつなぐ"""
+    if avl_height(right.left) <= avl_height(left) + 1:
+        node.left = left
+        node.right = right.left
+        update_avl_height(node)
+        if avl_height(node) <= avl_height(right.right) + 1:
+            right.left = node
+            update_avl_height(right)
+            return right
+        right.left = rotate_left(node)
+        update_avl_height(right)
+        return rotate_right(right)
+
+    right.left = join_left(left, node, right.left)
+    update_avl_height(right)
+    if avl_height(right.left) <= avl_height(right.right) + 1:
+        return right
+    return rotate_right(right)
+
+
+def split_last(root: AVLTreeNode) -> tuple:
+    """最大の値のノードを取り出す
+
+    Returns:
+        tuple: (残りのツリー, 最大の値のノード)
+    """
+    if root.right is None:
+        return root.left, root
+    rest, last = split_last(root.right)
+    return join_with_node(root.left, root, rest), last
+
+
+def join2(left: AVLTreeNode, right: AVLTreeNode) -> AVLTreeNode:
+    """左のツリー < 右のツリー となっている二つのツリーをまとめる"""
+    if left is None:
+        return right
+    rest, last = split_last(left)
+    return join_with_node(rest, last, right)
+
+
+def split(root: AVLTreeNode, data: object) -> tuple:
+    """dataより小さい値のツリーと、大きい値のツリーに分ける
+
+    Returns:
+        tuple: (dataより小さい値のツリー, dataの値を持つノード（なければNone）, dataより大きい値のツリー)
+    """
+    if root is None:
+        return None, None, None
+
+    left, right = root.left, root.right
+
+    if data == root.data:
+        root.left = root.right = None
+        update_avl_height(root)
+        return left, root, right
+
+    if data < root.data:
+        less, found, greater = split(left, data)
+        return less, found, join_with_node(greater, root, right)
+
+    less, found, greater = split(right, data)
+    return join_with_node(left, root, less), found, greater
+
+
+#
+# 集合演算
+#
+
+def union_avl(tree1: AVLTreeNode, tree2: AVLTreeNode) -> AVLTreeNode:
+    if tree1 is None:
+        return tree2
+    if tree2 is None:
+        return tree1
+
+    # tree1の頂点の値でtree2を分けて、左右それぞれで和集合を作ってからまとめる
+    left, right = tree1.left, tree1.right
+    less, _, greater = split(tree2, tree1.data)
+    return join_with_node(union_avl(left, less), tree1, union_avl(right, greater))
+
+
+def intersection_avl(tree1: AVLTreeNode, tree2: AVLTreeNode) -> AVLTreeNode:
+    if tree1 is None or tree2 is None:
+        return None
+
+    left, right = tree1.left, tree1.right
+    less, found, greater = split(tree2, tree1.data)
+    left = intersection_avl(left, less)
+    right = intersection_avl(right, greater)
+    if found is not None:
+        return join_with_node(left, tree1, right)
+    return join2(left, right)
+
+
+def difference_avl(tree1: AVLTreeNode, tree2: AVLTreeNode) -> AVLTreeNode:
+    if tree1 is None:
+        return None
+    if tree2 is None:
+        return tree1
+
+    # tree2の頂点の値でtree1を分けて、その値を取り除く
+    left, right = tree2.left, tree2.right
+    less, _, greater = split(tree1, tree2.data)
+    return join2(difference_avl(less, left), difference_avl(greater, right))
+
+
+SET_OPERATIONS = {
+    'union': union_avl,
+    'intersection': intersection_avl,
+    'difference': difference_avl,
+}
+
+
+def set_operation_partition(args: tuple) -> list:
+    """プロセスプールの中で実行する、値のリストを受け取って結果の値のリストを返す"""
+    operation, keys1, keys2 = args
+    tree1 = build_binary_tree(keys1, node_class=AVLTreeNode)
+    tree2 = build_binary_tree(keys2, node_class=AVLTreeNode)
+    result = SET_OPERATIONS[operation](tree1, tree2)
+    return [node.data for node in iter_range(result)]
+
+
+def set_operation_parallel(operation: str, tree1: AVLTreeNode, tree2: AVLTreeNode, workers: int) -> AVLTreeNode:
+    """値の範囲で分割して、プロセスプールで並列に計算する"""
+    keys1 = [node.data for node in iter_range(tree1)]
+    keys2 = [node.data for node in iter_range(tree2)]
+
+    # tree1の値を均等に分ける値を境界にして、両方のリストを同じ範囲で分割する
+    pivots = [keys1[len(keys1) * i // workers] for i in range(1, workers)]
+    bounds1 = [0] + [bisect_left(keys1, pivot) for pivot in pivots] + [len(keys1)]
+    bounds2 = [0] + [bisect_left(keys2, pivot) for pivot in pivots] + [len(keys2)]
+
+    partitions = [(operation, keys1[bounds1[i]:bounds1[i+1]], keys2[bounds2[i]:bounds2[i+1]])
+                  for i in range(workers)]
+    del keys1, keys2
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(set_operation_partition, partitions))
+
+    # 分割した範囲は重ならず昇順に並んでいるので、つなげるだけで整列済みになる
+    return build_binary_tree((key for result in results for key in result), node_class=AVLTreeNode)
+
+
+def set_operation(operation: str, tree1, tree2, workers: int = None,
+                  parallel_threshold: int = PARALLEL_THRESHOLD) -> AVLTreeNode:
+    tree1 = to_avl_tree(tree1)
+    tree2 = to_avl_tree(tree2)
+
+    # 境界の値が重ならないように、ノード数はworkers以上必要
+    if workers is not None and workers > 1 and \
+            min(subtree_size(tree1), subtree_size(tree2)) >= max(parallel_threshold, workers):
+        return set_operation_parallel(operation, tree1, tree2, workers)
+
+    return SET_OPERATIONS[operation](tree1, tree2)
+
+
+def union(tree1, tree2, workers: int = None, parallel_threshold: int = PARALLEL_THRESHOLD) -> AVLTreeNode:
+    """和集合
+
+    Args:
+        tree1 (_type_): BinaryTreeNodeのツリー、AVLTreeNodeならノードをそのまま使うので元のツリーは壊れる
+        tree2 (_type_): 同上
+        workers (int, optional): 並列に計算するプロセス数. Defaults to None（並列に計算しない）.
+        parallel_threshold (int, optional): 両方のノード数がこれ以上なら並列に計算する. Defaults to PARALLEL_THRESHOLD.
+
+    Returns:
+        AVLTreeNode: 結果のツリーの頂点
+    """
+    return set_operation('union', tree1, tree2, workers, parallel_threshold)
+
+
+def intersection(tree1, tree2, workers: int = None, parallel_threshold: int = PARALLEL_THRESHOLD) -> AVLTreeNode:
+    """積集合、引数はunion()と同じ"""
+    return set_operation('intersection', tree1, tree2, workers, parallel_threshold)
+
+
+def difference(tree1, tree2, workers: int = None, parallel_threshold: int = PARALLEL_THRESHOLD) -> AVLTreeNode:
+    """差集合 tree1 - tree2、引数はunion()と同じ"""
+    return set_operation('difference', tree1, tree2, workers, parallel_threshold)
+
+
+def split_tree(root, data: object) -> tuple:
+    """ツリーをdataより小さい値と大きい値に分ける
+
+    Returns:
+        tuple: (dataより小さい値のツリー, dataがツリーに含まれていればTrue, dataより大きい値のツリー)
+    """
+    less, found, greater = split(to_avl_tree(root), data)
+    return less, found is not None, greater
+
+
+def join_tree(left, right) -> AVLTreeNode:
+    """左のツリーの値が全て右のツリーの値より小さい二つのツリーをまとめる
+
+    Raises:
+        ValueError: 左のツリーの最大値が右のツリーの最小値以上の場合
+    """
+    left = to_avl_tree(left)
+    right = to_avl_tree(right)
+    if left is not None and right is not None:
+        if not find_max_node(left).data < find_min_node(right).data:
+            raise ValueError("all keys in the left tree must be smaller than the keys in the right tree")
+    return join2(left, right)
+
+
+def test_set_operations():
+
+    tree1 = build_binary_tree(range(0, 20, 2), node_class=AVLTreeNode)
+    tree2 = build_binary_tree(range(0, 20, 3), node_class=AVLTreeNode)
+
+    print("--- union ---")
+    root = union(tree1, tree2)
+    print_binary_tree_h(root)
+    print('')
+
+    print("--- split 9 ---")
+    less, found, greater = split_tree(root, 9)
+    print([node.data for node in iter_range(less)], found, [node.data for node in iter_range(greater)])
+    print('')
+
+    print("--- join ---")
+    root = join_tree(less, greater)
+    print([node.data for node in iter_range(root)])
+    print('')
+
+    print("--- intersection ---")
+    root = intersection(build_binary_tree(range(0, 20, 2), node_class=AVLTreeNode),
+                        build_binary_tree(range(0, 20, 3), node_class=AVLTreeNode))
+    print([node.data for node in iter_range(root)])
+    print('')
+
+    print("--- difference ---")
+    root = difference(build_binary_tree(range(0, 20, 2), node_class=AVLTreeNode),
+                      build_binary_tree(range(0, 20, 3), node_class=AVLTreeNode))
+    print([node.data for node in iter_range(root)])
+    print('')
+
+
+if __name__ == '__main__':
+
+    def main():
+        test_set_operations()
+        return 0
+
+    sys.exit(main())
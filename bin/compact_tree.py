@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+
+#
+# 配列で表現したツリー
+#
+# TreeNodeはノードごとにPythonのオブジェクトを作るため、100万ノードのツリーではギガバイト単位のメモリを消費してしまう。
+# CompactTreeはツリー全体をNumPyの配列の組（struct of arrays）で表現する。
+#
+# ノードには幅優先探索（BFS）の順に0から番号を振る。
+# こうすると、
+#   - 兄弟ノードの番号は連続するので、子の一覧はCSR形式のオフセット配列だけで表現できる
+#     ノードiの子は child_offsets[i] から child_offsets[i+1] - 1 まで
+#   - 子の番号は必ず親より大きいので、番号の大きい方から処理すればpostorder、小さい方から処理すればpreorderと同じ順序で計算できる
+#   - 同じ深さのノードの番号も連続する
+#
+
+import sys
+
+import numpy as np
+
+from tree_layout import TreeNode
+
+
+# 深さごとにまとめて処理する階層数の上限
+# 深さごとの処理はNumPyの呼び出しが階層の数だけ必要になるので、一直線のツリーではノード数と同じ回数になってしまう。
+# これより深い部分は、祖先へのポインタを倍々に伸ばしていく方法（pointer jumping）で計算する。
+LEVEL_LOOP_LIMIT = 64
+
+
+def accumulate_ancestors(parent: np.ndarray, values: np.ndarray, result: np.ndarray, start: int = 1):
+    """各ノードについて、祖先（自分は含まない）のvaluesの合計をresultに設定する
+
+    親の番号が子より小さければ、BFS順でもpreorder順でもよい。
+    result[:start]は設定済みとして、start以降のノードを計算する。
+
+    各ノードは、祖先ancと、親からancまでのvaluesの合計partialを持つ。
+    ancのpartialを自分のpartialに足し込んで、ancをancのancに置き換えると、ancまでの距離は倍になる。
+    ancが設定済みのノードに到達したら、そのノードのresultを足して完了する。
+    NumPyの配列演算をO(log 深さ)回行えば、全てのノードが求まる。
+
+    Args:
+        parent (np.ndarray): 親ノードの番号、ルートは-1
+        values (np.ndarray): ノードごとの値
+        result (np.ndarray): 結果を設定する配列
+        start (int, optional): 設定済みのノードの数. Defaults to 1（ルートのみ）.
+    """
+    num_nodes = len(parent)
+
+    anc = parent.astype(np.int64)
+    partial = np.zeros(num_nodes, dtype=values.dtype)
+    partial[start:] = values[anc[start:]]
+
+    active = np.arange(start, num_nodes)
+    while active.size:
+        a = anc[active]
+
+        done = a < start
+        finished = active[done]
+        result[finished] = partial[finished] + result[a[done]]
+
+        active = active[~done]
+        a = a[~done]
+
+        # 右辺は代入の前に全て読み出されるので、同じ回の更新が混ざることはない
+        partial[active] += partial[a]
+        anc[active] = anc[a]
+
+
+def accumulate_ancestors_bfs(parent: np.ndarray, child_offsets: np.ndarray, values: np.ndarray, result: np.ndarray):
+    """BFS順に並んだツリーで、各ノードの祖先のvaluesの合計をresultに設定する
+
+    浅い階層は深さごとにまとめて計算し、LEVEL_LOOP_LIMITより深い部分はaccumulate_ancestors()で計算する。
+
+    Args:
+        parent (np.ndarray): 親ノードの番号、ルートは-1
+        child_offsets (np.ndarray): CompactTreeのchild_offsets
+        values (np.ndarray): ノードごとの値
+        result (np.ndarray): 結果を設定する配列、ルートの値は0にしておくこと
+    """
+    num_nodes = len(parent)
+
+    level_end = 1
+    for _ in range(LEVEL_LOOP_LIMIT):
+        if level_end >= num_nodes:
+            return
+        # 一つ下の階層は、今の階層の末尾のノードの子の先頭まで
+        next_end = int(child_offsets[level_end])
+        p = parent[level_end:next_end]
+        result[level_end:next_end] = result[p] + values[p]
+        level_end = next_end
+
+    if level_end < num_nodes:
+        accumulate_ancestors(parent, values, result, start=level_end)
+
+
+class CompactTree:
+
+    def __init__(self, names: list, parent: np.ndarray, child_offsets: np.ndarray):
+        """BFS順に並んだ配列からツリーを作成する
+
+        Args:
+            names (list): ノードの名前、BFS順
+            parent (np.ndarray): 親ノードの番号、ルートは-1
+            child_offsets (np.ndarray): 長さはノード数+1、ノードiの子は child_offsets[i] から child_offsets[i+1] - 1 まで
+        """
+        num_nodes = len(parent)
+
+        self.names = names
+        self.parent = parent
+        self.child_offsets = child_offsets
+
+        # ノードの位置情報
+        self.x = np.zeros(num_nodes, dtype=np.float64)
+        self.y = np.zeros(num_nodes, dtype=np.float64)
+        self.mod = np.zeros(num_nodes, dtype=np.float64)
+
+        # ツリーの深さ、祖先の数を数えればよい
+        self.depth = np.zeros(num_nodes, dtype=np.int32)
+        if num_nodes > 1:
+            accumulate_ancestors_bfs(parent, child_offsets, np.ones(num_nodes, dtype=np.int32), self.depth)
+
+    @staticmethod
+    def index_dtype(num_nodes: int):
+        return np.int32 if num_nodes < np.iinfo(np.int32).max else np.int64
+
+    @classmethod
+    def from_tree_node(cls, root: TreeNode) -> 'CompactTree':
+        """TreeNodeのツリーから作成する
+
+        Args:
+            root (TreeNode): ルートノード
+
+        Returns:
+            CompactTree: _description_
+        """
+        order = [root]
+        parent = [-1]
+        child_offsets = []
+
+        # BFS順にノードを並べる
+        # ノードiの子は、ノードiを処理する時点でorderの末尾に追加されるので、その位置がオフセットになる
+        i = 0
+        while i < len(order):
+            node = order[i]
+            child_offsets.append(len(order))
+            for child in node.children:
+                order.append(child)
+                parent.append(i)
+            i += 1
+        child_offsets.append(len(order))
+
+        dtype = cls.index_dtype(len(order))
+        tree = cls([node.node_name for node in order],
+                   np.array(parent, dtype=dtype),
+                   np.array(child_offsets, dtype=np.int64))
+
+        tree.x[:] = [node.x for node in order]
+        tree.y[:] = [node.y for node in order]
+        return tree
+
+    def to_tree_node(self) -> TreeNode:
+        """TreeNodeのツリーに変換する
+
+        位置情報もコピーする
+
+        Returns:
+            TreeNode: ルートノード
+        """
+        nodes = [TreeNode(name) for name in self.names]
+
+        child_offsets = self.child_offsets.tolist()
+        xs = self.x.tolist()
+        ys = self.y.tolist()
+        depths = self.depth.tolist()
+
+        for i, node in enumerate(nodes):
+            node.x = xs[i]
+            node.y = ys[i]
+            node.depth = depths[i]
+            node.children = nodes[child_offsets[i]:child_offsets[i+1]]
+            for child in node.children:
+                child.parent = node
+
+        return nodes[0]
+
+    def children(self, index: int) -> range:
+        return range(int(self.child_offsets[index]), int(self.child_offsets[index + 1]))
+
+    def nbytes(self) -> int:
+        """配列が消費しているメモリのバイト数（名前の文字列は含まない）"""
+        return sum(a.nbytes for a in (self.parent, self.child_offsets, self.x, self.y, self.mod, self.depth))
+
+    def __len__(self):
+        return len(self.parent)
+
+
+def calc_y_compact(tree: CompactTree):
+    """深さからY座標を設定する
+
+    TreeNodeのcalc_y_preorder()と同じく、ルートのY座標を0として深さごとにMINIMAL_Y_DISTANCEずつ離す
+    """
+    tree.y[:] = tree.depth * TreeNode.MINIMAL_Y_DISTANCE
+
+
+def calc_x_compact(tree: CompactTree):
+    """tree_layout.calc_x_postorder_buchheim()と同じ手順でX座標を計算する
+
+    BFS順で番号の大きい方から処理すると、子は必ず親より先に処理されるのでpostorderと同じになる。
+    配列の要素をNumPyのまま一つずつ読み書きすると遅いので、計算中はリストに変換して扱い、最後に配列に書き戻す。
+
+    Args:
+        tree (CompactTree): _description_
+    """
+    num_nodes = len(tree)
+    if num_nodes == 0:
+        return
+
+    offsets = tree.child_offsets.tolist()
+    minimal_distance = TreeNode.MINIMAL_X_DISTANCE
+
+    prelim = [0.0] * num_nodes
+    mod = [0.0] * num_nodes
+    thread = [-1] * num_nodes
+    thread_mod = [0.0] * num_nodes
+    height = [0] * num_nodes
+
+    def next_left(v, mod_sum):
+        if offsets[v] < offsets[v+1]:
+            return offsets[v], mod_sum
+        return thread[v], mod_sum + thread_mod[v]
+
+    def next_right(v, mod_sum):
+        if offsets[v] < offsets[v+1]:
+            return offsets[v+1] - 1, mod_sum
+        return thread[v], mod_sum + thread_mod[v]
+
+    def set_initial_x(v, prev):
+        # tree_layout.set_initial_x()と同じ
+        first, last = offsets[v], offsets[v+1] - 1
+        mod[v] = 0.0
+        if prev < 0:
+            if last < first:
+                prelim[v] = 0
+            elif first == last:
+                prelim[v] = prelim[first]
+            else:
+                prelim[v] = (prelim[first] + prelim[last]) / 2
+            return
+        prelim[v] = prelim[prev] + minimal_distance
+        if first == last:
+            mod[v] = prelim[v] - prelim[first]
+        elif first < last:
+            mod[v] = prelim[v] - (prelim[first] + prelim[last]) / 2
+
+    def apportion(lo, v, forest_height, resolve):
+        # tree_layout.apportion()と同じ
+        vil = v - 1
+        vir = vor = v
+        vol = lo
+        sil = mod[vil]
+        sir = sor = mod[v]
+        sol = mod[vol]
+
+        min_distance = sys.float_info.max
+        for _ in range(min(height[v], forest_height)):
+            vil, sil = next_right(vil, sil)
+            vir, sir = next_left(vir, sir)
+            vol, sol = next_left(vol, sol)
+            vor, sor = next_right(vor, sor)
+            if resolve:
+                distance = (prelim[vir] + sir) - (prelim[vil] + sil)
+                if distance < min_distance:
+                    min_distance = distance
+            sil += mod[vil]
+            sir += mod[vir]
+            sol += mod[vol]
+            sor += mod[vor]
+
+        if resolve and min_distance < minimal_distance:
+            shift_value = minimal_distance - min_distance
+            prelim[v] += shift_value
+            mod[v] += shift_value
+            sir += shift_value
+            sor += shift_value
+
+        if forest_height > height[v]:
+            next_node, next_mod_sum = next_right(vil, sil)
+            thread[vor] = next_node
+            thread_mod[vor] = next_mod_sum - sor
+        elif height[v] > forest_height:
+            next_node, next_mod_sum = next_left(vir, sir)
+            thread[vol] = next_node
+            thread_mod[vol] = next_mod_sum - sol
+
+    def contour_distance(left, right):
+        # tree_layout.get_contour_distance()と同じ
+        vil, vir = left, right
+        sil, sir = mod[vil], mod[vir]
+        min_distance = sys.float_info.max
+        for _ in range(min(height[left], height[right])):
+            vil, sil = next_right(vil, sil)
+            vir, sir = next_left(vir, sir)
+            distance = (prelim[vir] + sir) - (prelim[vil] + sil)
+            if distance < min_distance:
+                min_distance = distance
+            sil += mod[vil]
+            sir += mod[vir]
+        return min_distance
+
+    def equalize(lo, hi):
+        # tree_layout.equalize_position_buchheim()と同じ
+        num_nodes_between = hi - lo - 2
+        if num_nodes_between <= 0:
+            return False
+        desired_interval = (prelim[hi-1] - prelim[lo]) / (num_nodes_between + 1)
+        moved = False
+        for v in range(lo + 1, hi):
+            if v > lo + 1 and offsets[v] < offsets[v+1]:
+                distance = contour_distance(v - 1, v)
+                if distance < minimal_distance:
+                    shift_value = minimal_distance - distance
+                    prelim[v] += shift_value
+                    mod[v] += shift_value
+                    moved = True
+            if prelim[v] - prelim[v-1] < desired_interval:
+                shift_value = desired_interval - prelim[v] + prelim[v-1]
+                prelim[v] += shift_value
+                mod[v] += shift_value
+                moved = True
+        return moved
+
+    for node in range(num_nodes - 1, -1, -1):
+        lo, hi = offsets[node], offsets[node+1]
+        if lo == hi:
+            continue
+
+        # 子ノードは lo から hi - 1 まで連続している
+        height[node] = max(height[lo:hi]) + 1
+
+        forest_heights = []
+        forest_height = -1
+        for v in range(lo, hi):
+            set_initial_x(v, v - 1 if v > lo else -1)
+            if v > lo:
+                apportion(lo, v, forest_height, offsets[v] < offsets[v+1])
+            forest_height = max(forest_height, height[v])
+            forest_heights.append(forest_height)
+
+        if hi - lo > 1 and offsets[hi-1] < offsets[hi]:
+            if equalize(lo, hi):
+                for v in range(lo + 1, hi):
+                    apportion(lo, v, forest_heights[v - lo - 1], False)
+
+    set_initial_x(0, -1)
+
+    tree.mod[:] = mod
+    tree.x[:] = prelim
+    calc_x_finalize_compact(tree)
+
+
+def calc_x_finalize_compact(tree: CompactTree):
+    """親のmodを子に伝えてX座標を確定する
+
+    ノードiに適用されるmodの累積値は、iの祖先のmodの合計なので、
+    tree_layout.calc_x_preorder()のように一つずつ辿らずに、配列演算でまとめて求める
+
+    Args:
+        tree (CompactTree): x に相対位置、mod にサブツリーを動かす量が設定されていること
+    """
+    num_nodes = len(tree)
+
+    # mod_sum[i]はノードiに適用されるmodの累積値
+    mod_sum = np.zeros(num_nodes, dtype=np.float64)
+    accumulate_ancestors_bfs(tree.parent, tree.child_offsets, tree.mod, mod_sum)
+
+    tree.x += mod_sum
+
+
+def calc_tree_position_compact(tree: CompactTree):
+    """CompactTreeの位置を計算する
+
+    calc_tree_position(tree, engine="buchheim")と同じ座標が得られる
+    """
+    calc_y_compact(tree)
+    calc_x_compact(tree)
+
+
+if __name__ == '__main__':
+
+    import tracemalloc
+
+    from benchmark import create_caterpillar_tree, create_chain_tree, create_random_tree, measure
+    from tree_layout import calc_x_preorder, calc_y_preorder
+
+    def compare_passes(name: str, root: TreeNode):
+        """TreeNodeを一つずつ辿る計算と、配列演算による計算の所要時間を比べる"""
+        tree = CompactTree.from_tree_node(root)
+        print(f"--- {name} {len(tree)} nodes ---")
+        y_compact = measure(accumulate_ancestors_bfs, tree.parent, tree.child_offsets,
+                            np.ones(len(tree), dtype=np.int32), tree.depth) + measure(calc_y_compact, tree)
+        print(f"{'calc_y_preorder':<25} {measure(calc_y_preorder, root):.3f} sec")
+        print(f"{'depth + calc_y_compact':<25} {y_compact:.3f} sec")
+        print(f"{'calc_x_preorder':<25} {measure(calc_x_preorder, root):.3f} sec")
+        print(f"{'calc_x_finalize_compact':<25} {measure(calc_x_finalize_compact, tree):.3f} sec")
+
+    def main():
+        num_nodes = 200_000
+
+        tracemalloc.start()
+        root = create_caterpillar_tree(num_nodes)
+        tree_node_bytes = tracemalloc.get_traced_memory()[0]
+
+        tree = CompactTree.from_tree_node(root)
+        del root
+        tracemalloc.stop()
+
+        print(f"nodes: {len(tree)}")
+        print(f"TreeNode: {tree_node_bytes / 1024 / 1024:.1f} MiB")
+        print(f"CompactTree arrays: {tree.nbytes() / 1024 / 1024:.1f} MiB")
+        print(f"layout: {measure(calc_tree_position_compact, tree):.3f} sec")
+        del tree
+
+        compare_passes("random", create_random_tree(1_000_000))
+        compare_passes("chain", create_chain_tree(1_000_000))
+        return 0
+
+    sys.exit(main())
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+#
+# CompactTreeをそのままmmapできるバイナリ形式で保存する
+#
+# TreeNodeのツリーを作る方法はTreeNode(name, *children)しかなく、数百万ノードではレイアウトの計算よりも時間がかかる。
+# JSONを解析してCompactTreeを作る場合も、ファイルを読むたびに全体を解析し直すことになる。
+#
+# この形式はCompactTreeの配列をそのままファイルに並べたもので、読み込むときはmmapした領域を
+# np.frombuffer()で配列として参照するだけなので、ノードごとのオブジェクトを作らずにcalc_tree_position_compact()に渡せる。
+#
+# ファイルの構成
+#   ヘッダ          HEADER_SIZEバイト、HEADERの形式で次の値を持つ
+#                     magic, version, 親の番号のバイト数（4ならint32、8ならint64）, バイトオーダー（0ならリトルエンディアン）,
+#                     ノード数, 名前の種類の数, 以下の各領域の開始位置, 名前の領域のバイト数
+#   親の番号        int32またはint64 × ノード数、BFS順、ルートは-1
+#   子のオフセット  int64 × (ノード数 + 1)、ノードiの子は child_offsets[i] から child_offsets[i+1] - 1 まで
+#   名前の番号      int32またはint64 × ノード数、ノードiの名前は名前表のname_ids[i]番目
+#   名前表のオフセット  uint64 × (名前の種類の数 + 1)
+#   名前表          UTF-8でエンコードした名前を連結したもの
+#
+# 名前表には同じ名前を一度だけ格納する（intern）。
+# 組織図の役職名のように同じラベルを持つノードが多いツリーでは、名前の領域が小さくなる。
+#
+# 各領域の開始位置は8バイト境界に揃えてあり、ヘッダ以外はネイティブのバイトオーダーで書く。
+#
+# 使い方
+#   write_csr_tree(load_compact_tree("tree.json"), "tree.csr")
+#
+#   tree = load_csr_tree("tree.csr")
+#   calc_tree_position_compact(tree)
+#
+
+import mmap
+import struct
+import sys
+
+from itertools import accumulate
+
+import numpy as np
+
+from compact_tree import CompactTree
+from layout_file import BYTEORDER_BIG, BYTEORDER_LITTLE, align
+
+# tree-layoutのCSR_MAGICと同じ値にする
+MAGIC = b'TREECSR1'
+VERSION = 1
+
+# magic, version, index_itemsize, byteorder, num_nodes, num_names,
+# parent_offset, child_offsets_offset, name_ids_offset, name_offsets_offset, names_offset, names_size
+HEADER = struct.Struct('<8sIHHQQQQQQQQ')
+
+# 後から項目を追加できるように、ヘッダの領域は大きめに確保しておく
+HEADER_SIZE = 128
+
+
+class NameTable:
+
+    def __init__(self, name_ids: np.ndarray, name_offsets: np.ndarray, names: memoryview):
+        """名前の番号と名前表から、ノードの名前を必要になったときに取り出すシーケンス
+
+        CompactTree.namesとして、名前のリストの代わりに使う
+
+        Args:
+            name_ids (np.ndarray): ノードごとの名前の番号
+            name_offsets (np.ndarray): 名前表の中での各名前の開始位置
+            names (memoryview): UTF-8でエンコードした名前を連結したもの
+        """
+        self.name_ids = name_ids
+        self.name_offsets = name_offsets
+        self.names = names
+
+    def name(self, name_id: int) -> str:
+        """名前表のname_id番目の名前を返す"""
+        start = int(self.name_offsets[name_id])
+        end = int(self.name_offsets[name_id + 1])
+        return str(self.names[start:end], 'utf-8')
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.name(name_id) for name_id in self.name_ids[index].tolist()]
+        return self.name(int(self.name_ids[index]))
+
+    def __iter__(self):
+        # 名前の番号は一定数ずつリストにしてから引く
+        for start in range(0, len(self.name_ids), 1 << 16):
+            for name_id in self.name_ids[start:start + (1 << 16)].tolist():
+                yield self.name(name_id)
+
+    def __len__(self):
+        return len(self.name_ids)
+
+
+def write_csr_tree(tree, fp):
+    """ツリーをmmapで読み込める形式で書き出す
+
+    Args:
+        tree (_type_): CompactTree、またはTreeNodeのルートノード
+        fp (_type_): ファイル名、またはバイナリモードで開いたファイル
+    """
+    if isinstance(fp, str):
+        with open(fp, 'wb') as f:
+            return write_csr_tree(tree, f)
+
+    if not hasattr(tree, 'child_offsets'):
+        tree = CompactTree.from_tree_node(tree)
+
+    num_nodes = len(tree)
+    index_dtype = CompactTree.index_dtype(num_nodes)
+
+    # 同じ名前には同じ番号を振る
+    name_index = {}
+    name_ids = np.fromiter((name_index.setdefault(str(name), len(name_index)) for name in tree.names),
+                           dtype=index_dtype, count=num_nodes)
+    names = [name.encode('utf-8') for name in name_index]
+    del name_index
+
+    name_offsets = np.zeros(len(names) + 1, dtype=np.uint64)
+    name_offsets[1:] = list(accumulate(map(len, names)))
+    names_size = int(name_offsets[-1])
+
+    parent = np.ascontiguousarray(tree.parent, dtype=index_dtype)
+    child_offsets = np.ascontiguousarray(tree.child_offsets, dtype=np.int64)
+
+    parent_offset = HEADER_SIZE
+    child_offsets_offset = align(parent_offset + parent.nbytes)
+    name_ids_offset = align(child_offsets_offset + child_offsets.nbytes)
+    name_offsets_offset = align(name_ids_offset + name_ids.nbytes)
+    names_offset = align(name_offsets_offset + name_offsets.nbytes)
+
+    byteorder = BYTEORDER_LITTLE if sys.byteorder == 'little' else BYTEORDER_BIG
+    header = HEADER.pack(MAGIC, VERSION, parent.itemsize, byteorder, num_nodes, len(names),
+                         parent_offset, child_offsets_offset, name_ids_offset, name_offsets_offset,
+                         names_offset, names_size)
+
+    position = 0
+
+    def write_at(offset, data):
+        # 8バイト境界に揃えるための隙間を0で埋める
+        nonlocal position
+        fp.write(bytes(offset - position))
+        fp.write(data)
+        position = offset + memoryview(data).nbytes
+
+    write_at(0, header.ljust(HEADER_SIZE, b'\0'))
+    write_at(parent_offset, parent)
+    write_at(child_offsets_offset, child_offsets)
+    write_at(name_ids_offset, name_ids)
+    write_at(name_offsets_offset, name_offsets)
+
+    fp.write(bytes(names_offset - position))
+    fp.writelines(names)
+
+
+def load_csr_tree(path: str) -> CompactTree:
+    """write_csr_tree()で書き出したファイルをmmapで開き、CompactTreeを作成する
+
+    親の番号、子のオフセット、名前はファイルをそのまま参照するので、ノード数に比例するのは
+    CompactTreeが計算用に確保する配列（x, y, mod, depth）だけになる。
+    参照している配列がなくなればmmapも閉じられる。
+
+    Args:
+        path (str): ファイル名
+
+    Raises:
+        ValueError: 形式が異なるファイルの場合
+
+    Returns:
+        CompactTree: namesはNameTable、parentとchild_offsetsは読み取り専用の配列
+    """
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(mm) < HEADER_SIZE:
+        mm.close()
+        raise ValueError(f"not a CSR tree file: {path}")
+
+    (magic, version, index_itemsize, byteorder, num_nodes, num_names,
+     parent_offset, child_offsets_offset, name_ids_offset, name_offsets_offset,
+     names_offset, names_size) = HEADER.unpack_from(mm)
+
+    error = None
+    if magic != MAGIC:
+        error = f"not a CSR tree file: {path}"
+    elif version != VERSION:
+        error = f"unsupported CSR tree file version: {version}"
+    elif index_itemsize not in (4, 8):
+        error = f"unsupported index size: {index_itemsize}"
+    elif byteorder != (BYTEORDER_LITTLE if sys.byteorder == 'little' else BYTEORDER_BIG):
+        error = "byte order of the CSR tree file does not match this machine"
+    elif names_offset + names_size > len(mm):
+        error = f"CSR tree file is truncated: {path}"
+    if error is not None:
+        mm.close()
+        raise ValueError(error)
+
+    index_dtype = np.int32 if index_itemsize == 4 else np.int64
+
+    parent = np.frombuffer(mm, dtype=index_dtype, count=num_nodes, offset=parent_offset)
+    child_offsets = np.frombuffer(mm, dtype=np.int64, count=num_nodes + 1, offset=child_offsets_offset)
+    name_ids = np.frombuffer(mm, dtype=index_dtype, count=num_nodes, offset=name_ids_offset)
+    name_offsets = np.frombuffer(mm, dtype=np.uint64, count=num_names + 1, offset=name_offsets_offset)
+    names = memoryview(mm)[names_offset:names_offset + names_size]
+
+    return CompactTree(NameTable(name_ids, name_offsets, names), parent, child_offsets)
+
+
+if __name__ == '__main__':
+
+    import json
+    import os
+    import tempfile
+    import time
+
+    from benchmark import create_random_tree
+    from compact_tree import calc_tree_position_compact
+    from tree_json import load_compact_tree, write_preset_json
+
+    def main():
+        num_nodes = 1_000_000
+
+        tree = CompactTree.from_tree_node(create_random_tree(num_nodes, seed=0))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            json_path = os.path.join(tmpdir, "tree.json")
+            csr_path = os.path.join(tmpdir, "tree.csr")
+
+            # data/test_tree_*.json と同じ形式
+            with open(json_path, 'w', encoding='utf-8') as fp:
+                fp.write('[\n')
+                for i, name in enumerate(tree.names):
+                    children = [tree.names[c] for c in tree.children(i)]
+                    fp.write(('' if i == 0 else ',\n') + json.dumps({'group': 'nodes', 'data': {'id': name, 'children': children}}))
+                fp.write('\n]\n')
+
+            start = time.perf_counter()
+            json_tree = load_compact_tree(json_path)
+            print(f"load JSON: {time.perf_counter() - start:.3f} sec, {os.path.getsize(json_path):,} bytes")
+
+            write_csr_tree(json_tree, csr_path)
+
+            start = time.perf_counter()
+            csr_tree = load_csr_tree(csr_path)
+            print(f"load CSR: {time.perf_counter() - start:.3f} sec, {os.path.getsize(csr_path):,} bytes")
+
+            start = time.perf_counter()
+            calc_tree_position_compact(csr_tree)
+            print(f"layout: {time.perf_counter() - start:.3f} sec")
+
+            calc_tree_position_compact(json_tree)
+            same = np.array_equal(json_tree.x, csr_tree.x) and list(json_tree.names) == list(csr_tree.names)
+            print(f"same as JSON: {same}")
+
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as fp:
+                write_preset_json(csr_tree, fp)
+            print(f"write preset JSON: {time.perf_counter() - start:.3f} sec")
+
+            del csr_tree
+        return 0
+
+    sys.exit(main())
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+#
+# 計算した位置をバイナリファイルに保存し、mmapで読み込んでノードのidから位置を引く
+#
+# 数百万ノードのツリーでは、サービスを起動するたびにJSONを解析したりレイアウトを計算し直したりするのに時間がかかる。
+# 一度計算した位置をこのファイルに書いておけば、読み込む側はファイル全体を解析せずに、
+# 必要なノードの位置だけをO(log n)で取り出せる。
+#
+# ファイルの構成
+#   ヘッダ        HEADER_SIZEバイト、HEADERの形式で次の値を持つ
+#                   magic, version, 列の要素のバイト数（4ならfloat32、8ならfloat64）, バイトオーダー（0ならリトルエンディアン）,
+#                   ノード数, 以下の各領域の開始位置, 名前の領域のバイト数
+#   名前のオフセット  uint64 × (ノード数 + 1)、i番目のノードの名前は names[offsets[i]:offsets[i+1]]
+#   X座標         float32またはfloat64 × ノード数
+#   Y座標         float32またはfloat64 × ノード数
+#   深さ          int32 × ノード数
+#   名前          UTF-8でエンコードした名前を連結したもの
+#
+# ノードは名前のバイト列の昇順に並べてあるので、名前は二分探索で引ける。
+# 列はヘッダ以外ネイティブのバイトオーダーで書き、読み込むときはmemoryviewでそのまま参照する（コピーしない）。
+# 各領域の開始位置は8バイト境界に揃えてある。
+#
+# 使い方
+#   calc_tree_position(tree, engine="buchheim")
+#   write_layout_file(tree, "positions.bin")
+#
+#   with LayoutFile("positions.bin") as layout:
+#       x, y, depth = layout["root"]
+#
+
+import mmap
+import struct
+import sys
+
+from array import array
+from itertools import accumulate, islice
+
+MAGIC = b'TREELAYT'
+VERSION = 1
+
+# magic, version, itemsize, byteorder, num_nodes, offsets_offset, x_offset, y_offset, depth_offset, names_offset, names_size
+HEADER = struct.Struct('<8sIHHQQQQQQQ')
+
+# 後から項目を追加できるように、ヘッダの領域は大きめに確保しておく
+HEADER_SIZE = 128
+
+BYTEORDER_LITTLE = 0
+BYTEORDER_BIG = 1
+
+# 列の要素のバイト数とarrayの型コード
+COLUMN_TYPECODES = {4: 'f', 8: 'd'}
+
+
+def align(offset: int, alignment: int = 8) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def iter_layout_items(tree):
+    """計算済みのツリーから(名前, x, y, 深さ)を順に取り出す
+
+    Args:
+        tree (_type_): TreeNode、BinaryTreeNodeのルートノード、またはCompactTree
+
+    Yields:
+        tuple: (name, x, y, depth)
+    """
+    if tree is None:
+        return
+
+    if hasattr(tree, 'child_offsets'):
+        yield from zip(tree.names, tree.x.tolist(), tree.y.tolist(), tree.depth.tolist())
+        return
+
+    binary = not hasattr(tree, 'children')
+
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if binary:
+            yield node.data, node.x, node.y, node.depth
+            stack.extend(c for c in (node.right, node.left) if c is not None)
+        else:
+            yield node.node_name, node.x, node.y, node.depth
+            stack.extend(reversed(node.children))
+
+
+def write_layout_file(tree, fp, horizontal: bool = False, x_scale: float = 1.0, y_scale: float = 1.0,
+                      itemsize: int = 8):
+    """計算済みのツリーの位置をバイナリファイルに書き出す
+
+    名前はstr()で文字列にしてから保存する。
+
+    Args:
+        tree (_type_): TreeNode、BinaryTreeNodeのルートノード、またはCompactTree
+        fp (_type_): ファイル名、またはバイナリモードで開いたファイル
+        horizontal (bool, optional): X座標とY座標を入れ替える. Defaults to False.
+        x_scale (float, optional): X座標に掛ける倍率. Defaults to 1.0.
+        y_scale (float, optional): Y座標に掛ける倍率. Defaults to 1.0.
+        itemsize (int, optional): 座標のバイト数、4ならfloat32、8ならfloat64. Defaults to 8.
+
+    Raises:
+        ValueError: 同じ名前のノードが複数ある場合
+    """
+    if isinstance(fp, str):
+        with open(fp, 'wb') as f:
+            return write_layout_file(tree, f, horizontal=horizontal, x_scale=x_scale, y_scale=y_scale,
+                                     itemsize=itemsize)
+
+    typecode = COLUMN_TYPECODES.get(itemsize)
+    if typecode is None:
+        raise ValueError(f"itemsize must be 4 or 8: {itemsize}")
+
+    keys = []
+    xs = []
+    ys = []
+    depths = []
+    for name, x, y, depth in iter_layout_items(tree):
+        keys.append(str(name).encode('utf-8'))
+        xs.append(x)
+        ys.append(y)
+        depths.append(depth)
+    if horizontal:
+        xs, ys = ys, xs
+        x_scale, y_scale = y_scale, x_scale
+
+    num_nodes = len(keys)
+
+    # 名前のバイト列の昇順に並べる
+    order = sorted(range(num_nodes), key=keys.__getitem__)
+    keys = [keys[i] for i in order]
+
+    for previous, key in zip(keys, islice(keys, 1, None)):
+        if previous == key:
+            raise ValueError(f"duplicate node id: {key.decode('utf-8')}")
+
+    offsets = array('Q', [0])
+    offsets.extend(accumulate(map(len, keys)))
+    names_size = offsets[-1]
+
+    x_column = array(typecode, [xs[i] * x_scale for i in order])
+    y_column = array(typecode, [ys[i] * y_scale for i in order])
+    depth_column = array('i', [depths[i] for i in order])
+    del xs, ys, depths, order
+
+    offsets_offset = HEADER_SIZE
+    x_offset = align(offsets_offset + offsets.itemsize * len(offsets))
+    y_offset = align(x_offset + itemsize * num_nodes)
+    depth_offset = align(y_offset + itemsize * num_nodes)
+    names_offset = align(depth_offset + depth_column.itemsize * num_nodes)
+
+    byteorder = BYTEORDER_LITTLE if sys.byteorder == 'little' else BYTEORDER_BIG
+    header = HEADER.pack(MAGIC, VERSION, itemsize, byteorder, num_nodes,
+                         offsets_offset, x_offset, y_offset, depth_offset, names_offset, names_size)
+
+    position = 0
+
+    def write_at(offset, data):
+        # 8バイト境界に揃えるための隙間を0で埋める
+        nonlocal position
+        fp.write(bytes(offset - position))
+        fp.write(data)
+        position = offset + memoryview(data).nbytes
+
+    write_at(0, header.ljust(HEADER_SIZE, b'\0'))
+    write_at(offsets_offset, offsets)
+    write_at(x_offset, x_column)
+    write_at(y_offset, y_column)
+    write_at(depth_offset, depth_column)
+
+    # 名前はまとめて連結するとノード数に比例したメモリを使うので、一つずつ書き込む
+    fp.write(bytes(names_offset - position))
+    fp.writelines(keys)
+
+
+class LayoutFile:
+
+    def __init__(self, path: str):
+        """write_layout_file()で書き出したファイルをmmapで開く
+
+        Args:
+            path (str): ファイル名
+
+        Raises:
+            ValueError: 形式が異なるファイルの場合
+        """
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if len(self.mm) < HEADER_SIZE:
+                raise ValueError(f"not a layout file: {path}")
+
+            (magic, version, itemsize, byteorder, num_nodes,
+             offsets_offset, x_offset, y_offset, depth_offset, names_offset, names_size) = HEADER.unpack_from(self.mm)
+
+            if magic != MAGIC:
+                raise ValueError(f"not a layout file: {path}")
+            if version != VERSION:
+                raise ValueError(f"unsupported layout file version: {version}")
+            if itemsize not in COLUMN_TYPECODES:
+                raise ValueError(f"unsupported column size: {itemsize}")
+            if byteorder != (BYTEORDER_LITTLE if sys.byteorder == 'little' else BYTEORDER_BIG):
+                raise ValueError("byte order of the layout file does not match this machine")
+            if names_offset + names_size > len(self.mm):
+                raise ValueError(f"layout file is truncated: {path}")
+
+            self.num_nodes = num_nodes
+            self.itemsize = itemsize
+            self.names_offset = names_offset
+
+            # 各列はmmapをそのまま参照する
+            view = memoryview(self.mm)
+            typecode = COLUMN_TYPECODES[itemsize]
+            self.offsets = view[offsets_offset:offsets_offset + 8 * (num_nodes + 1)].cast('Q')
+            self.x = view[x_offset:x_offset + itemsize * num_nodes].cast(typecode)
+            self.y = view[y_offset:y_offset + itemsize * num_nodes].cast(typecode)
+            self.depth = view[depth_offset:depth_offset + 4 * num_nodes].cast('i')
+            view.release()
+        except Exception:
+            self.close()
+            raise
+
+    def name_bytes(self, index: int) -> bytes:
+        """index番目（名前の昇順）のノードの名前をバイト列で返す"""
+        start = self.names_offset + self.offsets[index]
+        end = self.names_offset + self.offsets[index + 1]
+        return self.mm[start:end]
+
+    def name(self, index: int) -> str:
+        return self.name_bytes(index).decode('utf-8')
+
+    def find(self, node_id) -> int:
+        """名前からノードの番号を二分探索で求める
+
+        Args:
+            node_id (_type_): ノードの名前、文字列でなければstr()で変換する
+
+        Returns:
+            int: ノードの番号、見つからなければ-1
+        """
+        key = str(node_id).encode('utf-8')
+
+        lo = 0
+        hi = self.num_nodes
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.name_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < self.num_nodes and self.name_bytes(lo) == key:
+            return lo
+        return -1
+
+    def get(self, node_id, default=None) -> tuple:
+        """ノードの位置を返す
+
+        Returns:
+            tuple: (x, y, depth)、見つからなければdefault
+        """
+        i = self.find(node_id)
+        if i < 0:
+            return default
+        return self.x[i], self.y[i], self.depth[i]
+
+    def items(self):
+        """名前の昇順に(名前, x, y, 深さ)を順に取り出す"""
+        for i in range(self.num_nodes):
+            yield self.name(i), self.x[i], self.y[i], self.depth[i]
+
+    def close(self):
+        # memoryviewがmmapを参照したままだと閉じられない
+        for name in ('offsets', 'x', 'y', 'depth'):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+                setattr(self, name, None)
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def __getitem__(self, node_id) -> tuple:
+        position = self.get(node_id)
+        if position is None:
+            raise KeyError(node_id)
+        return position
+
+    def __contains__(self, node_id) -> bool:
+        return self.find(node_id) >= 0
+
+    def __len__(self):
+        return self.num_nodes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == '__main__':
+
+    import math
+    import os
+    import tempfile
+    import time
+
+    from benchmark import create_random_tree
+    from tree_layout import calc_tree_position, preorder
+
+    def main():
+        num_nodes = 1_000_000
+
+        tree = create_random_tree(num_nodes, seed=0)
+        calc_tree_position(tree, engine="buchheim")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for itemsize in (8, 4):
+                path = os.path.join(tmpdir, f"layout{itemsize}.bin")
+
+                start = time.perf_counter()
+                write_layout_file(tree, path, itemsize=itemsize)
+                print(f"write float{itemsize * 8}: {time.perf_counter() - start:.3f} sec, {os.path.getsize(path):,} bytes")
+
+                start = time.perf_counter()
+                with LayoutFile(path) as layout:
+                    opened = time.perf_counter() - start
+
+                    nodes = list(preorder(tree))[::1000]
+                    start = time.perf_counter()
+                    same = all(math.isclose(layout[node.node_name][0], node.x, rel_tol=1e-6, abs_tol=1e-3)
+                               for node in nodes)
+                    elapsed = time.perf_counter() - start
+                print(f"open: {opened * 1000:.3f} msec, lookup: {elapsed / len(nodes) * 1e6:.1f} usec/node, same: {same}")
+        return 0
+
+    sys.exit(main())
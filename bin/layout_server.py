@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+
+#
+# ブラウザの代わりにレイアウトを計算するHTTPサービス
+#
+# iida.layout.tree.jsはブラウザの中でcalc_x_postorder()と同じ計算をするため、大きなツリーではページが固まってしまう。
+# このサービスにツリーを送れば、計算済みの位置がcytoscape.jsのpresetレイアウトの形式で返ってくる。
+#
+#   POST /layout
+#     リクエスト  iida.appdata.get_elements()に渡すものと同じ要素のリスト、
+#                 または {"elements": [...], "options": {...}} の形のオブジェクト
+#                 optionsはiida.layout.tree.jsと同じく root_id, horizontal, minimal_x_distance, minimal_y_distance を受け付け、
+#                 さらに engine（buchheim, classic, compact, memo）を指定できる
+#     レスポンス  {"name": "preset", "positions": {"id": {"x": 0.0, "y": 0.0}, ...}}
+#
+#   GET /health   {"status": "ok"}
+#   GET /stats    受け付けたリクエストの数、まとめたリクエストの数など
+#
+# ブラウザ側では、受け取った位置を次のように適用するだけでよい。
+#
+#   cy.layout(await (await fetch(url, { method: 'POST', body: JSON.stringify(elements) })).json()).run();
+#
+# JSONの解析もレイアウトの計算もプロセスプールで行い、イベントループではリクエストのバイト列を受け渡すだけにする。
+# 同じ内容のリクエストが計算中に届いた場合は、新たに計算せずに計算中の結果を待って同じレスポンスを返す。
+#
+# 標準ライブラリだけで動くように、HTTP/1.1はContent-Lengthで本文の長さが分かるリクエストだけを扱う。
+# ローカルで起動する前提なので、認証やTLSは扱わない。
+#
+#   bin/tree-layout serve --port 8080
+#
+
+import asyncio
+import hashlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+
+from tree_json import build_tree_arrays, create_tree_node, write_preset_json
+
+# 待ち受けるアドレスとポート
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+# 受け付ける本文の最大サイズ
+MAX_BODY_SIZE = 256 << 20
+
+# 使えるレイアウトの計算方法
+# parallelはワーカープロセスの中からさらにプロセスを起動することになるので使えない
+ENGINES = ('buchheim', 'classic', 'compact', 'memo')
+DEFAULT_ENGINE = 'buchheim'
+
+# iida.layout.tree.jsでoptionsに指定がない場合の値
+DEFAULT_MINIMAL_X_DISTANCE = 50
+DEFAULT_MINIMAL_Y_DISTANCE = 100
+
+# optionsに指定できる値の型、Noneは指定がないのと同じ
+# boolはintのサブクラスなので、数値の項目には別に確認する
+# 数値の項目は座標の倍率になるので、1e400のような無限大を受け付けるとレスポンスにnanが入る
+OPTION_TYPES = {
+    'engine': str,
+    'root_id': str,
+    'horizontal': bool,
+    'minimal_x_distance': (int, float),
+    'minimal_y_distance': (int, float),
+}
+
+# これより大きな本文のハッシュ値はスレッドで計算して、イベントループを止めないようにする
+INLINE_HASH_SIZE = 1 << 20
+
+
+def parse_layout_request(body: bytes) -> tuple:
+    """リクエストの本文から要素のリストとオプションを取り出す
+
+    Args:
+        body (bytes): リクエストの本文
+
+    Raises:
+        ValueError: 形式が正しくない場合
+
+    Returns:
+        tuple: (elements, options)
+    """
+    try:
+        request = json.loads(body)
+    except json.JSONDecodeError as e:
+        # 例外にはリクエストの本文全体が含まれるので、メッセージだけをメインプロセスに返す
+        raise ValueError(f"invalid JSON: {e}") from None
+
+    if isinstance(request, list):
+        return request, {}
+
+    if not isinstance(request, dict):
+        raise ValueError("request must be a list of elements or an object with elements")
+
+    elements = request.get('elements')
+    options = request.get('options') or {}
+    if not isinstance(elements, list):
+        raise ValueError("elements must be a list")
+    if not isinstance(options, dict):
+        raise ValueError("options must be an object")
+    return elements, options
+
+
+def validate_options(options: dict):
+    """optionsの値の型を確認する
+
+    Raises:
+        ValueError: 型が正しくない場合
+    """
+    for name, types in OPTION_TYPES.items():
+        value = options.get(name)
+        if value is None:
+            continue
+        if not isinstance(value, types) or (types is not bool and isinstance(value, bool)):
+            raise ValueError(f"invalid type for option {name}: {type(value).__name__}")
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError(f"option {name} must be a finite number")
+
+
+def layout_elements(body: bytes) -> bytes:
+    """ワーカープロセスで実行する、リクエストの本文からツリーを作って位置を計算し、レスポンスの本文を返す
+
+    Args:
+        body (bytes): リクエストの本文
+
+    Raises:
+        ValueError: リクエストが正しくない場合
+
+    Returns:
+        bytes: presetレイアウトのJSON
+    """
+    elements, options = parse_layout_request(body)
+    validate_options(options)
+
+    engine = options.get('engine', DEFAULT_ENGINE)
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine: {engine}")
+
+    names, parent, child_offsets = build_tree_arrays(elements, root_id=options.get('root_id'))
+    del elements
+
+    if engine == 'compact':
+        import numpy as np
+        from compact_tree import CompactTree, calc_tree_position_compact
+        tree = CompactTree(names, np.array(parent, dtype=CompactTree.index_dtype(len(names))),
+                           np.array(child_offsets, dtype=np.int64))
+        calc_tree_position_compact(tree)
+    else:
+        from tree_layout import calc_tree_position
+        tree = create_tree_node(names, child_offsets)
+        calc_tree_position(tree, engine=engine)
+
+    fp = io.StringIO()
+    write_preset_json(tree, fp,
+                      horizontal=options.get('horizontal') is True,
+                      x_scale=float(options.get('minimal_x_distance') or DEFAULT_MINIMAL_X_DISTANCE),
+                      y_scale=float(options.get('minimal_y_distance') or DEFAULT_MINIMAL_Y_DISTANCE))
+    return fp.getvalue().encode('utf-8')
+
+
+class HttpError(Exception):
+
+    def __init__(self, status: HTTPStatus, message: str = None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+async def read_request(reader: asyncio.StreamReader) -> tuple:
+    """HTTPリクエストを一つ読み込む
+
+    Args:
+        reader (asyncio.StreamReader): _description_
+
+    Raises:
+        HttpError: リクエストが正しくない場合
+
+    Returns:
+        tuple: (method, path, version, headers, body)、接続が閉じられていればNone
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "malformed request line")
+    method, target, version = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'transfer-encoding' in headers:
+        raise HttpError(HTTPStatus.LENGTH_REQUIRED, "chunked request body is not supported")
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "invalid Content-Length") from None
+    if length < 0:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "invalid Content-Length")
+    if length > MAX_BODY_SIZE:
+        raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+    body = await reader.readexactly(length) if length else b''
+
+    path = target.split('?', 1)[0]
+    return method, path, version, headers, body
+
+
+def write_response(writer: asyncio.StreamWriter, status: HTTPStatus, body: bytes, keep_alive: bool):
+    headers = [
+        f"HTTP/1.1 {status.value} {status.phrase}",
+        "Content-Type: application/json",
+        f"Content-Length: {len(body)}",
+        # ローカルのHTMLファイルから呼び出せるようにする
+        "Access-Control-Allow-Origin: *",
+        "Access-Control-Allow-Methods: GET, POST, OPTIONS",
+        "Access-Control-Allow-Headers: Content-Type",
+        "Connection: keep-alive" if keep_alive else "Connection: close",
+    ]
+    writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1'))
+    writer.write(body)
+
+
+def hash_body(body: bytes) -> bytes:
+    """同じ内容のリクエストをまとめるためのキー"""
+    return hashlib.sha256(body).digest()
+
+
+def json_body(value) -> bytes:
+    return json.dumps(value).encode('utf-8')
+
+
+class LayoutServer:
+
+    def __init__(self, workers: int = None):
+        """レイアウトを計算するHTTPサーバ
+
+        Args:
+            workers (int, optional): ワーカープロセスの数. Defaults to None（CPUの数）.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+
+        # 待ち受けているソケット、serve()で設定する
+        self.sockets = None
+
+        # 計算中のリクエストの本文のハッシュ値と、その計算結果を待つタスク
+        self.pending = {}
+
+        self.stats = {
+            'requests': 0,
+            'layouts': 0,
+            'coalesced': 0,
+            'errors': 0,
+        }
+
+    async def layout(self, body: bytes) -> bytes:
+        """本文が同じリクエストが計算中であれば、その結果を待つ
+
+        Args:
+            body (bytes): リクエストの本文
+
+        Returns:
+            bytes: レスポンスの本文
+        """
+        loop = asyncio.get_running_loop()
+        if len(body) > INLINE_HASH_SIZE:
+            # hashlibは大きなデータではGILを解放するので、スレッドで計算すれば他の接続を待たせない
+            key = await loop.run_in_executor(None, hash_body, body)
+        else:
+            key = hash_body(body)
+
+        task = self.pending.get(key)
+        if task is None:
+            self.stats['layouts'] += 1
+            task = asyncio.ensure_future(loop.run_in_executor(self.executor, layout_elements, body))
+            self.pending[key] = task
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        else:
+            self.stats['coalesced'] += 1
+
+        # 待っているクライアントの一つが切断しても、計算は他のクライアントのために続ける
+        return await asyncio.shield(task)
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> tuple:
+        """リクエストを処理する
+
+        Returns:
+            tuple: (status, レスポンスの本文)
+        """
+        if method == 'OPTIONS':
+            return HTTPStatus.NO_CONTENT, b''
+
+        if path == '/layout':
+            if method != 'POST':
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED)
+            try:
+                return HTTPStatus.OK, await self.layout(body)
+            except ValueError as e:
+                raise HttpError(HTTPStatus.BAD_REQUEST, str(e)) from None
+
+        if path == '/health':
+            return HTTPStatus.OK, json_body({'status': 'ok'})
+
+        if path == '/stats':
+            return HTTPStatus.OK, json_body(dict(self.stats, pending=len(self.pending), workers=self.workers))
+
+        raise HttpError(HTTPStatus.NOT_FOUND)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    method, path, version, headers, body = request
+
+                    # HTTP/1.1は明示的に閉じない限り接続を維持する
+                    connection = headers.get('connection', '').lower()
+                    keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+                    self.stats['requests'] += 1
+                    status, response = await self.dispatch(method, path, body)
+                except HttpError as e:
+                    self.stats['errors'] += 1
+                    status, response = e.status, json_body({'error': str(e)})
+                    keep_alive = False
+                except asyncio.IncompleteReadError:
+                    break
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    status, response = HTTPStatus.INTERNAL_SERVER_ERROR, json_body({'error': repr(e)})
+                    keep_alive = False
+
+                write_response(writer, status, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, ready: asyncio.Event = None):
+        """サーバを起動し、キャンセルされるまで待ち受ける
+
+        Args:
+            host (str, optional): 待ち受けるアドレス. Defaults to DEFAULT_HOST.
+            port (int, optional): 待ち受けるポート、0なら空いているポートを使う. Defaults to DEFAULT_PORT.
+            ready (asyncio.Event, optional): 待ち受けを始めたらセットする. Defaults to None.
+        """
+        # forkでワーカーを作ると、その時点で開いている待ち受けのソケットやクライアントのソケットを引き継いでしまい、
+        # Connection: closeのリクエストでも接続が閉じなくなる
+        # forkserverかspawnで作ったワーカーはイベントループのファイルディスクリプタを持たない
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method)) as executor:
+            self.executor = executor
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            self.sockets = server.sockets
+            async with server:
+                if ready is not None:
+                    ready.set()
+                await server.serve_forever()
+
+
+def run_server(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, workers: int = None):
+    """Ctrl-Cで止めるまでサーバを動かす"""
+    server = LayoutServer(workers=workers)
+    print(f"listening on http://{host}:{port}/layout", file=sys.stderr)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="tree layout HTTP service")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    run_server(args.host, args.port, args.workers)
+    return 0
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: CPUs)")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
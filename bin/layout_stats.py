@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+#
+# レイアウト計算の統計情報を集める
+#
+# 大きなツリーのレイアウトに突然時間がかかるようになったとき、
+# プロファイラをつながなくても、どのフェーズでどれだけ輪郭を辿ったのかが分かるようにする。
+#
+# 使い方
+#   with collect_layout_stats() as stats:
+#       calc_tree_position(tree, engine="buchheim")
+#   print(stats.as_dict())
+#
+# with文の中だけ統計情報を集め、外では各関数がcurrentがNoneであることを確認するだけになる。
+# 集める値は次の通り。
+#   phases            フェーズごとの経過時間（秒）
+#                       y         Y座標と深さを決める
+#                       x_postorder  postorderで兄弟の相対位置を決める
+#                       finalize  相対位置から絶対位置を決める（engine="buchheim"ではY座標と深さもここで決める）
+#                       reset     engine="buchheim"で前回の計算結果を捨てる
+#   nodes_visited     x_postorderで処理したノード数（relayout()ではdirtyなノードだけ）
+#   distance_calls    兄弟のサブツリー同士の間隔を求めた回数（get_minimum_distance_between()などの呼び出し回数）
+#   contour_nodes     間隔を求めるために辿った輪郭のノード数の合計
+#   equalize_shifts   兄弟の位置を均等化するために兄弟を動かした回数
+#   peak_contour      一度に比較した輪郭の最大の深さ
+#
+# parallel_layout.calc_tree_position_parallel()ではワーカープロセスの中の値は集めず、フェーズの時間だけを集める。
+#
+
+import time
+
+from contextlib import contextmanager, nullcontext
+
+# collect_layout_stats()の中で使われている統計情報、それ以外ではNone
+current: 'LayoutStats' = None
+
+
+class LayoutStats:
+
+    def __init__(self):
+        self.phases = {}
+        self.nodes_visited = 0
+        self.distance_calls = 0
+        self.contour_nodes = 0
+        self.equalize_shifts = 0
+        self.peak_contour = 0
+
+    @contextmanager
+    def phase(self, name: str):
+        """with文の中の経過時間をフェーズの時間に加算する
+
+        Args:
+            name (str): フェーズの名前
+        """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def add_contour(self, num_nodes: int, depth: int):
+        """兄弟のサブツリー同士の間隔を一回求めたことを記録する
+
+        Args:
+            num_nodes (int): 辿った輪郭のノード数
+            depth (int): 比較した輪郭の深さ
+        """
+        self.distance_calls += 1
+        self.contour_nodes += num_nodes
+        if depth > self.peak_contour:
+            self.peak_contour = depth
+
+    def as_dict(self) -> dict:
+        """メトリクスとして送れるように、統計情報を辞書にして返す
+
+        Returns:
+            dict: _description_
+        """
+        return {
+            'phases': dict(self.phases),
+            'total_time': sum(self.phases.values()),
+            'nodes_visited': self.nodes_visited,
+            'distance_calls': self.distance_calls,
+            'contour_nodes': self.contour_nodes,
+            'equalize_shifts': self.equalize_shifts,
+            'peak_contour': self.peak_contour,
+        }
+
+    def __repr__(self):
+        return f"LayoutStats({self.as_dict()})"
+
+
+@contextmanager
+def collect_layout_stats(stats: LayoutStats = None):
+    """with文の中で実行したレイアウト計算の統計情報を集める
+
+    入れ子にした場合は内側の統計情報だけに記録され、抜けると外側に戻る。
+
+    Args:
+        stats (LayoutStats, optional): 記録先. Defaults to None（新たに作る）.
+
+    Returns:
+        LayoutStats: with文のasで受け取る統計情報
+    """
+    global current
+
+    if stats is None:
+        stats = LayoutStats()
+
+    previous = current
+    current = stats
+    try:
+        yield stats
+    finally:
+        current = previous
+
+
+def phase(name: str):
+    """統計情報を集めているときだけ、with文の中の経過時間をフェーズの時間に加算する
+
+    Args:
+        name (str): フェーズの名前
+    """
+    if current is None:
+        return nullcontext()
+    return current.phase(name)
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+
+#
+# 同じ形のサブツリーの相対位置を再利用するレイアウト
+#
+# 組織図のようなツリーには、同じテンプレートから作られたサブツリーや、末端ノードだけがぶら下がった管理職など、
+# 形が全く同じサブツリーが数多く含まれている。
+# サブツリーの中での相対位置は形だけで決まるので、一度計算した形であれば計算し直す必要はない。
+#
+# postorderで探索しながら、子の形のハッシュ値を連結してハッシュ値を求める（Merkle木と同じ方法）。
+# 同じハッシュ値のサブツリーは同じ形なので、キャッシュにある計算結果をそのまま使う。
+#
+# 計算結果（レイアウト）は形ごとに一つだけ作り、次の値を持つ。
+#   offsets     自分から見た子のX座標の相対位置
+#   children    子のレイアウト
+#   left        左輪郭の先頭のセル（自分自身で0.0）
+#   right       右輪郭の先頭のセル
+#   height      サブツリーの高さ（輪郭のセルの数）
+# 兄弟の配置の規則はcalc_x_postorder_buchheim()と同じ。
+#
+# 輪郭は深さごとの値を持つリストではなく、(x, 次のセル, 次のセルまでのずらし量)のタプルをつないだリンクリストにする。
+# 子の輪郭はずらし量を付けてそのまま参照するので、親のレイアウトを作るときに子の輪郭をコピーしなくてよい。
+# buchheimのスレッドと同じく、低い方のサブツリーの輪郭だけを作り直して高い方の輪郭につなぐので、
+# 作り直すセルの数は兄弟の高さの小さい方になり、全体でO(n)に収まる。
+# 輪郭のセルは複数の形から共有されるので、一度作ったセルは書き換えない。
+#
+# キャッシュはLRUで、保持する形の数に上限を設ける。
+# キャッシュから追い出されても、使用中のレイアウトは親のレイアウトから参照されているので消えることはない。
+#
+
+import sys
+
+from collections import OrderedDict
+from hashlib import blake2b
+
+import layout_stats
+
+from tree_layout import TreeNode, calc_y_preorder, postorder
+
+# キャッシュに保持する形の数
+CACHE_SIZE = 100_000
+
+
+class ShapeLayout:
+
+    __slots__ = ('offsets', 'children', 'left', 'right', 'height')
+
+    def __init__(self, offsets: tuple, children: tuple, left: tuple, right: tuple, height: int):
+        self.offsets = offsets
+        self.children = children
+        self.left = left
+        self.right = right
+        self.height = height
+
+
+# 末端ノードのハッシュ値とレイアウトは全て同じ
+LEAF_DIGEST = blake2b(b'', digest_size=16).digest()
+LEAF_CONTOUR = (0.0, None, 0.0)
+LEAF_LAYOUT = ShapeLayout((), (), LEAF_CONTOUR, LEAF_CONTOUR, 1)
+
+
+class ShapeLayoutCache:
+
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        """形のハッシュ値からレイアウトを引くLRUキャッシュ
+
+        Args:
+            maxsize (int, optional): 保持する形の数. Defaults to CACHE_SIZE.
+        """
+        self.maxsize = maxsize
+        self.layouts = OrderedDict()
+
+        # レイアウトはMINIMAL_X_DISTANCEによって変わるので、変わったら全て捨てる
+        self.minimal_distance = TreeNode.MINIMAL_X_DISTANCE
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: bytes) -> ShapeLayout:
+        layout = self.layouts.get(digest)
+        if layout is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.layouts.move_to_end(digest)
+        return layout
+
+    def put(self, digest: bytes, layout: ShapeLayout):
+        self.layouts[digest] = layout
+        if len(self.layouts) > self.maxsize:
+            self.layouts.popitem(last=False)
+
+    def clear(self):
+        self.layouts.clear()
+        self.minimal_distance = TreeNode.MINIMAL_X_DISTANCE
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.layouts)
+
+
+# calc_tree_position_memo()で使うキャッシュ、呼び出しをまたいで形を再利用する
+default_cache = ShapeLayoutCache()
+
+
+def descend_contour(cell: tuple, shift: float, count: int) -> tuple:
+    """輪郭をcount段だけ下に辿る
+
+    Returns:
+        tuple: (セル, そのセルのずらし量)
+    """
+    for _ in range(count):
+        shift += cell[2]
+        cell = cell[1]
+    return cell, shift
+
+
+def join_contour(cell: tuple, shift: float, count: int, tail: tuple, tail_shift: float) -> tuple:
+    """輪郭の上からcount段をコピーして、その下にtailをつないだ新しい輪郭を返す
+
+    元の輪郭は他の形と共有しているので書き換えない
+    コピーしたセルは絶対位置を持つので、返す輪郭のずらし量は0.0になる
+    """
+    xs = []
+    for _ in range(count):
+        xs.append(cell[0] + shift)
+        shift += cell[2]
+        cell = cell[1]
+
+    for x in reversed(xs):
+        tail = (x, tail, tail_shift)
+        tail_shift = 0.0
+    return tail
+
+
+def get_contour_distance(right_cell: tuple, right_shift: float, left_cell: tuple, left_shift: float) -> float:
+    """左のサブツリーの右輪郭と、右のサブツリーの左輪郭の最も狭い間隔を返す
+
+    tree_layout.get_minimum_distance_between()と同じく、兄弟自身より深い階層だけを比較する
+    """
+    min_distance = sys.float_info.max
+    depth = 1
+    right_shift += right_cell[2]
+    right_cell = right_cell[1]
+    left_shift += left_cell[2]
+    left_cell = left_cell[1]
+    while right_cell is not None and left_cell is not None:
+        distance = (left_cell[0] + left_shift) - (right_cell[0] + right_shift)
+        if distance < min_distance:
+            min_distance = distance
+        right_shift += right_cell[2]
+        right_cell = right_cell[1]
+        left_shift += left_cell[2]
+        left_cell = left_cell[1]
+        depth += 1
+
+    stats = layout_stats.current
+    if stats is not None:
+        stats.add_contour(2 * (depth - 1), depth - 1)
+
+    return min_distance
+
+
+def merge_right_contour(forest: tuple, child: ShapeLayout, position: float) -> tuple:
+    """左の兄弟たちの右輪郭に、positionに置いた子の右輪郭を重ねる
+
+    Args:
+        forest (tuple): 左の兄弟たちの(右輪郭のセル, ずらし量, 高さ)
+        child (ShapeLayout): 右に置く子のレイアウト
+        position (float): 子のX座標
+
+    Returns:
+        tuple: 重ねた後の(右輪郭のセル, ずらし量, 高さ)
+    """
+    cell, shift, height = forest
+    if child.height >= height:
+        # 子の方が深いので、子の右輪郭がそのまま全体の右輪郭になる
+        return child.right, position, child.height
+
+    # 子の下に左の兄弟たちの右輪郭をつなぐ
+    tail, tail_shift = descend_contour(cell, shift, child.height)
+    return join_contour(child.right, position, child.height, tail, tail_shift), 0.0, height
+
+
+def merge_left_contour(forest: tuple, child: ShapeLayout, position: float) -> tuple:
+    """左の兄弟たちの左輪郭に、positionに置いた子の左輪郭を重ねる
+
+    Args:
+        forest (tuple): 左の兄弟たちの(左輪郭のセル, ずらし量, 高さ)
+        child (ShapeLayout): 右に置く子のレイアウト
+        position (float): 子のX座標
+
+    Returns:
+        tuple: 重ねた後の(左輪郭のセル, ずらし量, 高さ)
+    """
+    cell, shift, height = forest
+    if child.height <= height:
+        # 子は左の兄弟たちより深くないので、左輪郭は変わらない
+        return forest
+
+    # 左の兄弟たちの下に子の左輪郭をつなぐ
+    tail, tail_shift = descend_contour(child.left, position, height)
+    return join_contour(cell, shift, height, tail, tail_shift), 0.0, child.height
+
+
+def create_shape_layout(children: list) -> ShapeLayout:
+    """子のレイアウトから、自分のレイアウトを作る
+
+    Args:
+        children (list): 子のレイアウトのリスト、空でないこと
+
+    Returns:
+        ShapeLayout: 自分のレイアウト
+    """
+    minimal_distance = TreeNode.MINIMAL_X_DISTANCE
+
+    # 左から順に、重ならない位置に置く
+    positions = []
+    forest_right = None
+    for i, child in enumerate(children):
+        if i == 0:
+            position = 0.0
+            forest_right = (child.right, 0.0, child.height)
+        else:
+            position = positions[-1] + minimal_distance
+            # 子がいなければ重なりは調べない
+            if child.height > 1:
+                distance = get_contour_distance(forest_right[0], forest_right[1], child.left, position)
+                if distance < minimal_distance:
+                    position += minimal_distance - distance
+            forest_right = merge_right_contour(forest_right, child, position)
+        positions.append(position)
+
+    # tree_layout.equalize_position_buchheim()と同じ
+    num_nodes_between = len(children) - 2
+    if num_nodes_between > 0 and children[-1].height > 1:
+        desired_interval = (positions[-1] - positions[0]) / (num_nodes_between + 1)
+        num_shifts = 0
+        for i in range(1, len(children)):
+            if i > 1 and children[i].height > 1:
+                distance = get_contour_distance(children[i-1].right, positions[i-1], children[i].left, positions[i])
+                if distance < minimal_distance:
+                    positions[i] += minimal_distance - distance
+                    num_shifts += 1
+            if positions[i] - positions[i-1] < desired_interval:
+                positions[i] = positions[i-1] + desired_interval
+                num_shifts += 1
+
+        stats = layout_stats.current
+        if stats is not None:
+            stats.equalize_shifts += num_shifts
+
+    # 自分は子の中央に置く
+    center = (positions[0] + positions[-1]) / 2
+    offsets = tuple(position - center for position in positions)
+
+    # 子の輪郭をつないで自分の輪郭を作る、自分自身が0段目になる
+    first = children[0]
+    left = (first.left, offsets[0], first.height)
+    right = (first.right, offsets[0], first.height)
+    for child, offset in zip(children[1:], offsets[1:]):
+        left = merge_left_contour(left, child, offset)
+        right = merge_right_contour(right, child, offset)
+
+    return ShapeLayout(offsets, tuple(children), (0.0, left[0], left[1]), (0.0, right[0], right[1]), left[2] + 1)
+
+
+def calc_shape_layout(tree: TreeNode, cache: ShapeLayoutCache) -> ShapeLayout:
+    """postorderで形のハッシュ値を求めながら、ツリー全体のレイアウトを求める
+
+    Args:
+        tree (TreeNode): ルートノード
+        cache (ShapeLayoutCache): _description_
+
+    Returns:
+        ShapeLayout: ルートのレイアウト
+    """
+    # postorderでは子が親より先に返されるので、子の結果はスタックの末尾に積まれている
+    digests = []
+    layouts = []
+
+    num_nodes = 0
+    for node in postorder(tree):
+        num_nodes += 1
+        num_children = len(node.children)
+        if num_children == 0:
+            digests.append(LEAF_DIGEST)
+            layouts.append(LEAF_LAYOUT)
+            continue
+
+        child_digests = digests[-num_children:]
+        child_layouts = layouts[-num_children:]
+        del digests[-num_children:]
+        del layouts[-num_children:]
+
+        digest = blake2b(b''.join(child_digests), digest_size=16).digest()
+        layout = cache.get(digest)
+        if layout is None:
+            layout = create_shape_layout(child_layouts)
+            cache.put(digest, layout)
+
+        digests.append(digest)
+        layouts.append(layout)
+
+    stats = layout_stats.current
+    if stats is not None:
+        stats.nodes_visited += num_nodes
+
+    return layouts[0]
+
+
+def calc_tree_position_memo(tree: TreeNode, cache: ShapeLayoutCache = None):
+    """同じ形のサブツリーのレイアウトを再利用して、ツリー全体の位置を計算する
+
+    Args:
+        tree (TreeNode): ルートノード
+        cache (ShapeLayoutCache, optional): Defaults to None（呼び出しをまたいで共有するdefault_cache）.
+    """
+    if cache is None:
+        cache = default_cache
+
+    if cache.minimal_distance != TreeNode.MINIMAL_X_DISTANCE:
+        cache.clear()
+
+    with layout_stats.phase("y"):
+        calc_y_preorder(tree)
+
+    with layout_stats.phase("x_postorder"):
+        layout = calc_shape_layout(tree, cache)
+
+    with layout_stats.phase("finalize"):
+        # calc_x_postorder_buchheim()と同じく、一番左の子を辿った先の末端ノードがX座標0の基準位置になる
+        x = 0.0
+        leftmost = layout
+        while leftmost.offsets:
+            x -= leftmost.offsets[0]
+            leftmost = leftmost.children[0]
+
+        stack = [(tree, x, layout)]
+        while stack:
+            node, x, layout = stack.pop()
+            node.x = x
+            for child, offset, child_layout in zip(node.children, layout.offsets, layout.children):
+                stack.append((child, x + offset, child_layout))
+
+
+if __name__ == '__main__':
+
+    import time
+
+    from tree_layout import calc_tree_position
+
+    def create_org_chart(num_departments: int, num_teams: int, num_members: int) -> TreeNode:
+        """部署の下にチームがあり、チームの下にメンバーがいる組織図"""
+        return TreeNode("root", *[
+            TreeNode(f"d{d}", *[
+                TreeNode(f"d{d}t{t}", *[TreeNode(f"d{d}t{t}m{m}") for m in range(num_members + (d + t) % 3)])
+                for t in range(num_teams)])
+            for d in range(num_departments)])
+
+    def main():
+        tree = create_org_chart(200, 20, 50)
+        num_nodes = sum(1 for _ in postorder(tree))
+        print(f"nodes: {num_nodes}")
+
+        start = time.perf_counter()
+        calc_tree_position(tree, engine="buchheim")
+        print(f"buchheim: {time.perf_counter() - start:.3f} sec")
+
+        cache = ShapeLayoutCache()
+        start = time.perf_counter()
+        calc_tree_position_memo(tree, cache)
+        print(f"memo: {time.perf_counter() - start:.3f} sec, shapes: {len(cache)}, hits: {cache.hits}, misses: {cache.misses}")
+        return 0
+
+    sys.exit(main())
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+#
+# ルートの子を頂点とするサブツリーの位置を、プロセスプールで並列に計算する
+#
+# calc_x_postorder()やcalc_x_postorder_buchheim()では、ルートの子を頂点とするサブツリーは互いに独立に計算され、
+# ルートの子を兄弟として並べるときに初めて隣のサブツリーの輪郭と比較される。
+# そこで、大きなサブツリーはワーカープロセスで計算し、ルートでの兄弟の配置だけを親プロセスでまとめて行う。
+#
+# ワーカープロセスとのデータの受け渡しには共有メモリを使う。
+#   入力  サブツリーのノードをBFS順に並べたときの、各ノードの子の数（int64）
+#   出力  サブツリーごとの基準で求めたX座標と、深さごとの左輪郭・右輪郭（float64）
+# TreeNodeをpickleで送ると親へのポインタをたどってツリー全体を直列化してしまうので、配列だけを受け渡す。
+#
+# サブツリーの計算はcompact_tree.calc_x_compact()で行うので、サブツリーの中の座標は engine="buchheim" と同じになる。
+# ルートでの兄弟の配置も同じ規則で行うが、輪郭はスレッドではなく深さごとの最小値・最大値で比較する。
+#
+
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+import layout_stats
+
+from compact_tree import CompactTree, calc_x_compact
+from tree_layout import TreeNode, calc_y_preorder
+
+# これ以上のノード数を持つサブツリーをワーカープロセスで計算する
+PARALLEL_THRESHOLD = 50_000
+
+
+def get_child_counts(root: TreeNode) -> tuple:
+    """サブツリーのノードをBFS順に並べる
+
+    Returns:
+        tuple: (BFS順に並べたノードのリスト, 各ノードの子の数のリスト)
+    """
+    order = [root]
+    child_counts = []
+    i = 0
+    while i < len(order):
+        children = order[i].children
+        child_counts.append(len(children))
+        order.extend(children)
+        i += 1
+    return order, child_counts
+
+
+def layout_subtree(child_counts: np.ndarray) -> tuple:
+    """BFS順に並べた子の数から、サブツリーの位置を計算する
+
+    Args:
+        child_counts (np.ndarray): BFS順に並べた各ノードの子の数
+
+    Returns:
+        tuple: (X座標の配列, 深さごとの左輪郭の配列, 深さごとの右輪郭の配列)
+    """
+    num_nodes = len(child_counts)
+
+    # ノードiの子は、それより前のノードの子の数の合計+1番目から始まる
+    child_offsets = np.empty(num_nodes + 1, dtype=np.int64)
+    child_offsets[0] = 0
+    np.cumsum(child_counts, out=child_offsets[1:])
+    child_offsets += 1
+
+    parent = np.empty(num_nodes, dtype=CompactTree.index_dtype(num_nodes))
+    parent[0] = -1
+    parent[1:] = np.repeat(np.arange(num_nodes, dtype=parent.dtype), child_counts)
+
+    tree = CompactTree(None, parent, child_offsets)
+    calc_x_compact(tree)
+
+    # BFS順では同じ深さのノードが連続しているので、深さが変わる位置で区切って最小値・最大値を求める
+    starts = np.flatnonzero(np.diff(tree.depth)) + 1
+    starts = np.concatenate(([0], starts))
+    return tree.x, np.minimum.reduceat(tree.x, starts), np.maximum.reduceat(tree.x, starts)
+
+
+def layout_subtree_shared(args: tuple) -> int:
+    """ワーカープロセスで実行する、共有メモリから子の数を読み、X座標と輪郭を共有メモリに書き込む
+
+    出力の共有メモリには、ノード一つにつきX座標、左輪郭、右輪郭の3つ分の領域を確保してある。
+
+    Args:
+        args (tuple): (入力の共有メモリの名前, 出力の共有メモリの名前, サブツリーの開始位置, ノード数)
+
+    Returns:
+        int: 輪郭の長さ（サブツリーの深さの数）
+    """
+    input_name, output_name, start, num_nodes = args
+
+    input_memory = SharedMemory(name=input_name)
+    output_memory = SharedMemory(name=output_name)
+
+    child_counts = output = None
+    try:
+        child_counts = np.ndarray(num_nodes, dtype=np.int64, buffer=input_memory.buf, offset=start * 8)
+        x, left, right = layout_subtree(child_counts)
+
+        output = np.ndarray(3 * num_nodes, dtype=np.float64, buffer=output_memory.buf, offset=3 * start * 8)
+        output[:num_nodes] = x
+        output[num_nodes:num_nodes + len(left)] = left
+        output[2 * num_nodes:2 * num_nodes + len(right)] = right
+        return len(left)
+    finally:
+        # 配列が共有メモリを参照したままだと閉じられない
+        child_counts = output = None
+        input_memory.close()
+        output_memory.close()
+
+
+def layout_subtrees_parallel(child_counts: list, workers: int) -> list:
+    """複数のサブツリーの位置をプロセスプールで計算する
+
+    Args:
+        child_counts (list): サブツリーごとの、BFS順に並べた子の数のリスト
+        workers (int): プロセス数
+
+    Returns:
+        list: サブツリーごとの(X座標のリスト, 左輪郭の配列, 右輪郭の配列)
+    """
+    sizes = [len(counts) for counts in child_counts]
+    starts = [0]
+    for size in sizes:
+        starts.append(starts[-1] + size)
+    total = starts[-1]
+
+    input_memory = SharedMemory(create=True, size=total * 8)
+    output_memory = SharedMemory(create=True, size=total * 3 * 8)
+
+    inputs = output = None
+    try:
+        inputs = np.ndarray(total, dtype=np.int64, buffer=input_memory.buf)
+        for counts, start, size in zip(child_counts, starts, sizes):
+            inputs[start:start + size] = counts
+
+        # 大きいサブツリーから順に投入して、最後に大きなサブツリーだけが残らないようにする
+        order = sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True)
+        num_levels = [0] * len(sizes)
+        with ProcessPoolExecutor(max_workers=min(workers, len(sizes))) as executor:
+            futures = {i: executor.submit(layout_subtree_shared,
+                                          (input_memory.name, output_memory.name, starts[i], sizes[i]))
+                       for i in order}
+            for i, future in futures.items():
+                num_levels[i] = future.result()
+
+        output = np.ndarray(total * 3, dtype=np.float64, buffer=output_memory.buf)
+        results = []
+        for start, size, levels in zip(starts, sizes, num_levels):
+            base = start * 3
+            results.append((output[base:base + size].tolist(),
+                            output[base + size:base + size + levels].copy(),
+                            output[base + 2 * size:base + 2 * size + levels].copy()))
+        return results
+    finally:
+        inputs = output = None
+        input_memory.close()
+        input_memory.unlink()
+        output_memory.close()
+        output_memory.unlink()
+
+
+def get_contour_distance(left_contour: np.ndarray, left_shift: float,
+                         right_contour: np.ndarray, right_shift: float) -> float:
+    """左の兄弟の右輪郭と、右の兄弟の左輪郭の最も狭い間隔を返す
+
+    tree_layout.get_minimum_distance_between()と同じく、兄弟自身より深い階層だけを比較する
+    """
+    depth = min(len(left_contour), len(right_contour))
+    if depth <= 1:
+        return sys.float_info.max
+    return float(np.min((right_contour[1:depth] + right_shift) - (left_contour[1:depth] + left_shift)))
+
+
+def place_subtrees(subtrees: list) -> list:
+    """ルートの子を兄弟として並べる
+
+    tree_layout.place_children_buchheim()と同じ規則で、左から順に重ならない位置に置いてから均等化する
+
+    Args:
+        subtrees (list): 子ごとの(X座標のリスト, 左輪郭, 右輪郭)、座標はサブツリーごとの基準で求めたもの
+
+    Returns:
+        list: 子ごとのX座標
+    """
+    minimal_distance = TreeNode.MINIMAL_X_DISTANCE
+
+    positions = []
+
+    # 左にいる兄弟全体の右輪郭
+    forest_right = np.empty(0, dtype=np.float64)
+
+    for i, (xs, left, right) in enumerate(subtrees):
+        if i == 0:
+            position = xs[0]
+        else:
+            position = positions[-1] + minimal_distance
+            # 子がいなければ重なりは調べない
+            if len(left) > 1:
+                distance = get_contour_distance(forest_right, 0.0, left, position - xs[0])
+                if distance < minimal_distance:
+                    position += minimal_distance - distance
+        positions.append(position)
+
+        shift = position - xs[0]
+        if len(right) > len(forest_right):
+            forest_right = np.concatenate((forest_right, np.full(len(right) - len(forest_right), -np.inf)))
+        np.maximum(forest_right[:len(right)], right + shift, out=forest_right[:len(right)])
+
+    # tree_layout.equalize_position_buchheim()と同じ
+    num_nodes_between = len(subtrees) - 2
+    if num_nodes_between > 0 and len(subtrees[-1][1]) > 1:
+        desired_interval = (positions[-1] - positions[0]) / (num_nodes_between + 1)
+        for i in range(1, len(subtrees)):
+            if i > 1 and len(subtrees[i][1]) > 1:
+                distance = get_contour_distance(subtrees[i-1][2], positions[i-1] - subtrees[i-1][0][0],
+                                                subtrees[i][1], positions[i] - subtrees[i][0][0])
+                if distance < minimal_distance:
+                    positions[i] += minimal_distance - distance
+            if positions[i] - positions[i-1] < desired_interval:
+                positions[i] = positions[i-1] + desired_interval
+
+    return positions
+
+
+def calc_tree_position_parallel(tree: TreeNode, workers: int = None, threshold: int = PARALLEL_THRESHOLD):
+    """ルートの子ごとにサブツリーの位置を並列に計算して、ツリー全体の位置を設定する
+
+    座標は calc_tree_position(tree, engine="buchheim") と同じになる。
+    ただしrelayout()で使うprelimやスレッドはノードに設定しない。
+
+    Args:
+        tree (TreeNode): ルートノード
+        workers (int, optional): プロセス数. Defaults to None（CPUの数）.
+        threshold (int, optional): これ以上のノード数を持つサブツリーをワーカープロセスで計算する. Defaults to PARALLEL_THRESHOLD.
+    """
+    with layout_stats.phase("y"):
+        calc_y_preorder(tree)
+
+    if not tree.children:
+        tree.x = 0.0
+        return
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with layout_stats.phase("x_postorder"):
+        orders = []
+        child_counts = []
+        for child in tree.children:
+            order, counts = get_child_counts(child)
+            orders.append(order)
+            child_counts.append(counts)
+
+        subtrees = [None] * len(orders)
+
+        large = [i for i, order in enumerate(orders) if len(order) >= threshold] if workers > 1 else []
+        if large:
+            results = layout_subtrees_parallel([child_counts[i] for i in large], workers)
+            for i, result in zip(large, results):
+                subtrees[i] = result
+
+        # 子のいない子は配列を作るまでもない
+        leaf = ([0.0], np.zeros(1), np.zeros(1))
+
+        for i, counts in enumerate(child_counts):
+            if subtrees[i] is None and len(counts) == 1:
+                subtrees[i] = leaf
+            elif subtrees[i] is None:
+                xs, left, right = layout_subtree(np.array(counts, dtype=np.int64))
+                subtrees[i] = (xs.tolist(), left, right)
+        del child_counts
+
+        positions = place_subtrees(subtrees)
+
+    stats = layout_stats.current
+    if stats is not None:
+        stats.nodes_visited += 1 + sum(len(order) for order in orders)
+
+    with layout_stats.phase("finalize"):
+        # ルートは子の中央に置く
+        tree.x = (positions[0] + positions[-1]) / 2
+
+        for order, (xs, _, _), position in zip(orders, subtrees, positions):
+            shift = position - xs[0]
+            for node, x in zip(order, xs):
+                node.x = x + shift
+
+
+if __name__ == '__main__':
+
+    import time
+
+    from benchmark import create_random_tree
+    from tree_layout import calc_tree_position, preorder
+
+    def main():
+        num_nodes = 200_000
+        num_children = 8
+        threshold = 10_000
+
+        # ルートの下に大きなサブツリーを並べる
+        tree = TreeNode("root", *[create_random_tree(num_nodes // num_children, seed=i) for i in range(num_children)])
+
+        start = time.perf_counter()
+        calc_tree_position(tree, engine="buchheim")
+        print(f"buchheim: {time.perf_counter() - start:.3f} sec")
+        expected = [node.x for node in preorder(tree)]
+
+        for workers in [1, 2, 4]:
+            start = time.perf_counter()
+            calc_tree_position_parallel(tree, workers=workers, threshold=threshold)
+            elapsed = time.perf_counter() - start
+            same = all(abs(node.x - x) < 1e-9 for node, x in zip(preorder(tree), expected))
+            print(f"parallel workers={workers}: {elapsed:.3f} sec, same as buchheim: {same}")
+        return 0
+
+    sys.exit(main())
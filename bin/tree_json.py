@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+
+#
+# data/test_tree_*.json 形式のファイルを読み込む
+#
+# ファイルはcytoscape.jsの要素のリストになっていて、ノードは以下の形をしている。
+# iida.appdata.get_elements()と同じく、groupが"edges"の要素と、data.idを持たない要素は無視する。
+#
+#   {
+#     "group": "nodes",
+#     "data": {
+#         "id": "root",
+#         "children": ["L1", "R1"]
+#     }
+#   }
+#
+# 数GBのファイルでも読めるように、ファイル全体をjson.load()で読み込むことはせずに、
+# リストの要素を一つずつ取り出しながらツリーを組み立てる。
+# 子のidはまだ現れていないノードを指していてもよい。
+#
+
+import json
+import sys
+
+from array import array
+
+from tree_layout import TreeNode
+from tree_render import iter_render_items
+
+# 一度に読み込む文字数
+CHUNK_SIZE = 1 << 20
+
+# 要素の区切りになる文字、デコードに失敗した位置より後ろにこれがあれば、続きを読んでも直らない
+STRUCTURAL_CHARS = frozenset(',:[]{}"')
+
+
+def is_truncated(e: json.JSONDecodeError) -> bool:
+    """デコードの失敗が、要素の途中でバッファが終わっているせいかどうかを返す
+
+    文字列が閉じていないか、失敗した位置からバッファの末尾までに区切りの文字がなければ、続きを読めばデコードできる可能性がある
+    """
+    if e.msg.startswith('Unterminated string'):
+        return True
+    return STRUCTURAL_CHARS.isdisjoint(e.doc[e.pos:])
+
+
+def iter_elements(fp, chunk_size: int = CHUNK_SIZE):
+    """JSONのリストの要素を先頭から一つずつ取り出す
+
+    Args:
+        fp (_type_): テキストモードで開いたファイル
+        chunk_size (int, optional): 一度に読み込む文字数. Defaults to CHUNK_SIZE.
+
+    Yields:
+        object: リストの要素
+    """
+    decoder = json.JSONDecoder()
+
+    buffer = ''
+    pos = 0
+    eof = False
+
+    # バッファの先頭がファイルの先頭から何文字目か、エラーメッセージに使う
+    offset = 0
+
+    def fill(size):
+        # 未処理の部分だけを残して、続きを読み込む
+        nonlocal buffer, pos, eof, offset
+        data = fp.read(size)
+        if not data:
+            eof = True
+        buffer = buffer[pos:] + data
+        offset += pos
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill(chunk_size)
+
+    skip_whitespace()
+    if pos >= len(buffer) or buffer[pos] != '[':
+        raise ValueError("JSON document must be a list of elements")
+    pos += 1
+
+    first = True
+    index = 0
+    while True:
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise ValueError("unexpected end of JSON document")
+
+        if buffer[pos] == ']':
+            return
+
+        if not first:
+            if buffer[pos] != ',':
+                raise ValueError(f"expected ',' but found {buffer[pos]!r}")
+            pos += 1
+            skip_whitespace()
+        first = False
+
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+                break
+            except json.JSONDecodeError as e:
+                # 要素の途中でバッファが終わっているときだけ続きを読む
+                # 壊れた要素のためにファイルの残りを全て読み込まないように、それ以外はすぐにエラーにする
+                if eof or not is_truncated(e):
+                    raise ValueError(f"invalid JSON in element {index} at offset {offset + e.pos}: {e.msg}") from e
+                # 大きな要素で何度もやり直さないように、読み込む量はバッファの長さに合わせて増やす
+                fill(max(chunk_size, len(buffer) - pos))
+
+        yield element
+        pos = end
+        index += 1
+
+
+def read_tree_arrays(fp, root_id: str = None, chunk_size: int = CHUNK_SIZE) -> tuple:
+    """ファイルを読み込んで、BFS順に並べたノードの名前、親の番号、子のオフセットを作成する
+
+    Args:
+        fp (_type_): テキストモードで開いたファイル
+        root_id (str, optional): ルートノードのid. Defaults to None.
+        chunk_size (int, optional): 一度に読み込む文字数. Defaults to CHUNK_SIZE.
+
+    Returns:
+        tuple: (names, parent, child_offsets)、CompactTreeの引数と同じ並び
+    """
+    return build_tree_arrays(iter_elements(fp, chunk_size=chunk_size), root_id=root_id)
+
+
+def build_tree_arrays(elements, root_id: str = None) -> tuple:
+    """cytoscape.jsの要素から、BFS順に並べたノードの名前、親の番号、子のオフセットを作成する
+
+    ルートはroot_idで指定する。指定しなければ、どのノードの子にもなっていない最初のノードをルートにする。
+    ルートから辿れないノードと、定義されていないidを指す子は無視する。
+
+    Args:
+        elements (_type_): 要素のリスト、またはイテレータ
+        root_id (str, optional): ルートノードのid. Defaults to None.
+
+    Returns:
+        tuple: (names, parent, child_offsets)、CompactTreeの引数と同じ並び
+    """
+    # idは現れた順に番号を振る
+    # 子として先に現れたidにも番号を振っておき、後から定義されるのを待つ
+    index = {}
+    names = []
+
+    def get_index(node_id):
+        # cytoscape.jsのidは文字列、リストなどが混ざっていると辞書のキーにできない
+        if not isinstance(node_id, str):
+            raise ValueError(f"node id must be a string: {node_id!r}")
+        i = index.get(node_id)
+        if i is None:
+            i = index[node_id] = len(names)
+            names.append(node_id)
+            defined.append(0)
+            has_parent.append(0)
+            child_start.append(0)
+            child_count.append(0)
+        return i
+
+    defined = bytearray()
+    has_parent = bytearray()
+
+    # 子のidの番号は定義された順に一つの配列に詰めていく
+    # ノードiの子は child_ids[child_start[i]] から child_count[i] 個
+    child_ids = array('q')
+    child_start = array('q')
+    child_count = array('q')
+
+    # 要素の並び順でのノード番号、ルートを探すのに使う
+    definition_order = array('q')
+
+    for element in elements:
+        if not isinstance(element, dict) or element.get('group') == 'edges':
+            continue
+        data = element.get('data')
+        if not isinstance(data, dict) or 'id' not in data:
+            continue
+
+        i = get_index(data['id'])
+        if defined[i]:
+            raise ValueError(f"duplicate node id: {data['id']}")
+        defined[i] = 1
+        definition_order.append(i)
+
+        children = data.get('children') or []
+        if not isinstance(children, list):
+            raise ValueError(f"children of node {data['id']} must be a list")
+        child_start[i] = len(child_ids)
+        child_count[i] = len(children)
+        for child_id in children:
+            c = get_index(child_id)
+            if has_parent[c]:
+                raise ValueError(f"node {child_id} has more than one parent")
+            has_parent[c] = 1
+            child_ids.append(c)
+
+    if root_id is None:
+        root = next((i for i in definition_order if not has_parent[i]), None)
+        if root is None:
+            raise ValueError("root node is not found")
+    else:
+        root = index.get(root_id)
+        if root is None or not defined[root]:
+            raise ValueError(f"root node {root_id} is not found")
+
+    # ルートからBFS順に並べ直す
+    order = array('q', [root])
+    parent = array('q', [-1])
+    child_offsets = array('q')
+    visited = bytearray(len(names))
+    visited[root] = 1
+
+    i = 0
+    while i < len(order):
+        node = order[i]
+        child_offsets.append(len(order))
+        start = child_start[node]
+        for c in child_ids[start:start + child_count[node]]:
+            if not defined[c]:
+                continue
+            if visited[c]:
+                raise ValueError(f"cycle detected at node {names[c]}")
+            visited[c] = 1
+            order.append(c)
+            parent.append(i)
+        i += 1
+    child_offsets.append(len(order))
+
+    return [names[i] for i in order], parent, child_offsets
+
+
+def load_compact_tree(path, root_id: str = None, chunk_size: int = CHUNK_SIZE):
+    """ファイルを読み込んでCompactTreeを作成する
+
+    Args:
+        path (_type_): ファイル名、またはテキストモードで開いたファイル
+        root_id (str, optional): ルートノードのid. Defaults to None.
+        chunk_size (int, optional): 一度に読み込む文字数. Defaults to CHUNK_SIZE.
+
+    Returns:
+        CompactTree: _description_
+    """
+    # numpyの読み込みには時間がかかるので、CompactTreeが必要になるまでimportしない
+    import numpy as np
+    from compact_tree import CompactTree
+
+    if isinstance(path, str):
+        with open(path, encoding='utf-8') as fp:
+            names, parent, child_offsets = read_tree_arrays(fp, root_id=root_id, chunk_size=chunk_size)
+    else:
+        names, parent, child_offsets = read_tree_arrays(path, root_id=root_id, chunk_size=chunk_size)
+
+    dtype = CompactTree.index_dtype(len(names))
+    return CompactTree(names,
+                       np.array(parent, dtype=dtype),
+                       np.array(child_offsets, dtype=np.int64))
+
+
+def load_tree_node(path, root_id: str = None, chunk_size: int = CHUNK_SIZE) -> TreeNode:
+    """ファイルを読み込んでTreeNodeのツリーを作成する
+
+    CompactTreeを経由しないので、numpyを必要としない
+
+    Args:
+        path (_type_): ファイル名、またはテキストモードで開いたファイル
+        root_id (str, optional): ルートノードのid. Defaults to None.
+        chunk_size (int, optional): 一度に読み込む文字数. Defaults to CHUNK_SIZE.
+
+    Returns:
+        TreeNode: ルートノード
+    """
+    if isinstance(path, str):
+        with open(path, encoding='utf-8') as fp:
+            return load_tree_node(fp, root_id=root_id, chunk_size=chunk_size)
+
+    names, _, child_offsets = read_tree_arrays(path, root_id=root_id, chunk_size=chunk_size)
+    return create_tree_node(names, child_offsets)
+
+
+def create_tree_node(names: list, child_offsets) -> TreeNode:
+    """BFS順に並べたノードの名前と子のオフセットからTreeNodeのツリーを作成する
+
+    Args:
+        names (list): ノードの名前、BFS順
+        child_offsets (_type_): 長さはノード数+1、ノードiの子は child_offsets[i] から child_offsets[i+1] - 1 まで
+
+    Returns:
+        TreeNode: ルートノード
+    """
+    nodes = [TreeNode(name) for name in names]
+    for i, node in enumerate(nodes):
+        node.children = nodes[child_offsets[i]:child_offsets[i+1]]
+        for child in node.children:
+            child.parent = node
+    return nodes[0]
+
+
+#
+# 計算した位置の書き出し
+#
+# cytoscape.jsのpresetレイアウトにそのまま渡せる形式か、1行に1ノードのNDJSON形式で書き出す。
+# ブラウザ側では calc_x_postorder() を実行せずに、次のように位置を適用するだけでよい。
+#
+#   cy.layout({ name: 'preset', positions: payload.positions }).run();
+#
+# ノードごとにprint()するのではなく、一定数のノードをまとめて文字列にしてから書き込む。
+#
+
+# まとめて書き込むノードの数
+WRITE_BATCH_SIZE = 10_000
+
+
+def iter_positions(tree, horizontal: bool = False, x_scale: float = 1.0, y_scale: float = 1.0):
+    """計算済みのツリーから(id, x, y)を順に取り出す
+
+    Args:
+        tree (_type_): TreeNode、BinaryTreeNodeのルートノード、またはCompactTree
+        horizontal (bool, optional): iida.layout.tree.jsのhorizontalと同じくX座標とY座標を入れ替える. Defaults to False.
+        x_scale (float, optional): X座標に掛ける倍率、iida.layout.tree.jsのminimal_x_distanceに相当. Defaults to 1.0.
+        y_scale (float, optional): Y座標に掛ける倍率、iida.layout.tree.jsのminimal_y_distanceに相当. Defaults to 1.0.
+
+    Yields:
+        tuple: (id, x, y)
+    """
+    for node_id, x, y, _, _ in iter_render_items(tree):
+        x = x * x_scale
+        y = y * y_scale
+        if horizontal:
+            yield node_id, y, x
+        else:
+            yield node_id, x, y
+
+
+def write_batches(fp, lines, batch_size: int = WRITE_BATCH_SIZE):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            fp.write(''.join(batch))
+            batch.clear()
+    if batch:
+        fp.write(''.join(batch))
+
+
+def write_preset_json(tree, fp, horizontal: bool = False, x_scale: float = 1.0, y_scale: float = 1.0):
+    """cytoscape.jsのpresetレイアウトの形式で位置を書き出す
+
+    {"name": "preset", "positions": {"id": {"x": 0.0, "y": 0.0}, ...}}
+
+    Args:
+        tree (_type_): TreeNode、BinaryTreeNodeのルートノード、またはCompactTree
+        fp (_type_): ファイル名、またはテキストモードで開いたファイル
+        horizontal (bool, optional): X座標とY座標を入れ替える. Defaults to False.
+        x_scale (float, optional): X座標に掛ける倍率. Defaults to 1.0.
+        y_scale (float, optional): Y座標に掛ける倍率. Defaults to 1.0.
+    """
+    if isinstance(fp, str):
+        with open(fp, 'w', encoding='utf-8') as f:
+            return write_preset_json(tree, f, horizontal=horizontal, x_scale=x_scale, y_scale=y_scale)
+
+    def lines():
+        separator = '\n'
+        for node_id, x, y in iter_positions(tree, horizontal=horizontal, x_scale=x_scale, y_scale=y_scale):
+            yield f'{separator}{json.dumps(str(node_id))}: {{"x": {x!r}, "y": {y!r}}}'
+            separator = ',\n'
+
+    fp.write('{"name": "preset", "positions": {')
+    write_batches(fp, lines())
+    fp.write('\n}}\n')
+
+
+def write_ndjson(tree, fp, horizontal: bool = False, x_scale: float = 1.0, y_scale: float = 1.0):
+    """1行に1ノードの形式で位置を書き出す
+
+    {"id": "root", "x": 0.0, "y": 0.0}
+
+    Args:
+        tree (_type_): TreeNode、BinaryTreeNodeのルートノード、またはCompactTree
+        fp (_type_): ファイル名、またはテキストモードで開いたファイル
+        horizontal (bool, optional): X座標とY座標を入れ替える. Defaults to False.
+        x_scale (float, optional): X座標に掛ける倍率. Defaults to 1.0.
+        y_scale (float, optional): Y座標に掛ける倍率. Defaults to 1.0.
+    """
+    if isinstance(fp, str):
+        with open(fp, 'w', encoding='utf-8') as f:
+            return write_ndjson(tree, f, horizontal=horizontal, x_scale=x_scale, y_scale=y_scale)
+
+    lines = (f'{{"id": {json.dumps(str(node_id))}, "x": {x!r}, "y": {y!r}}}\n'
+             for node_id, x, y in iter_positions(tree, horizontal=horizontal, x_scale=x_scale, y_scale=y_scale))
+    write_batches(fp, lines)
+
+
+if __name__ == '__main__':
+
+    from compact_tree import calc_tree_position_compact
+
+    def main():
+        for path in sys.argv[1:]:
+            tree = load_compact_tree(path)
+            calc_tree_position_compact(tree)
+            write_preset_json(tree, sys.stdout)
+        return 0
+
+    sys.exit(main())
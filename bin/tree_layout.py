@@ -5,6 +5,8 @@
 
 import sys
 
+import layout_stats
+
 
 class TreeNode:
 
@@ -21,8 +23,9 @@ class TreeNode:
         self.parent = None
 
         # コンストラクタで子ノードを渡されたら、それを子ノードとして設定する
+        # 後からadd_child()などで変更できるようにリストで保持する
         if children:
-            self.children = children
+            self.children = list(children)
             for child in self.children:
                 child.parent = self
         else:
@@ -40,6 +43,25 @@ class TreeNode:
         # modという名前は参考文献に倣っている
         self.mod: float = 0.0
 
+        # Buchheim/Walker方式で使うスレッド
+        # 輪郭の末端にあるノードから、より深い位置にある輪郭の続きを指し示す
+        # thread_modはスレッドを辿ったときにmodの累積値に加える補正量
+        self.thread: 'TreeNode' = None
+        self.thread_mod: float = 0.0
+
+        # Buchheim/Walker方式で計算した、兄弟の中での相対的なX座標
+        self.prelim: float = 0.0
+
+        # 自分を頂点とするサブツリーの高さ（末端なら0）
+        self.height: int = 0
+
+        # 自分の子を配置したときに、兄弟をまたいでスレッドを張ったノードのリスト
+        self.group_threads: list = None
+
+        # 配下のサブツリーの形が前回の計算から変わっていればTrue
+        # dirtyなノードの祖先は必ずdirtyになる
+        self.dirty: bool = True
+
     #
     # ツリーを操作するヘルパー関数
     #
@@ -103,6 +125,96 @@ class TreeNode:
             return None
         return self.children[-1]
 
+    #
+    # ツリーを編集するメソッド
+    #
+
+    def add_child(self, child: 'TreeNode', index: int = None) -> 'TreeNode':
+        """子ノードを追加する
+
+        Args:
+            child (TreeNode): 追加するノード、親を持っていてはいけない
+            index (int, optional): 兄弟の中での位置、Noneなら一番右に追加する. Defaults to None.
+
+        Returns:
+            TreeNode: 追加したノード
+        """
+        if child.parent is not None:
+            raise ValueError(f"{child} already has a parent, use move_subtree()")
+
+        # 自分の祖先を子にすると循環してしまう
+        node = self
+        while node is not None:
+            if node is child:
+                raise ValueError(f"{child} is an ancestor of {self}")
+            node = node.parent
+
+        if index is None:
+            self.children.append(child)
+        else:
+            self.children.insert(index, child)
+        child.parent = self
+
+        self.mark_dirty()
+        return child
+
+    def remove_child(self, child: 'TreeNode') -> 'TreeNode':
+        """子ノードを取り除く
+
+        取り除いたノードは配下のサブツリーごと独立したツリーになる
+
+        Args:
+            child (TreeNode): 取り除くノード
+
+        Returns:
+            TreeNode: 取り除いたノード
+        """
+        if child.parent is not self:
+            raise ValueError(f"{child} is not a child of {self}")
+
+        # 兄弟をまたぐスレッドは取り除くノードの配下にも張られているので、切り離す前に消しておく
+        self.mark_dirty()
+
+        self.children.remove(child)
+        child.parent = None
+        return child
+
+    def move_subtree(self, new_parent: 'TreeNode', index: int = None) -> 'TreeNode':
+        """自分を頂点とするサブツリーを別の親の下に付け替える
+
+        Args:
+            new_parent (TreeNode): 新しい親
+            index (int, optional): 新しい親の子の中での位置、Noneなら一番右. Defaults to None.
+
+        Returns:
+            TreeNode: 自分自身
+        """
+        # 循環のチェックは切り離す前に行う
+        node = new_parent
+        while node is not None:
+            if node is self:
+                raise ValueError(f"{new_parent} is in the subtree of {self}")
+            node = node.parent
+
+        if self.parent is not None:
+            self.parent.remove_child(self)
+        return new_parent.add_child(self, index)
+
+    def mark_dirty(self):
+        """自分からルートまでの経路をdirtyにする
+
+        dirtyになったノードが兄弟をまたいで張っていたスレッドは、次のrelayout()で張り直すのでここで消しておく
+        """
+        node = self
+        while node is not None and not node.dirty:
+            node.dirty = True
+            if node.group_threads:
+                for threaded in node.group_threads:
+                    threaded.thread = None
+                    threaded.thread_mod = 0.0
+            node.group_threads = None
+            node = node.parent
+
     #
     # 特殊メソッド
     #
@@ -128,32 +240,81 @@ class TreeNode:
         return len(self.children)
 
 
+#
+# トラバーサル
+#
+# 再帰呼び出しで実装すると深いツリーでRecursionErrorになってしまう。
+# またジェネレータをyield fromで入れ子にすると、ノードを一つ返すたびに深さ分のジェネレータを経由するので、
+# 深いツリーでは計算量がO(n * depth)になってしまう。
+# そこで、このモジュールのトラバーサルは全て明示的なスタックを使って実装し、ツリーの深さに制限を設けない。
+#
+
 def preorder(node: TreeNode):
     if node == None:
         return
 
-    yield node
+    stack = [node]
+    while stack:
+        node = stack.pop()
 
-    for child in node.children:
-        yield from preorder(child)
+        yield node
+
+        # 左の子から取り出されるように、逆順に積む
+        stack.extend(reversed(node.children))
 
 
 def postorder(node: TreeNode):
     if node == None:
         return
 
-    for child in node.children:
-        yield from postorder(child)
+    # スタックには(ノード, 子を辿るイテレータ)を積む
+    stack = [(node, iter(node.children))]
+    while stack:
+        node, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            # 子を全て辿り終えた
+            stack.pop()
+            yield node
+        else:
+            stack.append((child, iter(child.children)))
+
+
+def iter_levels(node: TreeNode, key=None):
+    """幅優先で探索し、同じ深さのノードをまとめて返す
+
+    一つずつ返すのではなく深さごとにリストで返すので、深さ単位の計算をまとめて行える
 
-    yield node
+    Args:
+        node (TreeNode): _description_
+        key (_type_, optional): 最小値と最大値を求める値を返す関数. Defaults to None（X座標）.
+
+    Yields:
+        tuple: (深さ, ノードのリスト, keyの最小値, keyの最大値)、ノード数はリストの長さ
+    """
+    if node == None:
+        return
+
+    if key is None:
+        key = lambda n: n.x
+
+    depth = 0
+    level = [node]
+    while level:
+        keys = [key(n) for n in level]
+        yield depth, level, min(keys), max(keys)
+        level = [child for n in level for child in n.children]
+        depth += 1
 
 
 def calc_y_preorder(node: TreeNode, depth: int = 0):
-    """preorderトラバーサルで探索し、ノードに自身の深さを設定する
+    """ノードに自身の深さを設定する
 
     サブツリーが重ならないように調整する際に、ノードの深さの情報が必要になるので、
     最初にこれを実行して深さを設定する
 
+    親より先に子を処理できればよいので、preorderの代わりに深さごとにまとめて処理する
+
     Args:
         node (TreeNode): _description_
         depth (int, optional): _description_. Defaults to 0.
@@ -161,19 +322,18 @@ def calc_y_preorder(node: TreeNode, depth: int = 0):
     if node == None:
         return
 
-    #
-    # preorder処理
-    #
-
-    # 深さをノードに設定
-    node.depth = depth
+    level = [node]
+    while level:
+        for n in level:
+            # 深さをノードに設定
+            n.depth = depth
 
-    # Y座標は親のY座標に最小距離を加えたものに設定する
-    if node.parent:
-        node.y = node.parent.y + TreeNode.MINIMAL_Y_DISTANCE
+            # Y座標は親のY座標に最小距離を加えたものに設定する
+            if n.parent:
+                n.y = n.parent.y + TreeNode.MINIMAL_Y_DISTANCE
 
-    for child in node.children:
-        calc_y_preorder(child, depth + 1)
+        level = [child for n in level for child in n.children]
+        depth += 1
 
 
 def calc_x_postorder(node: TreeNode):
@@ -193,11 +353,21 @@ def calc_x_postorder(node: TreeNode):
     Args:
         node (TreeNode): _description_
     """
-    if node == None:
-        return
+    stats = layout_stats.current
+    for child in postorder(node):
+        calc_x_postorder_node(child)
+        if stats is not None:
+            stats.nodes_visited += 1
+
+
+def calc_x_postorder_node(node: TreeNode):
+    """calc_x_postorder()において、postorderでたどり着いたノード一つ分の処理を行う
 
-    for child in node.children:
-        calc_x_postorder(child)
+    子ノードのX座標は設定済みであること
+
+    Args:
+        node (TreeNode): _description_
+    """
 
     #
     # postorder処理
@@ -278,7 +448,7 @@ def calc_x_postorder(node: TreeNode):
 
 
 def get_left_contour(node: TreeNode, mod_sum: float = 0.0, left_contour: dict = {}):
-    """preorderトラバーサルで探索し、ノードの左輪郭を取得する
+    """深さごとにまとめて探索し、ノードの左輪郭を取得する
 
     ノードにはdepthキーで深さが設定されているものとする。
 
@@ -290,49 +460,60 @@ def get_left_contour(node: TreeNode, mod_sum: float = 0.0, left_contour: dict =
         node (TreeNode): _description_
         mod_sum (float, optional): _description_. Defaults to 0.0.
         left_contour (dict, optional): _description_. Defaults to {}.
+
+    Returns:
+        int: 辿ったノード数
     """
     if node == None:
-        return
+        return 0
 
-    #
-    # preorder探索の処理
-    #
+    # 同じ深さのノードと、そこに適用するmodの累積値を組にしてまとめて扱う
+    num_nodes = 0
+    level = [(node, mod_sum)]
+    while level:
+        num_nodes += len(level)
+        depth = level[0][0].depth
+        x = min(n.x + s for n, s in level)
 
-    if left_contour.get(node.depth) is None:
-        left_contour[node.depth] = node.x + mod_sum
-    else:
-        left_contour[node.depth] = min(left_contour[node.depth], node.x + mod_sum)
+        if left_contour.get(depth) is None:
+            left_contour[depth] = x
+        else:
+            left_contour[depth] = min(left_contour[depth], x)
 
-    mod_sum += node.mod
+        level = [(child, s + n.mod) for n, s in level for child in n.children]
 
-    for child in node.children:
-        get_left_contour(child, mod_sum, left_contour)
+    return num_nodes
 
 
 def get_right_contour(node: TreeNode, mod_sum: float = 0.0, right_contour: dict = {}):
-    """preorderトラバーサルで探索し、ノードの右輪郭を取得する
+    """深さごとにまとめて探索し、ノードの右輪郭を取得する
 
     Args:
         node (TreeNode): _description_
         mod_sum (float, optional): _description_. Defaults to 0.0.
         right_contour (dict, optional): _description_. Defaults to {}.
+
+    Returns:
+        int: 辿ったノード数
     """
     if node == None:
-        return
+        return 0
 
-    #
-    # preorder探索の処理
-    #
+    num_nodes = 0
+    level = [(node, mod_sum)]
+    while level:
+        num_nodes += len(level)
+        depth = level[0][0].depth
+        x = max(n.x + s for n, s in level)
 
-    if right_contour.get(node.depth) is None:
-        right_contour[node.depth] = node.x + mod_sum
-    else:
-        right_contour[node.depth] = max(right_contour[node.depth], node.x + mod_sum)
+        if right_contour.get(depth) is None:
+            right_contour[depth] = x
+        else:
+            right_contour[depth] = max(right_contour[depth], x)
 
-    mod_sum += node.mod
+        level = [(child, s + n.mod) for n, s in level for child in n.children]
 
-    for child in node.children:
-        get_right_contour(child, mod_sum, right_contour)
+    return num_nodes
 
 
 def get_minimum_distance_between(left_node: TreeNode, right_node: TreeNode) -> float:
@@ -358,11 +539,11 @@ def get_minimum_distance_between(left_node: TreeNode, right_node: TreeNode) -> f
 
     # 左ノードの右輪郭を取得
     left_node_right_contour = {}
-    get_right_contour(left_node, mod_sum=0, right_contour=left_node_right_contour)
+    num_nodes = get_right_contour(left_node, mod_sum=0, right_contour=left_node_right_contour)
 
     # 右ノードの左輪郭を取得
     right_node_left_contour = {}
-    get_left_contour(right_node, mod_sum=0, left_contour=right_node_left_contour)
+    num_nodes += get_left_contour(right_node, mod_sum=0, left_contour=right_node_left_contour)
 
     # 輪郭の辞書のキーは階層を表しているので、その数字の最大値が輪郭の深さになる
     # 輪郭の深さの短い方を取得する
@@ -375,6 +556,10 @@ def get_minimum_distance_between(left_node: TreeNode, right_node: TreeNode) -> f
         if distance < min_distance:
             min_distance = distance
 
+    stats = layout_stats.current
+    if stats is not None:
+        stats.add_contour(num_nodes, min_depth - right_node.depth)
+
     return float(min_distance)
 
 
@@ -448,6 +633,9 @@ def equalize_position(node: TreeNode) -> bool:
     # 間にいる兄弟の数を考慮して望ましい間隔を求める
     desired_interval = width / (num_nodes_between + 1)
 
+    # 兄弟を動かした回数
+    num_shifts = 0
+
     # 左端の一つ右のノードから始めて、自分に至るまで
     for i in range(1, node_index + 1):
         mid_node = node.parent.children[i]
@@ -467,12 +655,18 @@ def equalize_position(node: TreeNode) -> bool:
                 shift_value = TreeNode.MINIMAL_X_DISTANCE - distance
                 mid_node.x += shift_value
                 mid_node.mod += shift_value
+                num_shifts += 1
 
         # 左隣りとの間隔が、望まれる間隔よりも狭ければ広げる
         if mid_node.x - prev_node.x < desired_interval:
             shift_value = desired_interval - mid_node.x + prev_node.x
             mid_node.x += shift_value
             mid_node.mod += shift_value
+            num_shifts += 1
+
+    stats = layout_stats.current
+    if stats is not None:
+        stats.equalize_shifts += num_shifts
 
     # 元の位置から変わっていたらTrueを返し、変わらなければFalseを返す
     if node.x - node_x > 0:
@@ -480,85 +674,504 @@ def equalize_position(node: TreeNode) -> bool:
     return False
 
 
+#
+# Buchheim/Walker方式のX座標計算
+#
+# calc_x_postorder()は兄弟ノードとの重なりを調べるたびにget_minimum_distance_between()でサブツリー全体を探索するため、
+# ノード数が多いツリーでは計算量がO(n^2)以上になってしまう。
+#
+# ここではBuchheimらの改良版Walkerアルゴリズムと同様に、輪郭の末端からより深い輪郭へスレッドを張っておき、
+# 輪郭を構成するノードだけを辿ることで計算量をO(n)に抑える。
+# 兄弟の初期位置、重なりの解消、均等化のルールはcalc_x_postorder()と同じにしてあるので、同じ座標が得られる。
+#
+# 親からの相対位置prelim、mod、スレッド、サブツリーの高さは計算後もノードに残しておく。
+# これらは配下のサブツリーの形が変わらない限り有効なので、
+# ツリーを編集したあとはrelayout()で変更のあったノードからルートまでの経路だけを計算し直せばよい。
+#
+# 参考文献
+# Christoph Buchheim, Michael Junger, Sebastian Leipert
+# Improving Walker's Algorithm to Run in Linear Time
+#
+
+def get_next_left_contour(node: TreeNode, mod_sum: float) -> tuple:
+    """左輪郭において、一つ深い階層のノードと、そのノードに適用されるmodの累積値を返す
+
+    子がいれば一番左の子が、いなければスレッドの先が次の輪郭になる
+
+    Args:
+        node (TreeNode): 輪郭を構成するノード
+        mod_sum (float): nodeのmodまで加算したmodの累積値
+
+    Returns:
+        tuple: (次の輪郭ノード, 次の輪郭ノードに適用されるmodの累積値)
+    """
+    if node.children:
+        return node.children[0], mod_sum
+    return node.thread, mod_sum + node.thread_mod
+
+
+def get_next_right_contour(node: TreeNode, mod_sum: float) -> tuple:
+    """右輪郭において、一つ深い階層のノードと、そのノードに適用されるmodの累積値を返す
+
+    Args:
+        node (TreeNode): 輪郭を構成するノード
+        mod_sum (float): nodeのmodまで加算したmodの累積値
+
+    Returns:
+        tuple: (次の輪郭ノード, 次の輪郭ノードに適用されるmodの累積値)
+    """
+    if node.children:
+        return node.children[-1], mod_sum
+    return node.thread, mod_sum + node.thread_mod
+
+
+def set_initial_x(node: TreeNode, previous_sibling: TreeNode):
+    """calc_x_postorder()と同じルールで、兄弟の中での初期位置とmodを設定する
+
+    Args:
+        node (TreeNode): 位置を決めるノード
+        previous_sibling (TreeNode): 左隣の兄弟、一番左であればNone
+    """
+    node.mod = 0.0
+
+    if previous_sibling is None:
+        # 兄弟の一番左は基準位置になるので、子の中央（子がいなければ0）に置く
+        if len(node.children) == 0:
+            node.prelim = 0
+        elif len(node.children) == 1:
+            node.prelim = node.children[0].prelim
+        else:
+            node.prelim = (node.children[0].prelim + node.children[-1].prelim) / 2
+        return
+
+    # 一番左でなければ、左隣のX座標に最小間隔を加える
+    node.prelim = previous_sibling.prelim + TreeNode.MINIMAL_X_DISTANCE
+
+    # 子の中央が自分のX座標になるように、子を動かす量をmodに記録する
+    if len(node.children) == 1:
+        node.mod = node.prelim - node.children[0].prelim
+    elif len(node.children) > 1:
+        node.mod = node.prelim - (node.children[0].prelim + node.children[-1].prelim) / 2
+
+
+def apportion(children: list, index: int, forest_height: int, resolve: bool = True) -> TreeNode:
+    """index番目の子の左輪郭と、それより左にいる兄弟全体の右輪郭を比較して重なりを解消し、スレッドを張る
+
+    resolve_overlap()と同じく、兄弟ノードの階層より深い階層だけを比較する。
+    左にいる兄弟全体の右輪郭は、スレッドを辿ることで一つのチェーンとして得られる。
+    比較は浅い方の輪郭の末端までで止まるので、計算量は浅い方のサブツリーの高さに比例する。
+
+    比較が終わったら、浅い方の輪郭の末端から、深い方の輪郭の続きへスレッドを張る。
+
+    Args:
+        children (list): 兄弟ノードのリスト
+        index (int): 位置を決める子のインデックス
+        forest_height (int): 左にいる兄弟全体の高さ
+        resolve (bool, optional): Falseならスレッドの補正量だけを設定し直す. Defaults to True.
+
+    Returns:
+        TreeNode: スレッドを張ったノード、張らなかった場合はNone
+    """
+    node = children[index]
+
+    # vil: 左の兄弟全体の右輪郭、vir: 自分の左輪郭
+    # vol: 左の兄弟全体の左輪郭、vor: 自分の右輪郭
+    vil = children[index - 1]
+    vir = vor = node
+    vol = children[0]
+    sil = vil.mod
+    sir = sor = node.mod
+    sol = vol.mod
+
+    min_distance = sys.float_info.max
+
+    depth = min(node.height, forest_height)
+    for _ in range(depth):
+        vil, sil = get_next_right_contour(vil, sil)
+        vir, sir = get_next_left_contour(vir, sir)
+        vol, sol = get_next_left_contour(vol, sol)
+        vor, sor = get_next_right_contour(vor, sor)
+
+        if resolve:
+            distance = (vir.prelim + sir) - (vil.prelim + sil)
+            if distance < min_distance:
+                min_distance = distance
+
+        sil += vil.mod
+        sir += vir.mod
+        sol += vol.mod
+        sor += vor.mod
+
+    stats = layout_stats.current
+    if stats is not None:
+        # 4本の輪郭を辿っている
+        if resolve:
+            stats.add_contour(4 * depth, depth)
+        else:
+            stats.contour_nodes += 4 * depth
+
+    if resolve and min_distance < TreeNode.MINIMAL_X_DISTANCE:
+        # 重なっているので自分を右にずらし、配下のサブツリーはmodで後からまとめて動かす
+        shift_value = TreeNode.MINIMAL_X_DISTANCE - min_distance
+        node.prelim += shift_value
+        node.mod += shift_value
+        sir += shift_value
+        sor += shift_value
+
+    if forest_height > node.height:
+        # 自分の方が浅いので、自分の右輪郭の末端から、左の兄弟全体の右輪郭の続きへスレッドを張る
+        next_node, next_mod_sum = get_next_right_contour(vil, sil)
+        vor.thread = next_node
+        vor.thread_mod = next_mod_sum - sor
+        return vor
+
+    if node.height > forest_height:
+        # 自分の方が深いので、左の兄弟全体の左輪郭の末端から、自分の左輪郭の続きへスレッドを張る
+        next_node, next_mod_sum = get_next_left_contour(vir, sir)
+        vol.thread = next_node
+        vol.thread_mod = next_mod_sum - sol
+        return vol
+
+    return None
+
+
+def get_contour_distance(left_node: TreeNode, right_node: TreeNode) -> float:
+    """get_minimum_distance_between()と同じ値を、輪郭のノードだけを辿って求める
+
+    Args:
+        left_node (TreeNode): left sibling
+        right_node (TreeNode): right sibling
+
+    Returns:
+        float: distance between left and right sibling
+    """
+    vil = left_node
+    vir = right_node
+    sil = vil.mod
+    sir = vir.mod
+
+    min_distance: float = sys.float_info.max
+
+    depth = min(left_node.height, right_node.height)
+    for _ in range(depth):
+        vil, sil = get_next_right_contour(vil, sil)
+        vir, sir = get_next_left_contour(vir, sir)
+
+        distance = (vir.prelim + sir) - (vil.prelim + sil)
+        if distance < min_distance:
+            min_distance = distance
+
+        sil += vil.mod
+        sir += vir.mod
+
+    stats = layout_stats.current
+    if stats is not None:
+        stats.add_contour(2 * depth, depth)
+
+    return float(min_distance)
+
+
+def equalize_position_buchheim(children: list) -> bool:
+    """equalize_position()と同じ処理を、輪郭のノードだけを辿って行う
+
+    Args:
+        children (list): 兄弟ノードのリスト
+
+    Returns:
+        bool: 兄弟のいずれかが動いたらTrue
+    """
+    node_index = len(children) - 1
+
+    # 自分と左端ノードの間に兄弟ノードがないなら何もしない
+    num_nodes_between = node_index - 1
+    if num_nodes_between <= 0:
+        return False
+
+    width = children[-1].prelim - children[0].prelim
+    desired_interval = width / (num_nodes_between + 1)
+
+    moved = False
+    num_shifts = 0
+    for i in range(1, node_index + 1):
+        mid_node = children[i]
+        prev_node = children[i-1]
+
+        if i > 1 and len(mid_node.children) > 0:
+            distance = get_contour_distance(prev_node, mid_node)
+            if distance < TreeNode.MINIMAL_X_DISTANCE:
+                shift_value = TreeNode.MINIMAL_X_DISTANCE - distance
+                mid_node.prelim += shift_value
+                mid_node.mod += shift_value
+                moved = True
+                num_shifts += 1
+
+        if mid_node.prelim - prev_node.prelim < desired_interval:
+            shift_value = desired_interval - mid_node.prelim + prev_node.prelim
+            mid_node.prelim += shift_value
+            mid_node.mod += shift_value
+            moved = True
+            num_shifts += 1
+
+    stats = layout_stats.current
+    if stats is not None:
+        stats.equalize_shifts += num_shifts
+
+    return moved
+
+
+def place_children_buchheim(children: list) -> list:
+    """配下のサブツリーの相対位置が決まっている兄弟ノードを左から順に配置する
+
+    Args:
+        children (list): 兄弟ノードのリスト
+
+    Returns:
+        list: 兄弟をまたいでスレッドを張ったノードのリスト
+    """
+    group_threads = []
+
+    forest_heights = []
+    forest_height = -1
+    for i, child in enumerate(children):
+        set_initial_x(child, children[i-1] if i > 0 else None)
+        if i > 0:
+            # 子がいなければcalc_x_postorder()と同様に重なりは調べないが、スレッドは張る必要がある
+            threaded = apportion(children, i, forest_height, resolve=len(child.children) > 0)
+            if threaded is not None:
+                group_threads.append(threaded)
+        forest_height = max(forest_height, child.height)
+        forest_heights.append(forest_height)
+
+    # 一番右の兄弟に子がいる場合に限り、calc_x_postorder()と同様に兄弟間の位置を均等化する
+    if len(children) > 1 and len(children[-1].children) > 0:
+        if equalize_position_buchheim(children):
+            # 兄弟が動いたので、兄弟をまたぐスレッドの補正量を設定し直す
+            for i in range(1, len(children)):
+                apportion(children, i, forest_heights[i-1], resolve=False)
+
+    return group_threads
+
+
+def calc_children_x_buchheim(node: TreeNode):
+    """postorderトラバーサルで探索し、子ノードを兄弟の中で配置する
+
+    dirtyでないノードは配下のサブツリーも含めて前回の計算結果がそのまま使えるので探索しない。
+
+    Args:
+        node (TreeNode): _description_
+    """
+    if not node.dirty:
+        return
+
+    stats = layout_stats.current
+
+    # スタックには(ノード, 子を積み終えたか)を積む
+    stack = [(node, False)]
+    while stack:
+        node, visited = stack.pop()
+
+        if not visited:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children if child.dirty)
+            continue
+
+        #
+        # postorder処理
+        #
+
+        node.height = max([child.height + 1 for child in node.children], default=0)
+        node.group_threads = place_children_buchheim(node.children)
+        node.dirty = False
+
+        if stats is not None:
+            stats.nodes_visited += 1
+
+
+def calc_x_postorder_buchheim(node: TreeNode):
+    """calc_x_postorder()と同じ座標をO(n)で求める
+
+    子の位置決めは親ノードの処理としてまとめて行う。
+    自分自身の位置は親が決めるので、ルートノードは最後に単独で位置を決める。
+    結果は親からの相対位置prelimとmodに設定されるので、calc_x_preorder_buchheim()で絶対位置に変換する。
+
+    注意:
+        equalize_position()は隣り合う兄弟同士でしか重なりを確認しないため、
+        均等化の結果、隣り合わない兄弟のサブツリーが重なってしまうことがある。
+        calc_x_postorder()は重なったノードも含めた各階層の最小値・最大値で輪郭を求めるのに対し、
+        こちらは左から順に並んだ輪郭をスレッドで辿るため、そのような場合に限り座標が一致しない。
+
+    Args:
+        node (TreeNode): _description_
+    """
+    calc_children_x_buchheim(node)
+    if node.is_root():
+        set_initial_x(node, None)
+
+
+def calc_x_preorder_buchheim(node: TreeNode, mod_sum: float = 0.0, depth: int = 0):
+    """preorderトラバーサルで探索して深さ、X座標、Y座標を確定します
+
+    calc_x_preorder()と違い、prelimやmodは次回のrelayout()で使うので変更しない。
+    ノードの付け替えで深さが変わることがあるので、深さとY座標もここで設定する。
+    """
+    if node == None:
+        return
+
+    stack = [(node, mod_sum, depth)]
+    while stack:
+        node, mod_sum, depth = stack.pop()
+
+        node.depth = depth
+
+        if node.parent:
+            node.y = node.parent.y + TreeNode.MINIMAL_Y_DISTANCE
+
+        node.x = node.prelim + mod_sum
+
+        mod_sum += node.mod
+
+        for child in reversed(node.children):
+            stack.append((child, mod_sum, depth + 1))
+
+
+def relayout(tree: TreeNode):
+    """前回の計算以降に変更のあったノードだけを計算し直して、ツリー全体の位置を更新する
+
+    add_child()、remove_child()、move_subtree()で変更されたノードからルートまでの経路がdirtyになっている。
+    dirtyなノードの兄弟配置だけをやり直し、それ以外のサブツリーはキャッシュした輪郭（スレッド）を再利用する。
+    最後の絶対位置への変換はツリー全体を一度だけ辿る。
+
+    Args:
+        tree (TreeNode): ルートノード
+    """
+    with layout_stats.phase("x_postorder"):
+        calc_x_postorder_buchheim(tree)
+
+    # 深さとY座標もここで決まる
+    with layout_stats.phase("finalize"):
+        calc_x_preorder_buchheim(tree)
+
+
 def calc_x_preorder(node: TreeNode, mod_sum: float = 0.0):
     """preorderトラバーサルで探索してノードのX座標を確定します
     """
     if node == None:
         return
 
-    #
-    # preorder処理
-    #
+    stack = [(node, mod_sum)]
+    while stack:
+        node, mod_sum = stack.pop()
+
+        #
+        # preorder処理
+        #
 
-    # 自分の位置をmod_sumd移動
-    node.x += mod_sum
+        # 自分の位置をmod_sumd移動
+        node.x += mod_sum
 
-    # 自分のmodを加算して、子を動かす
-    mod_sum += node.mod
+        # 自分のmodを加算して、子を動かす
+        mod_sum += node.mod
 
-    # 自分のmodはこれでリセット
-    node.mod = 0
+        # 自分のmodはこれでリセット
+        node.mod = 0
 
-    for child in node.children:
-        calc_x_preorder(child, mod_sum)
+        # スレッドも位置が確定すれば不要
+        # Buchheim/Walker方式で計算した結果を壊してしまうので、次のrelayout()は全体を計算し直す
+        node.thread = None
+        node.thread_mod = 0.0
+        node.group_threads = None
+        node.dirty = True
+
+        for child in reversed(node.children):
+            stack.append((child, mod_sum))
 
 
 def print_tree(node, indent=0):
     if node is None:
         return
 
-    # 現在のノードを出力
-    print(f"{indent * ' '}{node.node_name}")
+    stack = [(node, indent)]
+    while stack:
+        node, indent = stack.pop()
+
+        # 現在のノードを出力
+        print(f"{indent * ' '}{node.node_name}")
 
-    for child in node.children:
-        print_tree(child, indent + 1)
+        for child in reversed(node.children):
+            stack.append((child, indent + 1))
 
 
 def dump_tree(node, indent=0):
     if node is None:
         return
 
-    # 現在のノードを出力
-    print(f"{indent * ' '}{node.node_name} (x,y)=({node.x}, {node.y}) mod={node.mod}")
+    stack = [(node, indent)]
+    while stack:
+        node, indent = stack.pop()
 
-    for child in node.children:
-        dump_tree(child, indent + 1)
+        # 現在のノードを出力
+        print(f"{indent * ' '}{node.node_name} (x,y)=({node.x}, {node.y}) mod={node.mod}")
+
+        for child in reversed(node.children):
+            stack.append((child, indent + 1))
 
 
 def save_png(node, filename):
-    import matplotlib.pyplot as plt
-    import networkx as nx
+    """ツリーを画像として保存する
 
-    def add_tree(root, G):
-        if root is None:
-            return
-        G.add_node(root.node_name, label=f"{root.node_name}")
-        for child in root.children:
-            G.add_edge(root.node_name, child.node_name)
-            add_tree(child, G)
+    拡張子が.svgならラベル付きのSVG、それ以外はPNGで保存する
+    """
+    from tree_render import save_image
+    save_image(node, filename)
 
-    def get_postion_preorder(root, position={}):
-        if root is None:
-            return
-        position[root.node_name] = (root.x, -root.y)
-        for child in root.children:
-            get_postion_preorder(child, position)
 
-    position = {}
-    get_postion_preorder(node, position)
+def calc_tree_position(tree : TreeNode, engine: str = "classic"):
+    """ツリー全体の位置を計算する
+
+    Args:
+        tree (TreeNode): ルートノード
+        engine (str, optional): X座標の計算方法. Defaults to "classic".
+            "classic"  兄弟ノードごとにサブツリー全体の輪郭を求めるcalc_x_postorder()
+            "buchheim" スレッドを使って輪郭だけを辿るcalc_x_postorder_buchheim()、計算量はO(n)
+                       結果はノードに残るので、ツリーを編集したあとはrelayout()で差分だけを計算できる
+            "parallel" ルートの子ごとのサブツリーをプロセスプールで計算するparallel_layout.calc_tree_position_parallel()
+                       座標は"buchheim"と同じ、NumPyが必要
+            "memo"     同じ形のサブツリーの計算結果を再利用するmemo_layout.calc_tree_position_memo()
+                       座標は"buchheim"と同じ
+
+    layout_stats.collect_layout_stats()のwith文の中で実行すると、フェーズごとの時間や輪郭を辿った量を集める。
+    """
+    if engine not in ("classic", "buchheim", "parallel", "memo"):
+        raise ValueError(f"unknown engine: {engine}")
+
+    if engine == "memo":
+        from memo_layout import calc_tree_position_memo
+        calc_tree_position_memo(tree)
+        return
+
+    if engine == "parallel":
+        from parallel_layout import calc_tree_position_parallel
+        calc_tree_position_parallel(tree)
+        return
+
+    if engine == "buchheim":
+        # 前回の計算結果は使わずに全体を計算し直す
+        with layout_stats.phase("reset"):
+            for node in preorder(tree):
+                node.dirty = True
+                node.thread = None
+                node.group_threads = None
+        relayout(tree)
+        return
 
-    G = nx.Graph()
-    add_tree(node, G)
-    # nx.draw(G, pos=position, node_size=100)
-    nx.draw(G, pos=position, node_size=300, with_labels=True, font_size=8, font_color='white')
-    plt.savefig(filename)
-    plt.cla()
+    with layout_stats.phase("y"):
+        calc_y_preorder(tree)
 
+    with layout_stats.phase("x_postorder"):
+        calc_x_postorder(tree)
 
-def calc_tree_position(tree : TreeNode):
-    calc_y_preorder(tree)
-    calc_x_postorder(tree)
-    calc_x_preorder(tree)
+    with layout_stats.phase("finalize"):
+        calc_x_preorder(tree)
 
 
 if __name__ == '__main__':
@@ -695,7 +1308,7 @@ if __name__ == '__main__':
         trees = create_test_TreeNode()
 
         for i, tree in enumerate(trees):
-            test_tree(tree, f"log/tree_{i}.png")
+            test_tree(tree, f"log/tree_{i}.svg")
 
         return 0
 
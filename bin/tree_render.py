@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+#
+# 計算済みのツリーをSVGまたはPNGに描画する
+#
+# networkxのグラフを経由せずに、ノードの位置から直接ファイルに書き出す。
+#   - ノードを名前で識別しないので、同じ名前のノードがあっても一つにまとめられることはない
+#   - ツリーを辿りながら書き出すので、ノード数に比例するデータ構造を作らない
+#
+# 描画できるツリーは以下のいずれか
+#   - tree_layout.TreeNode    （childrenを持つ）
+#   - binary_search_tree_layout.BinaryTreeNode （left, rightを持つ）
+#   - compact_tree.CompactTree （child_offsetsを持つ）
+#
+# SVGは 辺、ノード、ラベル の順に重ねて描くため、ツリーを3回辿る。
+# PNGは標準ライブラリのzlibだけで書き出す。ラベルは描かないので、ラベルが必要な場合はSVGを使う。
+#
+
+import math
+import struct
+import sys
+import zlib
+
+# X座標、Y座標の1がSVGで何ピクセルになるか
+SCALE = 40
+
+# ノードの円の半径（ピクセル）
+NODE_RADIUS = 10
+
+# ラベルの文字の大きさ（ピクセル）
+FONT_SIZE = 8
+
+# 色はnetworkxのデフォルトに合わせる
+NODE_COLOR = '#1f78b4'
+EDGE_COLOR = '#000000'
+LABEL_COLOR = '#ffffff'
+BACKGROUND_COLOR = '#ffffff'
+
+# まとめて書き込む要素の数
+WRITE_BATCH_SIZE = 10_000
+
+# PNGの縦横の最大ピクセル数
+# 画像のメモリは縦×横バイトになるので、ノード数ではなくこの値で上限が決まる
+MAX_IMAGE_SIZE = 4096
+
+# CompactTreeの配列をリストに変換するときの単位
+COMPACT_CHUNK_SIZE = 1 << 16
+
+
+def iter_render_items(tree):
+    """描画に必要な情報を(ラベル, x, y, 親のx, 親のy)の形で順に取り出す
+
+    ルートの親のx, 親のyはNoneになる
+
+    Args:
+        tree (_type_): TreeNode、BinaryTreeNodeのルートノード、またはCompactTree
+
+    Yields:
+        tuple: (label, x, y, parent_x, parent_y)
+    """
+    if tree is None:
+        return
+
+    if hasattr(tree, 'child_offsets'):
+        yield from iter_compact_tree_items(tree)
+        return
+
+    binary = not hasattr(tree, 'children')
+
+    stack = [(tree, None, None)]
+    while stack:
+        node, parent_x, parent_y = stack.pop()
+        if binary:
+            yield node.data, node.x, node.y, parent_x, parent_y
+            children = [c for c in (node.right, node.left) if c is not None]
+        else:
+            yield node.node_name, node.x, node.y, parent_x, parent_y
+            children = reversed(node.children)
+        for child in children:
+            stack.append((child, node.x, node.y))
+
+
+def iter_compact_tree_items(tree):
+    parent = tree.parent
+    x = tree.x
+    y = tree.y
+    names = tree.names
+
+    # 配列全体を一度にリストにするとノード数に比例したメモリを使うので、一定数ずつ変換する
+    for start in range(0, len(tree), COMPACT_CHUNK_SIZE):
+        end = min(start + COMPACT_CHUNK_SIZE, len(tree))
+        parents = parent[start:end]
+        xs = x[start:end].tolist()
+        ys = y[start:end].tolist()
+        parent_xs = x[parents].tolist()
+        parent_ys = y[parents].tolist()
+        for i, p in enumerate(parents.tolist()):
+            if p < 0:
+                yield names[start + i], xs[i], ys[i], None, None
+            else:
+                yield names[start + i], xs[i], ys[i], parent_xs[i], parent_ys[i]
+
+
+def escape(text: str) -> str:
+    # xml.sax.saxutilsはurllibまで読み込んで起動が遅くなるので、必要な置き換えだけを行う
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def get_bounds(tree) -> tuple:
+    """ノードの位置の最小値と最大値を求める
+
+    Returns:
+        tuple: (min_x, min_y, max_x, max_y)
+    """
+    min_x = min_y = math.inf
+    max_x = max_y = -math.inf
+    for _, x, y, _, _ in iter_render_items(tree):
+        if x < min_x:
+            min_x = x
+        if x > max_x:
+            max_x = x
+        if y < min_y:
+            min_y = y
+        if y > max_y:
+            max_y = y
+    if min_x > max_x:
+        return 0, 0, 0, 0
+    return min_x, min_y, max_x, max_y
+
+
+def save_svg(tree, filename, scale: float = SCALE, node_radius: float = NODE_RADIUS,
+             font_size: float = FONT_SIZE, with_labels: bool = True):
+    """SVGで書き出す
+
+    Args:
+        tree (_type_): TreeNode、BinaryTreeNodeのルートノード、またはCompactTree
+        filename (_type_): ファイル名、またはテキストモードで開いたファイル
+        scale (float, optional): 座標の1を何ピクセルにするか. Defaults to SCALE.
+        node_radius (float, optional): ノードの半径. Defaults to NODE_RADIUS.
+        font_size (float, optional): ラベルの文字の大きさ. Defaults to FONT_SIZE.
+        with_labels (bool, optional): ラベルを描くかどうか. Defaults to True.
+    """
+    if isinstance(filename, str):
+        with open(filename, 'w', encoding='utf-8') as fp:
+            return save_svg(tree, fp, scale=scale, node_radius=node_radius,
+                            font_size=font_size, with_labels=with_labels)
+
+    fp = filename
+
+    min_x, min_y, max_x, max_y = get_bounds(tree)
+    margin = node_radius + 1
+    width = (max_x - min_x) * scale + margin * 2
+    height = (max_y - min_y) * scale + margin * 2
+
+    def to_px(x, y):
+        return round((x - min_x) * scale + margin, 2), round((y - min_y) * scale + margin, 2)
+
+    def write_batches(lines):
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                fp.write(''.join(batch))
+                batch.clear()
+        if batch:
+            fp.write(''.join(batch))
+
+    def edges():
+        for _, x, y, parent_x, parent_y in iter_render_items(tree):
+            if parent_x is None:
+                continue
+            x1, y1 = to_px(parent_x, parent_y)
+            x2, y2 = to_px(x, y)
+            yield f'<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}"/>\n'
+
+    def nodes():
+        for _, x, y, _, _ in iter_render_items(tree):
+            cx, cy = to_px(x, y)
+            yield f'<circle cx="{cx}" cy="{cy}" r="{node_radius}"/>\n'
+
+    def labels():
+        for label, x, y, _, _ in iter_render_items(tree):
+            cx, cy = to_px(x, y)
+            yield f'<text x="{cx}" y="{cy}">{escape(str(label))}</text>\n'
+
+    fp.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    fp.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.2f}" height="{height:.2f}" '
+             f'viewBox="0 0 {width:.2f} {height:.2f}">\n')
+    fp.write(f'<rect width="100%" height="100%" fill="{BACKGROUND_COLOR}"/>\n')
+
+    fp.write(f'<g stroke="{EDGE_COLOR}" stroke-width="1">\n')
+    write_batches(edges())
+    fp.write('</g>\n')
+
+    fp.write(f'<g fill="{NODE_COLOR}">\n')
+    write_batches(nodes())
+    fp.write('</g>\n')
+
+    if with_labels:
+        fp.write(f'<g fill="{LABEL_COLOR}" font-family="sans-serif" font-size="{font_size}" '
+                 f'text-anchor="middle" dominant-baseline="central">\n')
+        write_batches(labels())
+        fp.write('</g>\n')
+
+    fp.write('</svg>\n')
+
+
+#
+# PNG
+#
+
+# パレットの番号
+BACKGROUND = 0
+EDGE = 1
+NODE = 2
+
+# 一度に圧縮する行数
+PNG_ROWS_PER_CHUNK = 256
+
+
+def hex_to_rgb(color: str) -> bytes:
+    return bytes.fromhex(color.lstrip('#'))
+
+
+def draw_line(canvas: bytearray, width: int, height: int, x0: int, y0: int, x1: int, y1: int, color: int):
+    """Bresenhamのアルゴリズムで線を引く"""
+    dx = abs(x1 - x0)
+    dy = -abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    err = dx + dy
+    while True:
+        if 0 <= x0 < width and 0 <= y0 < height:
+            canvas[y0 * width + x0] = color
+        if x0 == x1 and y0 == y1:
+            return
+        e2 = 2 * err
+        if e2 >= dy:
+            err += dy
+            x0 += sx
+        if e2 <= dx:
+            err += dx
+            y0 += sy
+
+
+def fill_circle(canvas: bytearray, width: int, height: int, cx: int, cy: int, radius: int, color: int):
+    """円を塗りつぶす、行ごとにまとめて書き込む"""
+    for dy in range(-radius, radius + 1):
+        y = cy + dy
+        if y < 0 or y >= height:
+            continue
+        half = int(math.sqrt(radius * radius - dy * dy))
+        left = max(cx - half, 0)
+        right = min(cx + half, width - 1)
+        if left > right:
+            continue
+        row = y * width
+        canvas[row + left:row + right + 1] = bytes((color,)) * (right - left + 1)
+
+
+def write_png_chunk(fp, chunk_type: bytes, data: bytes):
+    fp.write(struct.pack('>I', len(data)))
+    fp.write(chunk_type)
+    fp.write(data)
+    fp.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def save_png(tree, filename, scale: float = SCALE, node_radius: float = NODE_RADIUS,
+             max_size: int = MAX_IMAGE_SIZE):
+    """PNGで書き出す
+
+    画像が max_size を超える場合は、収まるように縮小する。
+    ラベルは描かない。
+
+    Args:
+        tree (_type_): TreeNode、BinaryTreeNodeのルートノード、またはCompactTree
+        filename (_type_): ファイル名、またはバイナリモードで開いたファイル
+        scale (float, optional): 座標の1を何ピクセルにするか. Defaults to SCALE.
+        node_radius (float, optional): ノードの半径. Defaults to NODE_RADIUS.
+        max_size (int, optional): 縦横の最大ピクセル数. Defaults to MAX_IMAGE_SIZE.
+    """
+    if isinstance(filename, str):
+        with open(filename, 'wb') as fp:
+            return save_png(tree, fp, scale=scale, node_radius=node_radius, max_size=max_size)
+
+    fp = filename
+
+    min_x, min_y, max_x, max_y = get_bounds(tree)
+
+    # 収まらない場合は、ノードの半径も同じ割合で縮小する
+    extent = max(max_x - min_x, max_y - min_y)
+    margin = node_radius + 1
+    if extent * scale + margin * 2 > max_size:
+        ratio = max_size / (extent * scale + margin * 2)
+        scale *= ratio
+        node_radius *= ratio
+        margin = node_radius + 1
+
+    radius = max(int(round(node_radius)), 0)
+    width = min(int(math.ceil((max_x - min_x) * scale + margin * 2)), max_size)
+    height = min(int(math.ceil((max_y - min_y) * scale + margin * 2)), max_size)
+    width = max(width, 1)
+    height = max(height, 1)
+
+    def to_px(x, y):
+        return int(round((x - min_x) * scale + margin)), int(round((y - min_y) * scale + margin))
+
+    canvas = bytearray(width * height)
+
+    for _, x, y, parent_x, parent_y in iter_render_items(tree):
+        if parent_x is None:
+            continue
+        x0, y0 = to_px(parent_x, parent_y)
+        x1, y1 = to_px(x, y)
+        draw_line(canvas, width, height, x0, y0, x1, y1, EDGE)
+
+    for _, x, y, _, _ in iter_render_items(tree):
+        cx, cy = to_px(x, y)
+        fill_circle(canvas, width, height, cx, cy, radius, NODE)
+
+    fp.write(b'\x89PNG\r\n\x1a\n')
+    # 8bitのパレット形式
+    write_png_chunk(fp, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0))
+    write_png_chunk(fp, b'PLTE', hex_to_rgb(BACKGROUND_COLOR) + hex_to_rgb(EDGE_COLOR) + hex_to_rgb(NODE_COLOR))
+
+    # 行の先頭にフィルタの種類(0)を付けて、一定の行数ずつ圧縮して書き出す
+    compressor = zlib.compressobj()
+    for start in range(0, height, PNG_ROWS_PER_CHUNK):
+        rows = bytearray()
+        for y in range(start, min(start + PNG_ROWS_PER_CHUNK, height)):
+            rows.append(0)
+            rows += canvas[y * width:(y + 1) * width]
+        data = compressor.compress(bytes(rows))
+        if data:
+            write_png_chunk(fp, b'IDAT', data)
+    write_png_chunk(fp, b'IDAT', compressor.flush())
+    write_png_chunk(fp, b'IEND', b'')
+
+
+def save_image(tree, filename, scale: float = SCALE, node_radius: float = NODE_RADIUS,
+               font_size: float = FONT_SIZE, with_labels: bool = True, max_size: int = MAX_IMAGE_SIZE):
+    """拡張子が.svgならSVG、それ以外はPNGで書き出す
+
+    どちらの形式でも同じ引数で呼び出せるように、使わない引数は無視する。
+    PNGではfont_sizeとwith_labels、SVGではmax_sizeを使わない。
+    """
+    if str(filename).lower().endswith('.svg'):
+        save_svg(tree, filename, scale=scale, node_radius=node_radius,
+                 font_size=font_size, with_labels=with_labels)
+    else:
+        save_png(tree, filename, scale=scale, node_radius=node_radius, max_size=max_size)
+
+
+if __name__ == '__main__':
+
+    from tree_json import load_compact_tree
+    from compact_tree import calc_tree_position_compact
+
+    def main():
+        if len(sys.argv) != 3:
+            print(f"usage: {sys.argv[0]} tree.json output.svg|output.png")
+            return 1
+        tree = load_compact_tree(sys.argv[1])
+        calc_tree_position_compact(tree)
+        save_image(tree, sys.argv[2])
+        return 0
+
+    sys.exit(main())